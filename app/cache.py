@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response as HTTPResponse
+
+from kitchenLibrary.app.util import Response
+
+# Most entries kept by the in-process catalog cache
+CATALOG_CACHE_SIZE = int(os.getenv('CATALOG_CACHE_SIZE', '1024'))
+# Seconds an entry lives. Bounds how stale a worker can be after another worker changes the catalog.
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '60'))
+
+
+class CacheBackend:
+    """
+    Where cached response bodies and the catalog version live. Subclass it to share a cache between workers.
+
+    Keys are prefixed with the catalog version, so a shared backend has to share the version too (e.g. a counter
+    key incremented atomically) for one worker's catalog change to invalidate every worker's entries.
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def get_version(self) -> int:
+        raise NotImplementedError
+
+    def incr_version(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """
+    In-process LRU cache whose entries expire after ttl seconds
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[str, Tuple[float, bytes]]' = OrderedDict()
+        self.version = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_version(self) -> int:
+        return self.version
+
+    def incr_version(self) -> None:
+        with self.lock:
+            self.version += 1
+
+
+catalog_cache: CacheBackend = MemoryCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+
+def set_catalog_cache(backend: CacheBackend) -> None:
+    """
+    Swaps the backend used for catalog responses and the catalog version
+    """
+    global catalog_cache
+    catalog_cache = backend
+
+
+def catalog_version() -> int:
+    """
+    Counter that changes whenever recipes or ingredients are added or deleted, kept by the cache backend
+    """
+    return catalog_cache.get_version()
+
+
+def bump_catalog_version() -> None:
+    """
+    Marks every cached catalog response as out of date. Call after committing a catalog change.
+    """
+    catalog_cache.incr_version()
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = {tag.strip() for tag in if_none_match.split(',')}
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+async def cached_response(request: Request, key: str, build: Callable[[], Awaitable[Response]]) -> HTTPResponse:
+    """
+    Serves a catalog response from the cache, building and storing it on a miss.
+
+    Successful responses carry a strong ETag of their body and a matching If-None-Match gets a 304.
+
+    Arguments:
+        request: incoming request, checked for If-None-Match
+        key: what identifies the response within the current catalog version
+        build: makes the response on a miss
+    """
+    versioned_key = f'catalog:{catalog_version()}:{key}'
+    body = catalog_cache.get(versioned_key)
+    if body is None:
+        response = await build()
+        body = response.json().encode('utf-8')
+        if not response.success:
+            return HTTPResponse(body, media_type='application/json')
+        catalog_cache.set(versioned_key, body)
+
+    etag = _etag(body)
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _matches(request.headers.get('if-none-match'), etag):
+        return HTTPResponse(status_code=304, headers=headers)
+    return HTTPResponse(body, media_type='application/json', headers=headers)
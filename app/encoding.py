@@ -0,0 +1,100 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Union
+
+from starlette.requests import Request
+from starlette.responses import Response as HTTPResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library, just slower
+    orjson = None
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# Lines encoded into each chunk sent, so a sync source doesn't hop to the threadpool for every row
+NDJSON_BATCH_SIZE = 100
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encodes plain dicts, lists and scalars as compact JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(HTTPResponse):
+    """
+    JSON response for content that is already plain data, so it skips validation against the response model
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def fast_response(success: bool, message: Optional[str] = '', data: Any = None,
+                  next_cursor: Optional[Any] = None) -> FastJSONResponse:
+    """
+    Same body as util.Response, built from plain data instead of models.
+
+    Use it for large results where building and re-validating a model for every row costs more than the query.
+    """
+    return FastJSONResponse({'success': success, 'message': message, 'data': data, 'next_cursor': next_cursor})
+
+
+def wants_ndjson(request: Request) -> bool:
+    """
+    Checks if the client asked for newline delimited JSON
+    """
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def _ndjson_chunks(rows: Iterable[Any]) -> Iterator[bytes]:
+    lines = []
+    for row in rows:
+        lines.append(dumps(row))
+        if len(lines) == NDJSON_BATCH_SIZE:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+async def _async_ndjson_chunks(rows: AsyncIterable[Any]) -> AsyncIterator[bytes]:
+    lines = []
+    async for row in rows:
+        lines.append(dumps(row))
+        if len(lines) == NDJSON_BATCH_SIZE:
+            yield b'\n'.join(lines) + b'\n'
+            lines = []
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+class NDJSONResponse(StreamingResponse):
+    """
+    Sends each row as one line of JSON while the rows are still being read.
+
+    Rows can come from a sync iterator, which is read in the threadpool, or an async one. Under Mangum the body is
+    collected and sent at once, since Lambda can only return whole responses.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+
+    def __init__(self, rows: Union[Iterable[Any], AsyncIterable[Any]], status_code: int = 200,
+                 headers: Optional[dict] = None):
+        if hasattr(rows, '__aiter__'):
+            content = _async_ndjson_chunks(rows)
+        else:
+            content = _ndjson_chunks(rows)
+        super().__init__(content, status_code=status_code, headers=headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if 'aws.event' not in scope:
+            await super().__call__(scope, receive, send)
+            return
+        body = b''.join([chunk async for chunk in self.body_iterator])
+        buffered = HTTPResponse(body, status_code=self.status_code, media_type=self.media_type,
+                                background=self.background)
+        await buffered(scope, receive, send)
@@ -2,7 +2,10 @@ from fastapi import FastAPI
 from mangum import Mangum
 from starlette.middleware.cors import CORSMiddleware
 
-from kitchenLibrary.app.routers import kitchen, users, recipes, ingredients
+from kitchenLibrary.app.metrics import MetricsMiddleware
+from kitchenLibrary.app.models import replica_urls
+from kitchenLibrary.app.replicas import ReadAfterWriteMiddleware
+from kitchenLibrary.app.routers import kitchen, users, recipes, ingredients, metrics
 
 app = FastAPI()
 
@@ -17,10 +20,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+if replica_urls():
+    app.add_middleware(ReadAfterWriteMiddleware)
 
 app.include_router(users.router)
 app.include_router(recipes.router)
 app.include_router(kitchen.router)
 app.include_router(ingredients.router)
+app.include_router(metrics.router)
 
 handler = Mangum(app=app)
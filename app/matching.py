@@ -0,0 +1,448 @@
+import heapq
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+
+# Seconds before an index is reloaded from the database so other workers' writes show up. 0 never reloads.
+INDEX_MAX_AGE = float(os.getenv('RECIPE_INDEX_MAX_AGE', '300'))
+# Most users whose cookable recipes are kept in memory
+COOKABLE_CACHE_USERS = int(os.getenv('COOKABLE_CACHE_USERS', '10000'))
+
+
+class CatalogIndex:
+    """
+    Base for in-memory indexes over the catalog that are loaded lazily and reloaded once they get old.
+
+    Subclasses build a fresh copy from the database in _build and take its structures over in _swap. Incremental
+    changes go through _apply, so one made while a load reads the database is applied again after the swap, as the
+    load may have read the database before it was committed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.RLock()  # Held for a whole load so only one runs at a time
+        self.loaded_at: Optional[float] = None
+        self.changes: Optional[List[Tuple[Callable[..., None], tuple]]] = None  # made during the load running
+
+    def is_stale(self) -> bool:
+        """
+        If the index needs to be (re)loaded from the database
+        """
+        if self.loaded_at is None:
+            return True
+        return INDEX_MAX_AGE > 0 and time.monotonic() - self.loaded_at > INDEX_MAX_AGE
+
+    def load_if_stale(self, db: Session) -> None:
+        """
+        Loads the index if it needs it, once however many threads find it stale at the same time.
+
+        Before the first load every thread waits for it. After that the old index keeps answering while one
+        thread reloads it.
+        """
+        if not self.is_stale():
+            return
+        if not self.load_lock.acquire(blocking=self.loaded_at is None):
+            return
+        try:
+            if self.is_stale():
+                self.load(db)
+        finally:
+            self.load_lock.release()
+
+    def load(self, db: Session) -> None:
+        """
+        Rebuilds the whole index from the database
+        """
+        with self.load_lock:
+            with self.lock:
+                self.changes = []
+            try:
+                fresh = self._build(db)
+            except Exception:
+                with self.lock:
+                    self.changes = None
+                raise
+            with self.lock:
+                self._swap(fresh)
+                changes, self.changes = self.changes, None
+                for change, args in changes:
+                    change(*args)
+                self.loaded_at = time.monotonic()
+
+    def _build(self, db: Session) -> 'CatalogIndex':
+        raise NotImplementedError
+
+    def _swap(self, fresh: 'CatalogIndex') -> None:
+        raise NotImplementedError
+
+    def _apply(self, change: Callable[..., None], *args) -> None:
+        """
+        Applies an incremental change once the index is loaded, keeping it for the load running if there is one.
+        The caller holds lock and the change must be safe to apply twice.
+        """
+        if self.changes is not None:
+            self.changes.append((change, args))
+        if self.loaded_at is not None:
+            change(*args)
+
+
+class RecipeIndex(CatalogIndex):
+    """
+    In memory ingredient -> recipes inverted index.
+
+    Each recipe keeps the set of its required and optional ingredient ids, so checking a pantry against the whole
+    catalog only touches the postings of the ingredients in the pantry.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ingredient_ids: Dict[str, int] = {}
+        self.ingredient_names: Dict[int, str] = {}
+        self.required_postings: Dict[int, Set[int]] = defaultdict(set)  # ingredient id -> recipe ids requiring it
+        self.optional_postings: Dict[int, Set[int]] = defaultdict(set)  # ingredient id -> recipe ids it is optional in
+        self.required: Dict[int, Set[int]] = {}  # recipe id -> required ingredient ids
+        self.optional: Dict[int, Set[int]] = {}  # recipe id -> optional ingredient ids
+
+    def _build(self, db: Session) -> 'RecipeIndex':
+        """
+        A new index from the recipe_ingredients table
+        """
+        rows = db.query(RecipeIngredient.recipe_id,
+                        RecipeIngredient.ingredient_id,
+                        RecipeIngredient.required,
+                        Ingredient.name) \
+            .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id) \
+            .all()
+
+        fresh = RecipeIndex()
+        for recipe_id, ingredient_id, required, name in rows:
+            fresh._link(recipe_id, ingredient_id, name, required)
+        return fresh
+
+    def _swap(self, fresh: 'RecipeIndex') -> None:
+        self.ingredient_ids = fresh.ingredient_ids
+        self.ingredient_names = fresh.ingredient_names
+        self.required_postings = fresh.required_postings
+        self.optional_postings = fresh.optional_postings
+        self.required = fresh.required
+        self.optional = fresh.optional
+
+    def _link(self, recipe_id: int, ingredient_id: int, name: str, required: bool) -> None:
+        self.ingredient_ids[name] = ingredient_id
+        self.ingredient_names[ingredient_id] = name
+        self.required.setdefault(recipe_id, set())
+        self.optional.setdefault(recipe_id, set())
+        if required:
+            self.required[recipe_id].add(ingredient_id)
+            self.required_postings[ingredient_id].add(recipe_id)
+        else:
+            self.optional[recipe_id].add(ingredient_id)
+            self.optional_postings[ingredient_id].add(recipe_id)
+
+    def add_recipe(self, recipe_id: int, ingredients: Iterable[Tuple[int, str, bool]]) -> None:
+        """
+        Adds a committed recipe.
+
+        Arguments:
+            recipe_id: id of the new recipe
+            ingredients: (ingredient id, ingredient name, required) for everything in the recipe
+        """
+        with self.lock:
+            self._apply(self._add_recipe, recipe_id, list(ingredients))
+
+    def _add_recipe(self, recipe_id: int, ingredients: List[Tuple[int, str, bool]]) -> None:
+        self.required.setdefault(recipe_id, set())
+        self.optional.setdefault(recipe_id, set())
+        for ingredient_id, name, required in ingredients:
+            self._link(recipe_id, ingredient_id, name, required)
+
+    def remove_recipe(self, recipe_id: int) -> None:
+        """
+        Removes a deleted recipe
+        """
+        with self.lock:
+            self._apply(self._remove_recipe, recipe_id)
+
+    def _remove_recipe(self, recipe_id: int) -> None:
+        for ingredient_id in self.required.pop(recipe_id, ()):
+            self.required_postings[ingredient_id].discard(recipe_id)
+        for ingredient_id in self.optional.pop(recipe_id, ()):
+            self.optional_postings[ingredient_id].discard(recipe_id)
+
+    def remove_ingredients(self, ingredient_ids: Iterable[int]) -> None:
+        """
+        Forgets ingredients that were deleted from the database
+        """
+        with self.lock:
+            self._apply(self._remove_ingredients, list(ingredient_ids))
+
+    def _remove_ingredients(self, ingredient_ids: List[int]) -> None:
+        for ingredient_id in ingredient_ids:
+            name = self.ingredient_names.pop(ingredient_id, None)
+            if name is not None:
+                self.ingredient_ids.pop(name, None)
+            self.required_postings.pop(ingredient_id, None)
+            self.optional_postings.pop(ingredient_id, None)
+
+    def recipes_using_all(self, names: Iterable[str]) -> Set[int]:
+        """
+        Ids of the recipes that use every one of the named ingredients, required or optional
+        """
+        with self.lock:
+            found = None
+            for name in set(names):
+                ingredient_id = self.ingredient_ids.get(name)
+                if ingredient_id is None:
+                    return set()
+                recipes = self.required_postings.get(ingredient_id, set()) | \
+                    self.optional_postings.get(ingredient_id, set())
+                found = recipes if found is None else found & recipes
+                if not found:
+                    return set()
+            return found or set()
+
+    def pantry_ids(self, names: Iterable[str]) -> Set[int]:
+        """
+        Ids of the known ingredients in a list of names
+        """
+        return {self.ingredient_ids[name] for name in names if name in self.ingredient_ids}
+
+    def match_all(self, names: Iterable[str]) -> List[int]:
+        """
+        Finds every recipe that can be made with the given ingredients.
+
+        A recipe can be made when all of its required ingredients are in the pantry. Recipes without required
+        ingredients need at least one of their optional ingredients.
+
+        Returns:
+            Sorted ids of the recipes that can be made
+        """
+        with self.lock:
+            pantry = self.pantry_ids(names)
+            found = Counter()
+            for ingredient_id in pantry:
+                found.update(self.required_postings.get(ingredient_id, ()))
+            makeable = {recipe_id for recipe_id, count in found.items() if count == len(self.required[recipe_id])}
+
+            for ingredient_id in pantry:
+                makeable.update(recipe_id for recipe_id in self.optional_postings.get(ingredient_id, ())
+                                if not self.required[recipe_id])
+        return sorted(makeable)
+
+    def match_near(self, names: Iterable[str], max_missing: int, limit: int) -> List[Tuple[int, List[str], float]]:
+        """
+        Ranks the recipes that are missing at most max_missing required ingredients.
+
+        Pantry hits for every recipe are counted in one pass over the postings, then a heap keeps only the best
+        limit recipes: fewest missing required ingredients first, then the most optional ingredients covered.
+        Only recipes sharing at least one ingredient with the pantry are considered.
+
+        Returns:
+            (recipe id, names of the missing required ingredients, fraction of optional ingredients in the pantry)
+        """
+        with self.lock:
+            pantry = self.pantry_ids(names)
+            found = Counter()
+            optional_found = Counter()
+            for ingredient_id in pantry:
+                found.update(self.required_postings.get(ingredient_id, ()))
+                optional_found.update(self.optional_postings.get(ingredient_id, ()))
+
+            def ranked():
+                for recipe_id in found.keys() | optional_found.keys():
+                    missing = len(self.required[recipe_id]) - found[recipe_id]
+                    if missing <= max_missing:
+                        optional_count = len(self.optional[recipe_id])
+                        coverage = optional_found[recipe_id] / optional_count if optional_count else 1.0
+                        yield missing, -coverage, recipe_id
+
+            best = heapq.nsmallest(limit, ranked())
+            return [(recipe_id,
+                     sorted(self.ingredient_names[i] for i in self.required[recipe_id] - pantry),
+                     -coverage)
+                    for _, coverage, recipe_id in best]
+
+
+recipe_index = RecipeIndex()
+
+
+def get_recipe_index(db: Session) -> RecipeIndex:
+    """
+    Gets the process wide recipe index, loading it first if needed
+    """
+    recipe_index.load_if_stale(db)
+    return recipe_index
+
+
+class PantryMatches:
+    """
+    A user's pantry and how much of each recipe sharing an ingredient with it is covered
+    """
+    __slots__ = ('pantry', 'required_found', 'optional_found', 'cookable')
+
+    def __init__(self, pantry: Set[int]):
+        self.pantry = pantry
+        self.required_found: Dict[int, int] = {}  # recipe id -> its required ingredients in the pantry
+        self.optional_found: Dict[int, int] = {}  # recipe id without required ingredients -> optional ones in it
+        self.cookable: Set[int] = set()
+
+
+class CookableCache:
+    """
+    The recipes each user can cook right now, kept up to date with deltas instead of matching the whole pantry
+    again on every read.
+
+    Pantry edits only touch the postings of the ingredients that changed and recipe changes only recount that
+    recipe, so reads cost as much as the result. Everything is dropped when the recipe index reloads, which also
+    bounds how long other workers' kitchen edits take to show up.
+    """
+
+    def __init__(self, index: RecipeIndex, max_users: int):
+        self.index = index
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.users: 'OrderedDict[int, PantryMatches]' = OrderedDict()
+        self.index_loaded_at: Optional[float] = None
+        self.writes = 0  # Pantry edits so far, a pantry read before one of them is not stored
+
+    def _check_index(self) -> None:
+        if self.index.loaded_at != self.index_loaded_at:
+            self.users.clear()
+            self.index_loaded_at = self.index.loaded_at
+
+    def _count(self, matches: PantryMatches, ingredient_id: int, step: int) -> None:
+        """
+        Adds (step 1) or removes (step -1) one pantry ingredient's hits
+        """
+        index = self.index
+        for recipe_id in index.required_postings.get(ingredient_id, ()):
+            found = matches.required_found.get(recipe_id, 0) + step
+            if found:
+                matches.required_found[recipe_id] = found
+            else:
+                del matches.required_found[recipe_id]
+            if found == len(index.required[recipe_id]):
+                matches.cookable.add(recipe_id)
+            else:
+                matches.cookable.discard(recipe_id)
+        for recipe_id in index.optional_postings.get(ingredient_id, ()):
+            if index.required[recipe_id]:
+                continue
+            found = matches.optional_found.get(recipe_id, 0) + step
+            if found:
+                matches.optional_found[recipe_id] = found
+                matches.cookable.add(recipe_id)
+            else:
+                del matches.optional_found[recipe_id]
+                matches.cookable.discard(recipe_id)
+
+    def _recount(self, matches: PantryMatches, recipe_id: int) -> None:
+        """
+        Counts one recipe from scratch, or forgets it if it is no longer in the index
+        """
+        required = self.index.required.get(recipe_id)
+        if required is None:
+            matches.required_found.pop(recipe_id, None)
+            matches.optional_found.pop(recipe_id, None)
+            matches.cookable.discard(recipe_id)
+            return
+
+        found = len(required & matches.pantry)
+        optional_found = 0 if required else len(self.index.optional[recipe_id] & matches.pantry)
+        for counts, count in ((matches.required_found, found), (matches.optional_found, optional_found)):
+            if count:
+                counts[recipe_id] = count
+            else:
+                counts.pop(recipe_id, None)
+        if (required and found == len(required)) or optional_found:
+            matches.cookable.add(recipe_id)
+        else:
+            matches.cookable.discard(recipe_id)
+
+    def get(self, user_id: int) -> Optional[List[int]]:
+        """
+        Sorted ids of the recipes a user can cook, None if their pantry isn't cached
+        """
+        with self.lock:
+            self._check_index()
+            matches = self.users.get(user_id)
+            if matches is None:
+                return None
+            self.users.move_to_end(user_id)
+            cookable = list(matches.cookable)
+        return sorted(cookable)
+
+    def store(self, user_id: int, pantry: Set[int], writes: int) -> List[int]:
+        """
+        Matches a pantry read from the database and keeps the result.
+
+        Arguments:
+            user_id: whose pantry it is
+            pantry: ingredient ids in their kitchen
+            writes: value of writes from before the pantry was read. If a pantry was edited since, the result is
+                returned but not kept, as the edit may be missing from it.
+
+        Returns:
+            Sorted ids of the recipes that can be cooked
+        """
+        matches = PantryMatches(set(pantry))
+        with self.lock:
+            self._check_index()
+            with self.index.lock:
+                for ingredient_id in matches.pantry:
+                    self._count(matches, ingredient_id, 1)
+            if writes == self.writes:
+                self.users[user_id] = matches
+                self.users.move_to_end(user_id)
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            cookable = list(matches.cookable)
+        return sorted(cookable)
+
+    def update_pantry(self, user_id: int, added: Iterable[int], removed: Iterable[int]) -> None:
+        """
+        Applies committed kitchen changes. Ids already in or already missing from the pantry are skipped.
+        """
+        with self.lock:
+            self.writes += 1
+            self._check_index()
+            matches = self.users.get(user_id)
+            if matches is None:
+                return
+            with self.index.lock:
+                for ingredient_id in set(removed) & matches.pantry:
+                    matches.pantry.discard(ingredient_id)
+                    self._count(matches, ingredient_id, -1)
+                for ingredient_id in set(added) - matches.pantry:
+                    matches.pantry.add(ingredient_id)
+                    self._count(matches, ingredient_id, 1)
+
+    def forget_user(self, user_id: int) -> None:
+        """
+        Drops a deleted user
+        """
+        with self.lock:
+            self.writes += 1
+            self.users.pop(user_id, None)
+
+    def recipes_changed(self, recipe_ids: Iterable[int]) -> None:
+        """
+        Recounts recipes for every cached user once the recipe index has their adds and deletes
+        """
+        recipe_ids = list(recipe_ids)
+        with self.lock:
+            self._check_index()
+            with self.index.lock:
+                for matches in self.users.values():
+                    for recipe_id in recipe_ids:
+                        self._recount(matches, recipe_id)
+
+
+cookable_cache = CookableCache(recipe_index, COOKABLE_CACHE_USERS)
@@ -0,0 +1,194 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Upper bounds in seconds of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """
+    Database work done while handling one request
+    """
+    __slots__ = ('statements', 'db_seconds', 'rows')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """
+    Stats of the request being handled, None outside of a request
+    """
+    return _current.get()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    started = context.connection.info.get('metrics_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    # Buffering drivers like PyMySQL report rows fetched here, SQLite only reports rows changed
+    if cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+
+
+class EndpointMetrics:
+    """
+    Totals for one method, route and status
+    """
+    __slots__ = ('requests', 'seconds', 'db_seconds', 'statements', 'rows', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)  # Last one is +Inf
+
+
+class MetricsRegistry:
+    """
+    Request totals of this process, labelled by route
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints: Dict[Tuple[str, str, int], EndpointMetrics] = {}
+
+    def record(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        with self.lock:
+            metrics = self.endpoints.get((method, route, status))
+            if metrics is None:
+                metrics = self.endpoints[(method, route, status)] = EndpointMetrics()
+            metrics.requests += 1
+            metrics.seconds += seconds
+            metrics.db_seconds += stats.db_seconds
+            metrics.statements += stats.statements
+            metrics.rows += stats.rows
+            metrics.buckets[bisect_left(DURATION_BUCKETS, seconds)] += 1
+
+    def render(self, gauges: Dict[str, Dict[str, int]]) -> str:
+        """
+        Everything recorded in the Prometheus text format
+
+        Arguments:
+            gauges: extra values to report, as metric name -> label value -> value
+        """
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            lines: List[str] = []
+
+            def counter(name: str, help_text: str, attribute: str) -> None:
+                lines.extend((f'# HELP {name} {help_text}', f'# TYPE {name} counter'))
+                for (method, route, status), metrics in endpoints:
+                    lines.append(f'{name}{{method="{method}",route="{route}",status="{status}"}} '
+                                 f'{getattr(metrics, attribute)}')
+
+            counter('kitchen_requests_total', 'Requests handled.', 'requests')
+            counter('kitchen_db_seconds_total', 'Time spent running SQL statements.', 'db_seconds')
+            counter('kitchen_db_statements_total', 'SQL statements run.', 'statements')
+            counter('kitchen_db_rows_total', 'Rows fetched or changed by SQL statements.', 'rows')
+
+            name = 'kitchen_request_duration_seconds'
+            lines.extend((f'# HELP {name} Time from receiving a request to sending the whole response.',
+                          f'# TYPE {name} histogram'))
+            for (method, route, status), metrics in endpoints:
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                total = 0
+                for bound, count in zip(DURATION_BUCKETS + ('+Inf',), metrics.buckets):
+                    total += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{{labels}}} {metrics.seconds}')
+                lines.append(f'{name}_count{{{labels}}} {metrics.requests}')
+
+        for name, values in gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{{{label}}} {value}' for label, value in values.items())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _server_timing(seconds: float, stats: RequestStats) -> str:
+    return (f'app;dur={seconds * 1000:.1f}, '
+            f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} statements, {stats.rows} rows"')
+
+
+class MetricsMiddleware:
+    """
+    Times every request, counts its SQL statements and rows, and records them by route.
+
+    The numbers so far are sent back in a Server-Timing header. Streamed responses send their headers before
+    the body is read, so only the totals in the registry include the whole stream.
+    """
+
+    def __init__(self, app: ASGIApp, routes: Sequence):
+        self.app = app
+        self.routes = routes
+
+    def _route(self, scope: Scope) -> str:
+        """
+        Path template of the route that handled a request, so ids and names in paths don't become labels
+        """
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                timing = _server_timing(time.perf_counter() - start, stats)
+                headers.append((b'server-timing', timing.encode('latin-1')))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            registry.record(scope['method'], self._route(scope), status, time.perf_counter() - start, stats)
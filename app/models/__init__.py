@@ -1,24 +1,180 @@
 import os
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, List
 
 from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import configure_mappers
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
+from sqlalchemy.pool import NullPool, StaticPool
 
 configure_mappers()
 
 
+def _env_flag(name: str, default: bool) -> bool:
+    """
+    Reads a boolean setting from the environment
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Drivers the async engine uses for each sync driver
+ASYNC_DRIVERS = {'mysql': 'mysql+aiomysql', 'mysql+pymysql': 'mysql+aiomysql',
+                 'sqlite': 'sqlite+aiosqlite', 'sqlite+pysqlite': 'sqlite+aiosqlite'}
+# Where an in-memory SQLite database lives, named so the sync and async engines open the same one
+SHARED_MEMORY_DATABASE = 'file:kitchenlibrary'
+
+
+def database_url() -> URL:
+    """
+    Where the database is.
+
+    DATABASE_URL takes any SQLAlchemy URL, like sqlite:///catalog.db or sqlite:// for a database in memory. Without
+    it the MySQL database is built from DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and DB_NAME.
+    """
+    url = os.getenv('DATABASE_URL')
+    if url:
+        url = make_url(url)
+        if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+            url = url.set(database=SHARED_MEMORY_DATABASE, query={'mode': 'memory', 'cache': 'shared', 'uri': 'true'})
+        return url
+    return URL.create('mysql+pymysql',
+                      username=os.getenv('DB_USER', 'admin'),
+                      password=os.getenv('DB_PASSWORD'),
+                      host=os.getenv('DB_HOST', 'recipes.cbrohh83x5d7.us-east-2.rds.amazonaws.com'),
+                      port=int(os.getenv('DB_PORT', '3306')),
+                      database=os.getenv('DB_NAME', 'recipes'))
+
+
+def replica_urls() -> List[URL]:
+    """
+    Read replicas of the database from DATABASE_REPLICA_URLS, comma separated URLs like DATABASE_URL takes
+    """
+    return [make_url(url.strip()) for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+
+
+def _async_url(url: URL) -> URL:
+    if url.drivername not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver known for {url.drivername}')
+    return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+
+
+def _engine_options(url: URL) -> dict:
+    """
+    Engine settings read from DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE and DB_ECHO
+    """
+    if url.get_backend_name() == 'sqlite':
+        # Connections are used from the threadpool. A database in memory lives as long as the sync engine's one
+        # connection, async connections to it are opened per use since aiosqlite keeps a thread for each.
+        options = dict(echo=_env_flag('DB_ECHO', False), connect_args={'check_same_thread': False})
+        if url.database == SHARED_MEMORY_DATABASE:
+            options['poolclass'] = NullPool if url.get_driver_name() == 'aiosqlite' else StaticPool
+        return options
+    return dict(echo=_env_flag('DB_ECHO', False),
+                pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+                max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+                pool_pre_ping=_env_flag('DB_POOL_PRE_PING', True),
+                pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '3600')))
+
+
+@lru_cache(maxsize=None)
 def get_engine() -> Engine:
-    endpoint = 'recipes.cbrohh83x5d7.us-east-2.rds.amazonaws.com'
-    port = 3306
-    username = 'admin'
-    password = os.getenv('DB_PASSWORD')
+    """
+    Builds the engine once per process so warm containers and workers reuse its connection pool
+    """
+    url = database_url()
+    return create_engine(url, **_engine_options(url))
+
+
+@lru_cache(maxsize=None)
+def get_async_engine() -> AsyncEngine:
+    """
+    Engine for async route handlers on the same database, with its own pool configured like get_engine()
+    """
+    url = _async_url(database_url())
+    if url.database == SHARED_MEMORY_DATABASE:
+        get_engine().connect().close()  # Opens the connection that keeps the database alive
+    return create_async_engine(url, **_engine_options(url))
+
 
-    engine = create_engine(f'mysql+pymysql://{username}:{password}@{endpoint}:{port}/recipes', echo=True)
-    return engine
+@lru_cache(maxsize=None)
+def get_replica_engines() -> List[Engine]:
+    """
+    An engine per read replica, each with its own pool configured like get_engine()
+    """
+    return [create_engine(url, **_engine_options(url)) for url in replica_urls()]
+
+
+@lru_cache(maxsize=None)
+def get_async_replica_engines() -> List[AsyncEngine]:
+    """
+    get_replica_engines() for async route handlers
+    """
+    return [create_async_engine(url, **_engine_options(url)) for url in map(_async_url, replica_urls())]
+
+
+@lru_cache(maxsize=None)
+def get_replica_session_factories() -> List[sessionmaker]:
+    """
+    Session factory per read replica, in the order of DATABASE_REPLICA_URLS
+    """
+    return [sessionmaker(bind=engine) for engine in get_replica_engines()]
+
+
+@lru_cache(maxsize=None)
+def get_async_replica_session_factories() -> List[sessionmaker]:
+    """
+    AsyncSession factory per read replica, in the order of DATABASE_REPLICA_URLS
+    """
+    return [sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+            for engine in get_async_replica_engines()]
+
+
+@lru_cache(maxsize=None)
+def get_session_factory() -> sessionmaker:
+    """
+    Session factory bound to the process wide engine
+    """
+    return sessionmaker(bind=get_engine())
+
+
+@lru_cache(maxsize=None)
+def get_async_session_factory() -> sessionmaker:
+    """
+    AsyncSession factory bound to the process wide async engine.
+
+    Objects stay loaded after commit, since touching an expired attribute would need IO outside an await.
+    """
+    return sessionmaker(bind=get_async_engine(), class_=AsyncSession, expire_on_commit=False)
 
 
 def get_session() -> Session:
-    Session = sessionmaker(bind=get_engine())
-    return Session()
+    return get_session_factory()()
+
+
+def get_db() -> Iterator[Session]:
+    """
+    FastAPI dependency that hands a pooled session to a request and returns its connection afterwards.
+
+    Its queries block, so they must stay off the event loop. Plain def handlers get that from FastAPI's threadpool, an
+    async def handler using it (like the bulk upload, which reads its body on the loop) has to pass the work that
+    touches the session to run_in_threadpool.
+    """
+    db = get_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency for async def handlers, which must await all of their queries
+    """
+    async with get_async_session_factory()() as db:
+        yield db
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 
 from kitchenLibrary.app.models.meta import Base
 
@@ -12,5 +12,8 @@ class Kitchen(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     ingredient_id = Column(Integer, ForeignKey('ingredients.id'), nullable=False)
 
+    # A user has an ingredient at most once, lets adding be an idempotent INSERT IGNORE
+    __table_args__ = (Index('uq_kitchen_user_ingredient', 'user_id', 'ingredient_id', unique=True),)
+
     def __repr__(self):
         return f'<Kitchen user={self.user_id} ingredient={self.ingredient_id}>'
@@ -0,0 +1,78 @@
+from typing import Callable, List, Set, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, VARCHAR, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from kitchenLibrary.app.models.kitchen import Kitchen
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.models.user import User
+
+# Kept out of the models' metadata so it is only managed here
+schema_version = Table('schema_version', MetaData(),
+                       Column('version', Integer, primary_key=True),
+                       Column('description', VARCHAR(length=256), nullable=False))
+
+
+def _create_missing_indexes(conn: Connection, table: Table) -> None:
+    """
+    Creates the indexes declared on a table that the database doesn't have yet
+    """
+    existing = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(conn)
+
+
+def _recipe_ingredient_indexes(conn: Connection) -> None:
+    _create_missing_indexes(conn, RecipeIngredient.__table__)
+
+
+def _unique_kitchen_ingredients(conn: Connection) -> None:
+    # Keep the first row of any duplicated (user, ingredient) so the unique index can be built.
+    # The derived table lets MySQL delete from the table it is reading.
+    conn.execute(text('DELETE FROM kitchen WHERE id NOT IN '
+                      '(SELECT id FROM (SELECT MIN(id) AS id FROM kitchen GROUP BY user_id, ingredient_id) AS keep)'))
+    _create_missing_indexes(conn, Kitchen.__table__)
+
+
+def _user_tokens_revoked_at(conn: Connection) -> None:
+    if 'tokens_revoked_at' not in {column['name'] for column in inspect(conn).get_columns(User.__tablename__)}:
+        conn.execute(text('ALTER TABLE users ADD COLUMN tokens_revoked_at BIGINT NOT NULL DEFAULT 0'))
+
+
+# (version, description, upgrade) in the order they are applied. Never change or reorder one that has shipped.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, 'Composite indexes on recipe_ingredients', _recipe_ingredient_indexes),
+    (2, 'Unique (user_id, ingredient_id) on kitchen', _unique_kitchen_ingredients),
+    (3, 'tokens_revoked_at on users', _user_tokens_revoked_at),
+]
+
+
+def applied_versions(engine: Engine) -> Set[int]:
+    """
+    Versions already applied to a database
+    """
+    schema_version.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {version for version, in conn.execute(select(schema_version.c.version))}
+
+
+def upgrade(engine: Engine) -> List[int]:
+    """
+    Applies every migration the database doesn't have yet, each in its own transaction.
+
+    Migrations check what already exists, so running them after create_all on a new database only records them.
+
+    Returns:
+        Versions that were applied
+    """
+    done = applied_versions(engine)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(schema_version.insert().values(version=version, description=description))
+        applied.append(version)
+    return applied
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, ForeignKey, Float, Boolean
+from sqlalchemy import Column, Integer, Text, ForeignKey, Float, Boolean, Index
 
 from kitchenLibrary.app.models.meta import Base
 
@@ -15,5 +15,11 @@ class RecipeIngredient(Base):
     unit = Column(Text)
     required = Column(Boolean, nullable=False)  # 0 means optional, 1 is required
 
+    # Covering indexes for joining ingredient -> recipes (matching) and recipe -> ingredients (loading recipes)
+    __table_args__ = (
+        Index('ix_recipe_ingredients_ingredient_recipe_required', 'ingredient_id', 'recipe_id', 'required'),
+        Index('ix_recipe_ingredients_recipe_ingredient', 'recipe_id', 'ingredient_id'),
+    )
+
     def __repr__(self):
         return f'<RecipeIngredient recipe={self.recipe_id} ingredient={self.ingredient_id}>'
@@ -1,8 +1,16 @@
-import bcrypt
-from sqlalchemy import Column, Integer, BINARY, VARCHAR
+from sqlalchemy import BigInteger, Column, Integer, BINARY, SmallInteger, VARCHAR
 from sqlalchemy.dialects.mysql import TINYINT
 
 from kitchenLibrary.app.models.meta import Base
+from kitchenLibrary.app.passwords import check_password_sync, hash_password_sync
+
+
+def permissions_allow(permissions: int, can_write: bool, can_delete: bool, can_change_users: bool) -> bool:
+    """
+    Checks a permissions bitmask
+    """
+    return permissions & (can_write + 2 * can_delete + 4 * can_change_users) == \
+           can_write + 2 * can_delete + 4 * can_change_users
 
 
 class User(Base):
@@ -13,7 +21,10 @@ class User(Base):
     id = Column(Integer, primary_key=True)
     name = Column(VARCHAR(256), nullable=False, unique=True)
     password = Column(BINARY(60), nullable=False)
-    permissions = Column(TINYINT, default=0, nullable=False)  # 0 = read, 1 = write, 2 = delete, 4 = change users
+    # 0 = read, 1 = write, 2 = delete, 4 = change users. TINYINT on MySQL, which other databases don't have.
+    permissions = Column(SmallInteger().with_variant(TINYINT, 'mysql'), default=0, nullable=False)
+    # Time in ms before which the user's access tokens are rejected, shared by every worker
+    tokens_revoked_at = Column(BigInteger, default=0, server_default='0', nullable=False)
 
     def __repr__(self):
         return f'<User name={self.name}>'
@@ -22,17 +33,14 @@ class User(Base):
         """
         Sets a new password by hashing the given password.
         """
-        password_hash = bcrypt.hashpw(str.encode(password), bcrypt.gensalt())
-        self.password = password_hash
+        self.password = hash_password_sync(password)
 
     def check_password(self, password: str) -> bool:
         """
         Returns:
              if a password is correct by comparing to what is in the database
         """
-        if self.password is not None:
-            return bcrypt.checkpw(str.encode(password), self.password)
-        return False
+        return check_password_sync(password, self.password)
 
     def set_permissions(self, can_write: bool, can_delete: bool, can_change_users: bool) -> None:
         """
@@ -49,5 +57,4 @@ class User(Base):
         """
         Checks a user's permissions
         """
-        return self.permissions & (can_write + 2 * can_delete + 4 * can_change_users) == \
-               can_write + 2 * can_delete + 4 * can_change_users
+        return permissions_allow(self.permissions, can_write, can_delete, can_change_users)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, TypeVar
+
+# bcrypt cost factor for new hashes. Hashes with a different cost are rehashed on the next sign in.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+# Threads doing bcrypt work. bcrypt releases the GIL so this scales with cores.
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+
+T = TypeVar('T')
+
+
+class HashPool:
+    """
+    Bounded thread pool that runs password hashing off the event loop and counts its work
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """
+        Runs func in the pool and waits for it without blocking the event loop
+        """
+        with self.lock:
+            self.queued += 1
+
+        def job() -> T:
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return func(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        return await asyncio.get_event_loop().run_in_executor(self.executor, job)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Current queue depth and work done by the pool
+        """
+        with self.lock:
+            return {'workers': self.workers,
+                    'queued': self.queued,
+                    'running': self.running,
+                    'completed': self.completed}
+
+
+hash_pool = HashPool(HASH_WORKERS)
+
+
+def hash_password_sync(password: str, rounds: Optional[int] = None) -> bytes:
+    """
+    Hashes a password on the calling thread
+    """
+    import bcrypt  # Imported on first use to keep it out of cold starts
+    return bcrypt.hashpw(str.encode(password), bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
+
+
+def check_password_sync(password: str, password_hash: Optional[bytes]) -> bool:
+    """
+    Checks a password against its hash on the calling thread
+    """
+    if password_hash is None:
+        return False
+    import bcrypt
+    return bcrypt.checkpw(str.encode(password), password_hash)
+
+
+async def hash_password(password: str) -> bytes:
+    """
+    Hashes a password in the hashing pool
+    """
+    return await hash_pool.run(hash_password_sync, password)
+
+
+async def check_password(password: str, password_hash: Optional[bytes]) -> bool:
+    """
+    Checks a password against its hash in the hashing pool
+    """
+    if password_hash is None:
+        return False
+    return await hash_pool.run(check_password_sync, password, password_hash)
+
+
+def needs_rehash(password_hash: bytes) -> bool:
+    """
+    If a hash was made with a different cost factor than BCRYPT_ROUNDS
+    """
+    try:
+        return int(password_hash.split(b'$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
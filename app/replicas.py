@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterator, List
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.session import Session
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from kitchenLibrary.app.models import (get_async_replica_session_factories, get_async_session_factory,
+                                       get_replica_session_factories, get_session, replica_urls)
+
+# Seconds a replica that failed its health check is skipped before it is tried again
+REPLICA_RETRY_SECONDS = float(os.getenv('DB_REPLICA_RETRY_SECONDS', '30'))
+# Seconds after a write that the same client's reads stay on the primary, longer than the replication lag
+READ_AFTER_WRITE_SECONDS = int(os.getenv('DB_READ_AFTER_WRITE_SECONDS', '5'))
+# Set on responses to writes, reads carrying it go to the primary
+PRIMARY_COOKIE = 'kitchen_primary'
+WRITE_METHODS = frozenset(('PUT', 'PATCH', 'DELETE'))
+
+
+class ReplicaHealth:
+    """
+    Which replicas reads can go to. They are taken in turn, and one that failed is skipped for a while.
+    """
+
+    def __init__(self, count: int):
+        self.lock = threading.Lock()
+        self.count = count
+        self.down_until = [0.0] * count
+        self.next = 0
+
+    def order(self) -> List[int]:
+        """
+        Indexes of the replicas to try, starting with the next one in turn and leaving out the ones marked down
+        """
+        with self.lock:
+            start = self.next
+            self.next = (self.next + 1) % self.count if self.count else 0
+            now = time.monotonic()
+            return [i % self.count for i in range(start, start + self.count) if self.down_until[i % self.count] <= now]
+
+    def mark_down(self, replica: int) -> None:
+        with self.lock:
+            self.down_until[replica] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def stats(self) -> Dict[str, int]:
+        """
+        replica label -> 1 if it is in use, 0 if it is being skipped
+        """
+        now = time.monotonic()
+        with self.lock:
+            return {f'replica="{i}"': int(down_until <= now) for i, down_until in enumerate(self.down_until)}
+
+
+@lru_cache(maxsize=None)
+def get_replica_health() -> ReplicaHealth:
+    return ReplicaHealth(len(replica_urls()))
+
+
+def _reads_on_primary(request: Request) -> bool:
+    return PRIMARY_COOKIE in request.cookies
+
+
+def _read_session(request: Request) -> Session:
+    """
+    A session on the first replica that hands out a working connection, the primary if none do or the client
+    wrote something moments ago
+    """
+    if not _reads_on_primary(request):
+        health = get_replica_health()
+        factories = get_replica_session_factories()
+        for replica in health.order():
+            db = factories[replica]()
+            try:
+                db.connection()  # Checks a connection out, pinging it if the pool pings
+                return db
+            except DBAPIError:
+                db.close()
+                health.mark_down(replica)
+    return get_session()
+
+
+async def _async_read_session(request: Request) -> AsyncSession:
+    """
+    _read_session for async handlers
+    """
+    if not _reads_on_primary(request):
+        health = get_replica_health()
+        factories = get_async_replica_session_factories()
+        for replica in health.order():
+            db = factories[replica]()
+            try:
+                await db.connection()
+                return db
+            except DBAPIError:
+                await db.close()
+                health.mark_down(replica)
+    return get_async_session_factory()()
+
+
+def get_read_db(request: Request) -> Iterator[Session]:
+    """
+    get_db for handlers that only read and can be a moment behind the primary, which then run on a replica.
+
+    Don't load the in-memory indexes from it, they would keep what a lagging replica had until they are reloaded.
+    """
+    db = _read_session(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """
+    get_async_db for handlers that only read, see get_read_db
+    """
+    db = await _async_read_session(request)
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+class ReadAfterWriteMiddleware:
+    """
+    Keeps a client's reads on the primary for READ_AFTER_WRITE_SECONDS after it wrote, so it sees its own writes
+    before they reach the replicas.
+
+    Responses to PUT, PATCH and DELETE set a short lived cookie, which get_read_db looks for. Cross origin clients
+    need to send credentials for it to come back.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.cookie = (f'{PRIMARY_COOKIE}=1; Max-Age={READ_AFTER_WRITE_SECONDS}; Path=/; HttpOnly; '
+                       f'SameSite=Lax').encode('latin-1')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message = dict(message, headers=list(message.get('headers', [])) + [(b'set-cookie', self.cookie)])
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -1,20 +1,54 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.requests import Request
 
+from kitchenLibrary.app.cache import cached_response
+from kitchenLibrary.app.encoding import NDJSONResponse, wants_ndjson
 from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.replicas import get_async_read_db
+from kitchenLibrary.app.suggest import get_ingredient_suggester
 from kitchenLibrary.app.util import Response
-from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.models import get_db
 
 router = APIRouter()
 
+MAX_SUGGESTIONS = 50
+
 
 @router.get('/ingredients', tags=['ingredients'], response_model=Response)
-async def get_all_ingredients() -> Response:
+async def get_all_ingredients(request: Request, db: AsyncSession = Depends(get_async_read_db)):
     """
-    Gets a list of all ingredient names
+    Gets a list of all ingredient names.
+
+    With Accept: application/x-ndjson the names are streamed, one per line.
     """
-    with get_session() as db:
+    if wants_ndjson(request):
+        async def names():
+            result = await db.stream(select(Ingredient.name))
+            async for name in result.scalars():
+                yield name
+
+        return NDJSONResponse(names())
+
+    async def build() -> Response:
         try:
-            ingredients = db.query(Ingredient).all()
-            return Response(success=True, data=[i.name for i in ingredients])
+            ingredients = await db.execute(select(Ingredient.name))
+            return Response(success=True, data=ingredients.scalars().all())
         except Exception as e:
             return Response(success=False, message=str(e))
+
+    return await cached_response(request, 'ingredients', build)
+
+
+@router.get('/ingredients/suggest', tags=['ingredients'], response_model=Response)
+def suggest_ingredients(q: str, k: int = Query(10, ge=1, le=MAX_SUGGESTIONS),
+                        db: Session = Depends(get_db)) -> Response:
+    """
+    Suggests up to k ingredient names for a partly typed or misspelled name
+    """
+    try:
+        return Response(success=True, data=get_ingredient_suggester(db).suggest(q, k))
+    except Exception as e:
+        return Response(success=False, message=str(e))
@@ -1,65 +1,221 @@
-from typing import List
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
 
-from fastapi import APIRouter
-from sqlalchemy import and_
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
+from kitchenLibrary.app.encoding import fast_response
+from kitchenLibrary.app.matching import cookable_cache, get_recipe_index
 from kitchenLibrary.app.models.ingredients import Ingredient
 from kitchenLibrary.app.models.kitchen import Kitchen
-from kitchenLibrary.app.models.user import User
-from kitchenLibrary.app.util import Response, decrypt
-from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.models.recipes import Recipe
+from kitchenLibrary.app.replicas import get_async_read_db
+from kitchenLibrary.app.units import from_base, to_base
+from kitchenLibrary.app.util import Response, insert_ignore, resolve_user_id, resolve_user_id_async
+from kitchenLibrary.app.models import get_async_db, get_db
 
 router = APIRouter()
 
 
+class KitchenChanges(BaseModel):
+    """
+    Ingredients to add to and remove from a kitchen
+    """
+    add: List[str] = []
+    remove: List[str] = []
+
+
+class ShoppingListRequest(BaseModel):
+    """
+    Recipes to shop for and whose kitchen to shop for them
+    """
+    user_id: str
+    recipes: List[str]
+    servings: float = 1.0  # Every quantity is multiplied by this
+
+
+class ShoppingItem(BaseModel):
+    """
+    How much of an ingredient to buy. Ingredients used in units that can't be converted get one item per unit.
+    """
+    name: str
+    quantity: float
+    unit: str
+    required: bool  # If any of the recipes requires it
+
+
+class ShoppingList(BaseModel):
+    """
+    What to buy for some recipes, and what was left out
+    """
+    items: List[ShoppingItem]
+    in_kitchen: List[str]
+    recipes_not_found: List[str]
+
+
 @router.get('/kitchen/{user_id}', tags=['kitchen'], response_model=Response)
-async def get_kitchen_contents(user_id: str) -> Response:
+async def get_kitchen_contents(user_id: str, db: AsyncSession = Depends(get_async_read_db)) -> Response:
     """
     Gets all the ingredients a user has in their kitchen
     """
-    with get_session() as db:
-        try:
-            user_db  = db.query(User).filter(User.id == decrypt(user_id)).first()
+    try:
+        kitchen_user_id = await resolve_user_id_async(db, user_id)
 
-            if not user_db:
-                return Response(success=False, message="No kitchen found for user.")
+        if kitchen_user_id is None:
+            return Response(success=False, message="No kitchen found for user.")
 
-            # Join kitchen to ingredients to get names of all ingredients user has
-            ingredients = db.query(Ingredient)\
-                .join(Kitchen, Ingredient.id == Kitchen.ingredient_id)\
-                .filter(Kitchen.user_id == user_db.id)\
-                .all()
+        # Join kitchen to ingredients to get names of all ingredients user has
+        ingredients = await db.execute(select(Ingredient.name)
+                                       .join(Kitchen, Ingredient.id == Kitchen.ingredient_id)
+                                       .where(Kitchen.user_id == kitchen_user_id))
 
-            return Response(success=True, data={ingredient.name for ingredient in ingredients})
-        except Exception as e:
-            return Response(success=False, message=str(e))
+        return Response(success=True, data=set(ingredients.scalars().all()))
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+def _apply_kitchen_changes(db: Session, user_id: int, to_add: Set[int], to_remove: Set[int]) -> None:
+    """
+    Adds and removes ingredients from a kitchen with at most one bulk insert and one delete. Doesn't commit.
+    """
+    if to_add:
+        db.execute(insert_ignore(db, Kitchen.__table__),
+                   [{'user_id': user_id, 'ingredient_id': ingredient_id} for ingredient_id in to_add])
+    if to_remove:
+        db.query(Kitchen) \
+            .filter(and_(Kitchen.user_id == user_id, Kitchen.ingredient_id.in_(to_remove))) \
+            .delete(synchronize_session=False)
 
 
 @router.put('/kitchen/{user_id}', tags=['kitchen'], response_model=Response)
-async def update_kitchen(user_id: str, ingredients: List[str]):
+def update_kitchen(user_id: str, ingredients: List[str], db: Session = Depends(get_db)):
     """
     Updates a user's kitchen
     """
-    with get_session() as db:
-        try:
-            user_db = db.query(User).filter(User.id == decrypt(user_id)).first()
-            if not user_db:
-                return Response(success=False, message="User not found.")
-
-            # Make sets of what user has in DB and what they have now
-            user_ingredients = {k.ingredient_id for k in db.query(Kitchen).filter(Kitchen.user_id == user_db.id).all()}
-            ingredient_ids = {k.id for k in db.query(Ingredient).filter(Ingredient.name.in_(ingredients)).all()}
-
-            # Find the set differences to know what to add and delete
-            to_add = ingredient_ids - user_ingredients
-            to_remove = user_ingredients - ingredient_ids
-
-            for add_id in to_add:
-                db.add(Kitchen(user_id=user_db.id, ingredient_id=add_id))
-            for delete_id in to_remove:
-                db.query(Kitchen).filter(and_(Kitchen.user_id == user_db.id, Kitchen.ingredient_id == delete_id)).delete()
-
-            db.commit()
-            return Response(success=True)
-        except Exception as e:
-            return Response(success=False, message=str(e))
\ No newline at end of file
+    try:
+        kitchen_user_id = resolve_user_id(db, user_id)
+        if kitchen_user_id is None:
+            return Response(success=False, message="User not found.")
+
+        # Make sets of what user has in DB and what they have now
+        user_ingredients = {ingredient_id for ingredient_id, in
+                            db.query(Kitchen.ingredient_id).filter(Kitchen.user_id == kitchen_user_id).all()}
+        ingredient_ids = {ingredient_id for ingredient_id, in
+                          db.query(Ingredient.id).filter(Ingredient.name.in_(ingredients)).all()}
+
+        # Find the set differences to know what to add and delete
+        to_add, to_remove = ingredient_ids - user_ingredients, user_ingredients - ingredient_ids
+        _apply_kitchen_changes(db, kitchen_user_id, to_add, to_remove)
+        db.commit()
+        cookable_cache.update_pantry(kitchen_user_id, to_add, to_remove)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.patch('/kitchen/{user_id}', tags=['kitchen'], response_model=Response)
+def patch_kitchen(user_id: str, changes: KitchenChanges, db: Session = Depends(get_db)) -> Response:
+    """
+    Adds and removes some ingredients in a user's kitchen without sending the whole kitchen.
+
+    Adding something already in the kitchen or removing something not in it does nothing. An ingredient in both
+    lists ends up removed.
+    """
+    try:
+        kitchen_user_id = resolve_user_id(db, user_id)
+        if kitchen_user_id is None:
+            return Response(success=False, message="User not found.")
+
+        ingredient_ids = dict(db.query(Ingredient.name, Ingredient.id)
+                              .filter(Ingredient.name.in_(changes.add + changes.remove)).all())
+        to_remove = {ingredient_ids[name] for name in changes.remove if name in ingredient_ids}
+        to_add = {ingredient_ids[name] for name in changes.add if name in ingredient_ids} - to_remove
+
+        _apply_kitchen_changes(db, kitchen_user_id, to_add, to_remove)
+        db.commit()
+        cookable_cache.update_pantry(kitchen_user_id, to_add, to_remove)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.get('/kitchen/{user_id}/cookable', tags=['kitchen'], response_model=Response)
+def get_cookable_recipes(user_id: str, db: Session = Depends(get_db)) -> Response:
+    """
+    Names of the recipes a user can cook with what is in their kitchen, the same ones POST /recipes/match_all finds
+    for the whole kitchen.
+
+    Kitchen and recipe changes keep each user's result up to date, so a read only looks up the names of the recipes
+    found. The kitchen itself is read again only after the recipe index reloads.
+    """
+    try:
+        kitchen_user_id = resolve_user_id(db, user_id)
+        if kitchen_user_id is None:
+            return Response(success=False, message="User not found.")
+
+        get_recipe_index(db)
+        recipe_ids = cookable_cache.get(kitchen_user_id)
+        if recipe_ids is None:
+            writes = cookable_cache.writes
+            pantry = {ingredient_id for ingredient_id, in
+                      db.query(Kitchen.ingredient_id).filter(Kitchen.user_id == kitchen_user_id).all()}
+            recipe_ids = cookable_cache.store(kitchen_user_id, pantry, writes)
+        names = dict(db.query(Recipe.id, Recipe.name).filter(Recipe.id.in_(recipe_ids)).all()) if recipe_ids else {}
+        return fast_response(success=True, data=[names[recipe_id] for recipe_id in recipe_ids if recipe_id in names])
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.post('/shopping_list', tags=['kitchen'], response_model=Response)
+async def get_shopping_list(shopping: ShoppingListRequest, db: AsyncSession = Depends(get_async_db)) -> Response:
+    """
+    Adds up the ingredients of several recipes, leaving out what is already in the user's kitchen.
+
+    Quantities of an ingredient are summed after converting compatible units (tsp, tbsp and cup, oz and lb, metric
+    ones) and given back in the largest unit that fits. Everything comes from one query, however many recipes.
+
+    Returns:
+        Response with a ShoppingList as data
+    """
+    try:
+        kitchen_user_id = await resolve_user_id_async(db, shopping.user_id)
+        if kitchen_user_id is None:
+            return Response(success=False, message="User not found.")
+
+        names = {name.lower() for name in shopping.recipes}
+        # Every ingredient of every recipe, with the user's kitchen row if they have it. Outer joins so a recipe
+        # without ingredients still comes back, as one row of nulls.
+        rows = await db.execute(select(Recipe.name, Ingredient.name, RecipeIngredient.quantity, RecipeIngredient.unit,
+                                       RecipeIngredient.required, Kitchen.id)
+                                .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+                                .outerjoin(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+                                .outerjoin(Kitchen, and_(Kitchen.ingredient_id == RecipeIngredient.ingredient_id,
+                                                         Kitchen.user_id == kitchen_user_id))
+                                .where(Recipe.name.in_(names)))
+
+        found, in_kitchen = set(), set()
+        totals: Dict[Tuple[str, str], float] = defaultdict(float)  # (ingredient, unit kind) -> base quantity
+        required: Dict[str, bool] = defaultdict(bool)
+        for recipe_name, name, quantity, unit, is_required, kitchen_id in rows:
+            found.add(recipe_name)
+            if name is None:
+                continue
+            if kitchen_id is not None:
+                in_kitchen.add(name)
+                continue
+            kind, base_quantity = to_base((quantity or 0) * shopping.servings, unit)
+            totals[(name, kind)] += base_quantity
+            required[name] |= is_required
+
+        items = []
+        for (name, kind), base_quantity in sorted(totals.items()):
+            quantity, unit = from_base(kind, base_quantity)
+            items.append(ShoppingItem(name=name, quantity=quantity, unit=unit, required=required[name]))
+        return Response(success=True, data=ShoppingList(items=items, in_kitchen=sorted(in_kitchen),
+                                                        recipes_not_found=sorted(names - found)))
+    except Exception as e:
+        return Response(success=False, message=str(e))
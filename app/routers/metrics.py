@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+
+from kitchenLibrary.app.metrics import registry
+from kitchenLibrary.app.passwords import hash_pool
+from kitchenLibrary.app.replicas import get_replica_health
+
+router = APIRouter()
+
+
+@router.get('/metrics', tags=['metrics'], response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """
+    Request, SQL, password hashing and replica metrics of this process in the Prometheus text format
+    """
+    pool = hash_pool.stats()
+    gauges = {'kitchen_password_hash_pool': {f'state="{state}"': value for state, value in pool.items()},
+              'kitchen_db_replica_up': get_replica_health().stats()}
+    return PlainTextResponse(registry.render(gauges), media_type='text/plain; version=0.0.4')
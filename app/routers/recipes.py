@@ -1,17 +1,45 @@
+import json
 from collections import defaultdict
-from typing import List
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from fastapi import APIRouter
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
+from kitchenLibrary.app.cache import bump_catalog_version, cached_response
+from kitchenLibrary.app.encoding import NDJSONResponse, fast_response, wants_ndjson
+from kitchenLibrary.app.matching import cookable_cache, get_recipe_index, recipe_index
 from kitchenLibrary.app.models.ingredients import IngredientInfo, Ingredient
+from kitchenLibrary.app.models.kitchen import Kitchen
 from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
 from kitchenLibrary.app.models.recipes import RecipeInfo, Recipe
-from kitchenLibrary.app.util import Response, check_referenced_user_permissions
-from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.replicas import get_async_read_db, get_read_db
+from kitchenLibrary.app.search import get_recipe_search_index, recipe_search_index
+from kitchenLibrary.app.similarity import get_similarity_index, similarity_index
+from kitchenLibrary.app.suggest import ingredient_suggester
+from kitchenLibrary.app.util import Response, check_referenced_user_permissions, insert_ignore
+from kitchenLibrary.app.models import get_db
 
 router = APIRouter()
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+DEFAULT_BULK_CHUNK_SIZE = 500
+# Rows fetched at a time from the server side cursor when streaming recipes
+STREAM_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 100
+# What fields= can ask for. ingredients has quantities and units, ingredient_names just the names.
+RECIPE_FIELDS = frozenset(('name', 'directions', 'ingredients', 'ingredient_names'))
+DEFAULT_FIELDS = frozenset(('name', 'directions', 'ingredients'))
+
+# (recipe id, name, directions, (ingredient id, ingredient name, required) links) for the in-memory indexes
+IndexEntry = Tuple[int, str, str, List[Tuple[int, str, bool]]]
+
 
 class FullRecipe(BaseModel):
     """
@@ -30,81 +58,493 @@ class NewRecipe(BaseModel):
     directions: str
 
 
+class BulkRecipeResult(BaseModel):
+    """
+    What happened to one recipe in a bulk upload
+    """
+    name: str
+    success: bool
+    message: Optional[str] = ""
+
+
+class SearchResult(BaseModel):
+    """
+    A recipe found by a text search and how well it matched
+    """
+    name: str
+    score: float
+
+
+class SimilarRecipe(BaseModel):
+    """
+    A recipe with ingredients like another one's
+    """
+    name: str
+    similarity: float
+
+
+class NearRecipe(BaseModel):
+    """
+    A recipe that can almost be made and what it is missing
+    """
+    recipe: FullRecipe
+    missing: List[str]
+    optional_coverage: float
+
+
+def parse_fields(fields: Optional[str]) -> FrozenSet[str]:
+    """
+    Reads a comma separated fields= parameter, the full recipe when it isn't given. The name is always sent.
+    """
+    if fields is None:
+        return DEFAULT_FIELDS
+    wanted = frozenset(field.strip() for field in fields.split(',') if field.strip())
+    unknown = wanted - RECIPE_FIELDS
+    if unknown:
+        raise ValueError(f'Unknown fields {", ".join(sorted(unknown))}, use {", ".join(sorted(RECIPE_FIELDS))}.')
+    return wanted | {'name'}
+
+
+def _recipe_dict(recipe: Sequence, links: Iterable[Sequence], fields: FrozenSet[str]) -> dict:
+    """
+    Dict shaped like FullRecipe holding only the fields asked for
+
+    Arguments:
+        recipe: (name, directions) of the recipe, just (name,) without directions
+        links: (ingredient name, quantity, unit, required) of its ingredients, just (ingredient name,) without
+            ingredients
+        fields: from parse_fields
+    """
+    info = {'name': recipe[0]}
+    if 'directions' in fields:
+        info['directions'] = recipe[1]
+    result = {'recipe_info': info}
+    if 'ingredients' in fields:
+        result['ingredients'] = [{'name': name, 'quantity': quantity, 'unit': unit, 'required': required}
+                                 for name, quantity, unit, required in links]
+    if 'ingredient_names' in fields:
+        result['ingredient_names'] = [link[0] for link in links]
+    return result
+
+
+def _columns(fields: FrozenSet[str]) -> Tuple[list, list]:
+    """
+    Recipe and ingredient link columns to select for some fields, directions and ingredient details only if asked
+    """
+    recipe_columns = [Recipe.id, Recipe.name] + ([Recipe.directions] if 'directions' in fields else [])
+    link_columns = []
+    if 'ingredients' in fields:
+        link_columns = [Ingredient.name, RecipeIngredient.quantity, RecipeIngredient.unit, RecipeIngredient.required]
+    elif 'ingredient_names' in fields:
+        link_columns = [Ingredient.name]
+    return recipe_columns, link_columns
+
+
+def load_recipe_dicts(db: Session, recipe_ids: List[int], fields: FrozenSet[str] = DEFAULT_FIELDS) -> List[dict]:
+    """
+    Loads recipes and all of their ingredients with a fixed number of queries no matter how many recipes there are.
+
+    Only columns are selected and the results are plain dicts shaped like FullRecipe, so large results skip both
+    ORM objects and pydantic models. Send them with fast_response. Directions and ingredients are only read from
+    the database when fields asks for them.
+
+    Returns:
+        Dict for each recipe id that exists, in the order of recipe_ids
+    """
+    recipes = load_recipe_dicts_by_id(db, recipe_ids, fields)
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+def load_recipe_dicts_by_id(db: Session, recipe_ids: List[int],
+                            fields: FrozenSet[str] = DEFAULT_FIELDS) -> Dict[int, dict]:
+    """
+    load_recipe_dicts keyed by recipe id, to join the recipes with something else known about them. Ids of recipes
+    deleted since they were looked up are missing.
+    """
+    if not recipe_ids:
+        return {}
+    recipe_columns, link_columns = _columns(fields)
+    recipes = {row[0]: row[1:] for row in db.query(*recipe_columns).filter(Recipe.id.in_(recipe_ids)).all()}
+
+    links = defaultdict(list)
+    if link_columns:
+        for row in db.query(RecipeIngredient.recipe_id, *link_columns) \
+                .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id) \
+                .filter(RecipeIngredient.recipe_id.in_(recipe_ids)) \
+                .order_by(RecipeIngredient.id) \
+                .all():
+            links[row[0]].append(row[1:])
+
+    return {recipe_id: _recipe_dict(recipes[recipe_id], links[recipe_id], fields)
+            for recipe_id in recipe_ids if recipe_id in recipes}
+
+
+def iter_recipe_dicts(db: Session, condition, fields: FrozenSet[str] = DEFAULT_FIELDS) -> Iterator[dict]:
+    """
+    Streams the recipes matching a condition, in id order, as dicts shaped like FullRecipe.
+
+    Recipes and ingredients come from one joined query read through a server side cursor, so memory use stays the
+    same however many recipes match. Without ingredient fields the join is skipped. The session can't run other
+    queries until the iterator is used up.
+
+    Arguments:
+        db: session to read with
+        condition: filter on Recipe columns
+        fields: from parse_fields
+    """
+    recipe_columns, link_columns = _columns(fields)
+    query = db.query(*recipe_columns, *link_columns)
+    order = [Recipe.id]
+    if link_columns:
+        query = query.join(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id) \
+            .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+        order.append(RecipeIngredient.id)
+    rows = query.filter(condition).order_by(*order).yield_per(STREAM_BATCH_SIZE)
+
+    split = len(recipe_columns)
+    for _, group in groupby(rows, key=itemgetter(0)):
+        group = list(group)
+        yield _recipe_dict(group[0][1:split], [row[split:] for row in group] if link_columns else (), fields)
+
+
+def load_full_recipes(db: Session, recipe_ids: List[int]) -> List[FullRecipe]:
+    """
+    load_recipe_dicts as FullRecipe models
+    """
+    return [FullRecipe.parse_obj(recipe) for recipe in load_recipe_dicts(db, recipe_ids)]
+
+
 @router.put('/recipes', tags=['recipes'], response_model=Response)
-async def add_recipe(recipe: NewRecipe, reference_id: str) -> Response:
+def add_recipe(recipe: NewRecipe, reference_id: str, db: Session = Depends(get_db)) -> Response:
     """
     Adds a new recipe to the database
     """
-    with get_session() as db:
-        try:
-            if not check_referenced_user_permissions(db, reference_id, True, False, False):
-                return Response(success=False, message='Reference user cannot perform this operation')
-            if db.query(Recipe).filter(Recipe.name == recipe.name).first():
-                # No duplicates
-                return Response(success=False, message="Recipe already exists.")
+    try:
+        if not check_referenced_user_permissions(db, reference_id, True, False, False):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        if db.query(Recipe).filter(Recipe.name == recipe.name).first():
+            # No duplicates
+            return Response(success=False, message="Recipe already exists.")
+
+        recipe_db = Recipe(name=recipe.name, directions=recipe.directions)
+        db.add(recipe_db)
+        db.flush()
+
+        links = []
+        for ingredient in recipe.ingredients:
+            ingredient_db = db.query(Ingredient).filter(Ingredient.name == ingredient.name).first()
+            if not ingredient_db:
+                # New ingredient, need to add it
+                ingredient_db = Ingredient(name=ingredient.name)
+                db.add(ingredient_db)
+                db.flush()
+            link = RecipeIngredient(recipe_id=recipe_db.id,
+                                    ingredient_id=ingredient_db.id,
+                                    quantity=ingredient.quantity,
+                                    unit=ingredient.unit,
+                                    required=ingredient.required)
+            db.add(link)
+            links.append((ingredient_db.id, ingredient_db.name, ingredient.required))
+        entry = (recipe_db.id, recipe_db.name, recipe_db.directions, links)
+        db.commit()
+        _index_recipes([entry])
+        return Response(success=True)
+
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+def _resolve_ingredient_ids(db: Session, names: List[str]) -> Dict[str, int]:
+    """
+    Gets the ids for ingredient names, inserting any that don't exist yet in one bulk statement
+
+    Returns:
+        Ingredient name -> id
+    """
+    ingredient_ids = {name: ingredient_id for ingredient_id, name in
+                      db.query(Ingredient.id, Ingredient.name).filter(Ingredient.name.in_(names)).all()}
+    missing = [name for name in names if name not in ingredient_ids]
+    if missing:
+        # Ignore rows another writer added since the lookup, then read back every new id
+        db.execute(insert_ignore(db, Ingredient.__table__), [{'name': name} for name in missing])
+        ingredient_ids.update({name: ingredient_id for ingredient_id, name in
+                               db.query(Ingredient.id, Ingredient.name).filter(Ingredient.name.in_(missing)).all()})
+    return ingredient_ids
+
+
+def _insert_recipes(db: Session, recipes: List[NewRecipe]) -> List[IndexEntry]:
+    """
+    Writes recipes, the ingredients in them that don't exist yet and their ingredient links with one multi-row
+    insert per table. Doesn't commit, so new ingredients are rolled back with the recipes if they fail.
+
+    Returns:
+        What to add to the in-memory indexes once committed
+    """
+    ingredient_ids = _resolve_ingredient_ids(db, sorted({i.name for recipe in recipes for i in recipe.ingredients}))
+    db.execute(Recipe.__table__.insert(), [{'name': recipe.name, 'directions': recipe.directions}
+                                            for recipe in recipes])
+    recipe_ids = {name: recipe_id for recipe_id, name in
+                  db.query(Recipe.id, Recipe.name).filter(Recipe.name.in_([r.name for r in recipes])).all()}
+    links = [{'recipe_id': recipe_ids[recipe.name],
+              'ingredient_id': ingredient_ids[ingredient.name],
+              'quantity': ingredient.quantity,
+              'unit': ingredient.unit,
+              'required': ingredient.required}
+             for recipe in recipes for ingredient in recipe.ingredients]
+    if links:
+        db.execute(RecipeIngredient.__table__.insert(), links)
 
-            recipe_db = Recipe(name=recipe.name, directions=recipe.directions)
-            db.add(recipe_db)
+    return [(recipe_ids[recipe.name], recipe.name, recipe.directions,
+             [(ingredient_ids[i.name], i.name, i.required) for i in recipe.ingredients])
+            for recipe in recipes]
 
+
+def _index_recipes(entries: List[IndexEntry]) -> None:
+    """
+    Adds committed recipes to the in-memory indexes
+    """
+    for recipe_id, name, directions, links in entries:
+        recipe_index.add_recipe(recipe_id, links)
+        ingredient_suggester.add(ingredient_name for _, ingredient_name, _ in links)
+        recipe_search_index.add_recipe(recipe_id, name, directions)
+        similarity_index.add_recipe(recipe_id, (ingredient_id for ingredient_id, _, _ in links))
+    cookable_cache.recipes_changed(recipe_id for recipe_id, _, _, _ in entries)
+    bump_catalog_version()
+
+
+def _parse_bulk_body(body: bytes, content_type: str) -> List[dict]:
+    """
+    Reads a bulk upload sent either as a JSON list or as NDJSON with one recipe per line
+    """
+    if 'ndjson' in content_type:
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    recipes = json.loads(body)
+    if not isinstance(recipes, list):
+        raise ValueError('Expected a list of recipes.')
+    return recipes
+
+
+@router.put('/recipes/bulk', tags=['recipes'], response_model=Response)
+async def add_recipes_bulk(request: Request, reference_id: str,
+                           chunk_size: int = Query(DEFAULT_BULK_CHUNK_SIZE, ge=1, le=5000),
+                           db: Session = Depends(get_db)) -> Response:
+    """
+    Adds many recipes at once from a JSON list of NewRecipe or an application/x-ndjson stream.
+
+    Recipes are written chunk_size at a time, each chunk in its own transaction. A chunk's ingredients are resolved
+    with one query and missing ones inserted in bulk in the same transaction. A failed chunk is retried one recipe
+    at a time so only the bad recipes fail, leaving no ingredients behind.
+
+    Returns:
+        Response with a BulkRecipeResult for every uploaded recipe as data
+    """
+    body = await request.body()
+    # The upload is read on the event loop, the blocking database work runs in the threadpool
+    return await run_in_threadpool(_add_recipes_bulk, db, reference_id, body,
+                                   request.headers.get('content-type', ''), chunk_size)
+
+
+def _add_recipes_bulk(db: Session, reference_id: str, body: bytes, content_type: str, chunk_size: int) -> Response:
+    try:
+        if not check_referenced_user_permissions(db, reference_id, True, False, False):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        raw_recipes = _parse_bulk_body(body, content_type)
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+    try:
+        results: List[BulkRecipeResult] = []
+        accepted: List[NewRecipe] = []
+        seen = set()
+        for raw in raw_recipes:
+            try:
+                recipe = NewRecipe.parse_obj(raw)
+            except ValidationError as e:
+                name = raw.get('name', '') if isinstance(raw, dict) else ''
+                results.append(BulkRecipeResult(name=str(name), success=False, message=str(e)))
+                continue
+            # Names are stored lowercased, bulk inserts skip the model validators
+            recipe.name = recipe.name.lower()
             for ingredient in recipe.ingredients:
-                ingredient_db = db.query(Ingredient).filter(Ingredient.name == ingredient.name).first()
-                if not ingredient_db:
-                    # New ingredient, need to add it
-                    ingredient_db = Ingredient(name=ingredient.name)
-                    db.add(ingredient_db)
-                    db.flush()
-                link = RecipeIngredient(recipe_id=recipe_db.id,
-                                        ingredient_id=ingredient_db.id,
-                                        quantity=ingredient.quantity,
-                                        unit=ingredient.unit,
-                                        required=ingredient.required)
-                db.add(link)
-            db.commit()
-            return Response(success=True)
-
-        except Exception as e:
-            return Response(success=False, message=str(e))
+                ingredient.name = ingredient.name.lower()
+            result = BulkRecipeResult(name=recipe.name, success=True)
+            if recipe.name in seen:
+                result.success, result.message = False, 'Duplicate recipe in upload.'
+            else:
+                seen.add(recipe.name)
+                accepted.append(recipe)
+            results.append(result)
+
+        # No duplicates with what is already stored
+        existing = {name for name, in db.query(Recipe.name).filter(Recipe.name.in_(seen)).all()} if seen else set()
+        for result in results:
+            if result.success and result.name in existing:
+                result.success, result.message = False, 'Recipe already exists.'
+        accepted = [recipe for recipe in accepted if recipe.name not in existing]
+        if not accepted:
+            return Response(success=True, data=results)
+
+        failures = dict()
+        for start in range(0, len(accepted), chunk_size):
+            chunk = accepted[start:start + chunk_size]
+            try:
+                entries = _insert_recipes(db, chunk)
+                db.commit()
+                _index_recipes(entries)
+            except Exception:
+                db.rollback()
+                for recipe in chunk:
+                    try:
+                        entries = _insert_recipes(db, [recipe])
+                        db.commit()
+                        _index_recipes(entries)
+                    except Exception as e:
+                        db.rollback()
+                        failures[recipe.name] = str(e)
+
+        for result in results:
+            if result.name in failures and result.success:
+                result.success, result.message = False, failures[result.name]
+        return Response(success=True, data=results)
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+def _delete_recipes(db: Session, recipe_ids: List[int]) -> List[Tuple[int, str]]:
+    """
+    Deletes recipes and then, with one anti-join, every one of their ingredients that no other recipe or kitchen
+    uses. Ingredients still in someone's kitchen are kept so kitchens never point at missing ingredients.
+    Doesn't commit.
+
+    Returns:
+        (id, name) of the ingredients that were deleted
+    """
+    ingredient_ids = [ingredient_id for ingredient_id, in
+                      db.query(RecipeIngredient.ingredient_id)
+                          .filter(RecipeIngredient.recipe_id.in_(recipe_ids))
+                          .distinct()
+                          .all()]
+    db.query(RecipeIngredient).filter(RecipeIngredient.recipe_id.in_(recipe_ids)).delete(synchronize_session=False)
+    db.query(Recipe).filter(Recipe.id.in_(recipe_ids)).delete(synchronize_session=False)
+    if not ingredient_ids:
+        return []
+
+    orphans = [(ingredient_id, name) for ingredient_id, name in
+               db.query(Ingredient.id, Ingredient.name)
+                   .filter(Ingredient.id.in_(ingredient_ids),
+                           ~exists().where(RecipeIngredient.ingredient_id == Ingredient.id),
+                           ~exists().where(Kitchen.ingredient_id == Ingredient.id))
+                   .all()]
+    if orphans:
+        db.query(Ingredient) \
+            .filter(Ingredient.id.in_([ingredient_id for ingredient_id, _ in orphans])) \
+            .delete(synchronize_session=False)
+    return orphans
+
+
+def _unindex_recipes(recipe_ids: List[int], orphans: List[Tuple[int, str]]) -> None:
+    """
+    Removes committed deletes from the in-memory indexes
+    """
+    for recipe_id in recipe_ids:
+        recipe_index.remove_recipe(recipe_id)
+    recipe_search_index.remove_recipes(recipe_ids)
+    similarity_index.remove_recipes(recipe_ids)
+    recipe_index.remove_ingredients(ingredient_id for ingredient_id, _ in orphans)
+    ingredient_suggester.remove(name for _, name in orphans)
+    cookable_cache.recipes_changed(recipe_ids)
+    bump_catalog_version()
 
 
 @router.delete('/recipes/{name}', tags=['recipes'], response_model=Response)
-def delete_recipe(recipe_name: str, reference_id: str) -> Response:
+def delete_recipe(recipe_name: str, reference_id: str, db: Session = Depends(get_db)) -> Response:
     """
     Deletes a recipe from the database.
     """
-    with get_session() as db:
-        try:
-            if not check_referenced_user_permissions(db, reference_id, False, True, False):
-                return Response(success=False, message='Reference user cannot perform this operation')
-            recipe = db.query(Recipe).filter(Recipe.name == recipe_name.lower()).first()
-            if not recipe:
-                return Response(success=False, message='Recipe not found.')
-            ingredient_ids = {r.ingredient_id for r in
-                              db.query(RecipeIngredient).filter(RecipeIngredient.recipe_id == recipe.id).all()}
-
-            db.query(RecipeIngredient).filter(RecipeIngredient.recipe_id == recipe.id).delete()
-            db.delete(recipe)
-
-            for ingredient_id in ingredient_ids:
-                remaining_recipes = db.query(RecipeIngredient).filter(
-                    RecipeIngredient.ingredient_id == ingredient_id).count()
-                if not remaining_recipes:  # Remove orphans
-                    db.query(Ingredient).filter(Ingredient.id == ingredient_id).delete()
-            db.commit()
-            return Response(success=True)
-        except Exception as e:
-            return Response(success=False, message=str(e))
+    try:
+        if not check_referenced_user_permissions(db, reference_id, False, True, False):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        recipe = db.query(Recipe.id).filter(Recipe.name == recipe_name.lower()).first()
+        if not recipe:
+            return Response(success=False, message='Recipe not found.')
+
+        orphans = _delete_recipes(db, [recipe.id])
+        db.commit()
+        _unindex_recipes([recipe.id], orphans)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.delete('/recipes', tags=['recipes'], response_model=Response)
+def delete_recipes_bulk(recipe_names: List[str], reference_id: str,
+                        chunk_size: int = Query(DEFAULT_BULK_CHUNK_SIZE, ge=1, le=5000),
+                        db: Session = Depends(get_db)) -> Response:
+    """
+    Deletes many recipes at once, chunk_size recipes per transaction.
+
+    Returns:
+        Response with a BulkRecipeResult for every requested name as data
+    """
+    try:
+        if not check_referenced_user_permissions(db, reference_id, False, True, False):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        names = list(dict.fromkeys(name.lower() for name in recipe_names))
+        recipe_ids = dict(db.query(Recipe.name, Recipe.id).filter(Recipe.name.in_(names)).all()) if names else {}
+
+        results = {name: BulkRecipeResult(name=name, success=name in recipe_ids,
+                                          message='' if name in recipe_ids else 'Recipe not found.')
+                   for name in names}
+        found = [name for name in names if name in recipe_ids]
+        for start in range(0, len(found), chunk_size):
+            chunk = found[start:start + chunk_size]
+            chunk_ids = [recipe_ids[name] for name in chunk]
+            try:
+                orphans = _delete_recipes(db, chunk_ids)
+                db.commit()
+                _unindex_recipes(chunk_ids, orphans)
+            except Exception as e:
+                db.rollback()
+                for name in chunk:
+                    results[name].success, results[name].message = False, str(e)
+        return Response(success=True, data=list(results.values()))
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.get('/recipes/search', tags=['recipes'], response_model=Response)
+def search_recipes(q: str, ingredients: List[str] = Query([]),
+                   limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: int = Query(0, ge=0),
+                   db: Session = Depends(get_db)) -> Response:
+    """
+    Searches recipe names and directions for words, best matches first.
+
+    Only recipes using every ingredient in ingredients are searched when any are given. Pass the returned
+    next_cursor back as cursor to get the next page.
+
+    Everything comes from the in-memory indexes, the session on the primary is only used when they (re)load so they
+    never keep a lagging replica's catalog until INDEX_MAX_AGE.
+    """
+    try:
+        only = get_recipe_index(db).recipes_using_all(ingredients) if ingredients else None
+        results, more = get_recipe_search_index(db).search(q, limit, cursor, only)
+        return Response(success=True,
+                        data=[SearchResult(name=name, score=score) for name, score in results],
+                        next_cursor=cursor + limit if more else None)
+    except Exception as e:
+        return Response(success=False, message=str(e))
 
 
 @router.post('/recipes/search/{name}', tags=['recipes'], response_model=Response)
-async def get_recipe(name: str) -> Response:
+async def get_recipe(name: str, request: Request, db: AsyncSession = Depends(get_async_read_db)):
     """
     Gets a recipe from the database using the name
     """
-    with get_session() as db:
-        recipes = db.query(Recipe, RecipeIngredient, Ingredient) \
-            .join(RecipeIngredient, Recipe.id == RecipeIngredient.recipe_id) \
-            .join(Ingredient, RecipeIngredient.ingredient_id == Ingredient.id) \
-            .filter(Recipe.name == name.lower()).all()
+    async def build() -> Response:
+        recipes = (await db.execute(select(Recipe, RecipeIngredient, Ingredient)
+                                    .join(RecipeIngredient, Recipe.id == RecipeIngredient.recipe_id)
+                                    .join(Ingredient, RecipeIngredient.ingredient_id == Ingredient.id)
+                                    .where(Recipe.name == name.lower()))).all()
         if not recipes:
             return Response(success=False, message="Recipe not found.")
         recipe_info = RecipeInfo(name=recipes[0][0].name, directions=recipes[0][0].directions)
@@ -118,93 +558,130 @@ async def get_recipe(name: str) -> Response:
                         data=FullRecipe(recipe_info=recipe_info,
                                         ingredients=ingredients_info))
 
+    return await cached_response(request, f'recipe:{name.lower()}', build)
+
+
+@router.post('/recipes/batch', tags=['recipes'], response_model=Response)
+def get_recipes_batch(names: List[str], fields: Optional[str] = None, db: Session = Depends(get_db)) -> Response:
+    """
+    Gets up to MAX_BATCH_SIZE recipes by name in one call, with a fixed number of queries.
+
+    Recipes come back in the order their names were sent, names without a recipe are left out. fields works like
+    in match_any.
+    """
+    try:
+        if len(names) > MAX_BATCH_SIZE:
+            return Response(success=False, message=f'At most {MAX_BATCH_SIZE} recipes at a time.')
+        fields = parse_fields(fields)
+        names = list(dict.fromkeys(name.lower() for name in names))
+        recipe_ids = dict(db.query(Recipe.name, Recipe.id).filter(Recipe.name.in_(names)).all()) if names else {}
+        return fast_response(success=True, data=load_recipe_dicts(db, [recipe_ids[name] for name in names
+                                                                       if name in recipe_ids], fields))
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.get('/recipes/{name}/similar', tags=['recipes'], response_model=Response)
+def get_similar_recipes(name: str, k: int = Query(10, ge=1, le=MAX_PAGE_SIZE), weighted: bool = False,
+                        db: Session = Depends(get_db)) -> Response:
+    """
+    Finds the k recipes whose ingredients are most like a recipe's, by Jaccard similarity of the ingredient sets.
+
+    With weighted an optional ingredient counts for less than a required one. Candidates come from a MinHash index
+    so a few of the most similar recipes can be missed, the similarities returned are exact.
+    """
+    try:
+        recipe = db.query(Recipe.id).filter(Recipe.name == name.lower()).first()
+        if not recipe:
+            return Response(success=False, message="Recipe not found.")
+
+        similar = get_similarity_index(db).similar(recipe.id, k, weighted)
+        names = dict(db.query(Recipe.id, Recipe.name).filter(Recipe.id.in_([i for i, _ in similar])).all()) \
+            if similar else {}
+        return Response(success=True, data=[SimilarRecipe(name=names[recipe_id], similarity=similarity)
+                                            for recipe_id, similarity in similar if recipe_id in names])
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
 
 @router.post('/recipes/match_any', tags=['recipes'], response_model=Response)
-def get_all_recipes(ingredients: List[str]) -> Response:
-    """
-    Finds all the recipes that can be made with anything in the list of ingredients
-    """
-    with get_session() as db:
-        try:
-            recipes = dict()
-            # Find all the ingredients with the given names
-            found_recipes = db.query(Ingredient, RecipeIngredient, Recipe) \
-                .join(RecipeIngredient, Ingredient.id == RecipeIngredient.ingredient_id) \
-                .join(Recipe, RecipeIngredient.recipe_id == Recipe.id) \
-                .filter(Ingredient.name.in_(ingredients)).all()
-
-            for recipe in found_recipes:
-                if not recipe[1].recipe_id in recipes:
-                    # If we don't have the recipe already, add it to the list with all the ingredients in it
-                    ingredients = [
-                        IngredientInfo(name=ing[0].name,
-                                       quantity=ing[1].quantity,
-                                       unit=ing[1].unit,
-                                       required=ing[1].required) for
-                        ing in db.query(Ingredient, RecipeIngredient)
-                            .join(RecipeIngredient, RecipeIngredient.ingredient_id == Ingredient.id)
-                            .filter(RecipeIngredient.recipe_id == recipe[1].recipe_id)
-                            .all()]
-                    recipes[recipe[1].recipe_id] = FullRecipe(
-                        recipe_info=RecipeInfo(name=recipe[2].name, directions=recipe[2].directions),
-                        ingredients=ingredients)
-            return Response(success=True, data=list(recipes.values()))
-        except Exception as e:
-            return Response(success=False, message=str(e))
+def get_all_recipes(ingredients: List[str], request: Request,
+                    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                    cursor: Optional[int] = None, fields: Optional[str] = None,
+                    db: Session = Depends(get_read_db)) -> Response:
+    """
+    Finds all the recipes that can be made with anything in the list of ingredients.
+
+    Results are ordered by recipe id. Pass the returned next_cursor back as cursor to get the next page.
+
+    With Accept: application/x-ndjson every recipe after cursor is streamed, one FullRecipe per line, and limit is
+    ignored.
+
+    fields picks what is sent of each recipe, comma separated from name, directions, ingredients and
+    ingredient_names. Everything but ingredient_names is sent without it.
+    """
+    try:
+        fields = parse_fields(fields)
+        # Ids of every recipe using any of the ingredients, one page at a time
+        candidates = db.query(RecipeIngredient.recipe_id) \
+            .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id) \
+            .filter(Ingredient.name.in_(ingredients))
+        if cursor is not None:
+            candidates = candidates.filter(RecipeIngredient.recipe_id > cursor)
+        if wants_ndjson(request):
+            return NDJSONResponse(iter_recipe_dicts(db, Recipe.id.in_(candidates.statement), fields))
+        recipe_ids = [row.recipe_id for row in
+                      candidates.distinct().order_by(RecipeIngredient.recipe_id).limit(limit + 1).all()]
+
+        # One extra row tells us if there is another page
+        next_cursor = None
+        if len(recipe_ids) > limit:
+            recipe_ids = recipe_ids[:limit]
+            next_cursor = recipe_ids[-1]
+
+        return fast_response(success=True, data=load_recipe_dicts(db, recipe_ids, fields), next_cursor=next_cursor)
+    except Exception as e:
+        return Response(success=False, message=str(e))
 
 
 @router.post('/recipes/match_all', tags=['recipes'], response_model=Response)
-def get_matching_recipes(ingredients: List[str]) -> Response:
-    """
-    Finds all the recipes that can be made with the list of ingredients
-    """
-    with get_session() as db:
-        try:
-            # Find all the ingredients and recipes with those
-            found_recipes = db.query(Ingredient, RecipeIngredient, Recipe) \
-                .join(RecipeIngredient, Ingredient.id == RecipeIngredient.ingredient_id) \
-                .join(Recipe, RecipeIngredient.recipe_id == Recipe.id) \
-                .filter(Ingredient.name.in_(ingredients)) \
-                .all()
-
-            # Find all the recipes that match the ingredients and build a dict for each recipe that will hold
-            # a set of all the found ingredients
-            recipe_pieces = defaultdict(list)
-            recipe_info = dict()
-
-            for recipe in found_recipes:
-                if recipe[2].id not in recipe_info:
-                    recipe_info[recipe[2].id] = RecipeInfo(name=recipe[2].name, directions=recipe[2].directions)
-                recipe_pieces[recipe[2].id].append(IngredientInfo(
-                    name=recipe[0].name,
-                    quantity=recipe[1].quantity,
-                    unit=recipe[1].unit,
-                    required=recipe[1].required
-                ))
-
-            # Search for the full recipe for each possible recipe and see if we have all the required ingredients for it
-            full_recipes = list()
-            for recipe_id in recipe_info.keys():
-                # IngredientInfo objects of the full ingredients for this recipe
-                full_ingredients = [
-                    IngredientInfo(name=r[1].name,
-                                   quantity=r[0].quantity,
-                                   unit=r[0].unit,
-                                   required=r[0].required) for r in db.query(RecipeIngredient, Ingredient)
-                        .join(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
-                        .filter(RecipeIngredient.recipe_id == recipe_id)
-                        .all()]
-
-                # Only check on ingredients that are required
-                non_required_full_ingredients = len([r for r in full_ingredients if r.required])
-                non_required_found_ingredients = len([r for r in recipe_pieces[recipe_id] if r.required])
-                if non_required_full_ingredients == non_required_found_ingredients:
-                    # If we have everything then pass it
-                    full_recipes.append(FullRecipe(
-                        recipe_info=recipe_info[recipe_id],
-                        ingredients=full_ingredients
-                    ))
-
-            return Response(success=True, data=full_recipes)
-        except Exception as e:
-            return Response(success=False, message=str(e))
+def get_matching_recipes(ingredients: List[str], request: Request, fields: Optional[str] = None,
+                         db: Session = Depends(get_read_db), primary: Session = Depends(get_db)) -> Response:
+    """
+    Finds all the recipes that can be made with the list of ingredients.
+
+    With Accept: application/x-ndjson they are streamed, one FullRecipe per line. fields works like in match_any.
+    """
+    try:
+        fields = parse_fields(fields)
+        # The index answers which recipes have every required ingredient, then load just those. It loads from the
+        # primary, a replica's lag would stay in it until it is reloaded. The session only connects if it does.
+        recipe_ids = get_recipe_index(primary).match_all(ingredients)
+        if wants_ndjson(request):
+            # A batch of ids at a time so the IN lists stay short
+            batches = (recipe_ids[start:start + STREAM_BATCH_SIZE]
+                       for start in range(0, len(recipe_ids), STREAM_BATCH_SIZE))
+            return NDJSONResponse(recipe for batch in batches
+                                  for recipe in iter_recipe_dicts(db, Recipe.id.in_(batch), fields))
+        return fast_response(success=True, data=load_recipe_dicts(db, recipe_ids, fields))
+    except Exception as e:
+        return Response(success=False, message=str(e))
+
+
+@router.post('/recipes/match_near', tags=['recipes'], response_model=Response)
+def get_near_recipes(ingredients: List[str], max_missing: int = Query(1, ge=0),
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                     db: Session = Depends(get_db)) -> Response:
+    """
+    Finds the recipes missing at most max_missing required ingredients, ranked by how few are missing
+    """
+    try:
+        matches = get_recipe_index(db).match_near(ingredients, max_missing, limit)
+        # The index can be behind other workers' deletes, those recipes are left out
+        recipes = load_recipe_dicts_by_id(db, [recipe_id for recipe_id, _, _ in matches])
+        # Plain dicts shaped like NearRecipe
+        return fast_response(success=True,
+                             data=[{'recipe': recipes[recipe_id], 'missing': missing, 'optional_coverage': coverage}
+                                   for recipe_id, missing, coverage in matches if recipe_id in recipes])
+    except Exception as e:
+        return Response(success=False, message=str(e))
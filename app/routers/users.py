@@ -1,106 +1,118 @@
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from kitchenLibrary.app.matching import cookable_cache
 from kitchenLibrary.app.models.kitchen import Kitchen
 from kitchenLibrary.app.models.user import User
-from kitchenLibrary.app.util import Response, encrypt, check_referenced_user_permissions, decrypt
-from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.passwords import check_password, hash_password, needs_rehash
+from kitchenLibrary.app.tokens import issue_token, now_ms, revoke_user
+from kitchenLibrary.app.util import Response, check_referenced_user_permissions_async, resolve_user_id_async
+from kitchenLibrary.app.models import get_async_db
 
 router = APIRouter()
 
 
 @router.put('/users/{username}', tags=['users'], response_model=Response)
 async def add_user(username: str, password: str, can_write: Optional[bool] = False, can_delete: Optional[bool] = False,
-                   can_alter_users: Optional[bool] = False) -> Response:
+                   can_alter_users: Optional[bool] = False, db: AsyncSession = Depends(get_async_db)) -> Response:
     """
     Adds a new user to the database.
     """
-    with get_session() as db:
-        if db.query(User).filter(User.name == username).count():
-            return Response(success=False, message="User already exists.")
+    if await db.scalar(select(func.count()).select_from(User).where(User.name == username)):
+        return Response(success=False, message="User already exists.")
 
-        new_user = User(name=username)
-        new_user.set_password(password)
-        new_user.set_permissions(can_write, can_delete, can_alter_users)
+    new_user = User(name=username)
+    new_user.password = await hash_password(password)
+    new_user.set_permissions(can_write, can_delete, can_alter_users)
 
-        db.add(new_user)
-        db.commit()
-        return Response(success=True)
+    db.add(new_user)
+    await db.commit()
+    return Response(success=True)
 
 
 @router.post('/users/signIn/{username}', tags=['users'], response_model=Response)
-async def sign_in(username: str, password: str) -> Response:
+async def sign_in(username: str, password: str, db: AsyncSession = Depends(get_async_db)) -> Response:
     """
     Tries to log a user in.
 
     Returns:
-        Response with encrypted username as data
+        Response with a signed access token as data
     """
-    with get_session() as db:
-        try:
-            user_db = db.query(User).filter(User.name == username).first()
-            if not user_db:
-                return Response(success=False, message='User not found.')
-            if not user_db.check_password(password):
-                return Response(success=False, message='Password incorrect')
-            return Response(success=True, data=encrypt(str(user_db.id).encode('utf-8')))
-        except Exception as e:
-            return Response(success=False, message=str(e))
+    try:
+        user_db = (await db.execute(select(User).where(User.name == username))).scalars().first()
+        if not user_db:
+            return Response(success=False, message='User not found.')
+        if not await check_password(password, user_db.password):
+            return Response(success=False, message='Password incorrect')
+        if needs_rehash(user_db.password):
+            # Cost factor changed since this hash was made
+            user_db.password = await hash_password(password)
+            await db.commit()
+        return Response(success=True, data=issue_token(user_db.id, user_db.permissions))
+    except Exception as e:
+        return Response(success=False, message=str(e))
 
 
 @router.put('/users/updatePermissions/{username}', tags=['users'], response_model=Response)
 async def update_permissions(username: str, reference_id: str, can_write: Optional[bool] = False, can_delete: Optional[bool] = False,
-                             can_alter_users: Optional[bool] = False) -> Response:
+                             can_alter_users: Optional[bool] = False, db: AsyncSession = Depends(get_async_db)) -> Response:
     """
     Updates permissions on a user
     """
-    with get_session() as db:
-        try:
-            if not check_referenced_user_permissions(db, reference_id, False, False, True):
-                return Response(success=False, message='Reference user cannot perform this operation')
-            user_db = db.query(User).filter(User.name == username).first()
-            if not user_db:
-                return Response(success=False, message="User not found.")
-            user_db.set_permissions(can_write, can_delete, can_alter_users)
-            db.commit()
-            return Response(success=True)
-        except Exception as e:
-            return Response(success=False, message=str(e))
+    try:
+        if not await check_referenced_user_permissions_async(db, reference_id, False, False, True):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        user_db = (await db.execute(select(User).where(User.name == username))).scalars().first()
+        if not user_db:
+            return Response(success=False, message="User not found.")
+        user_db.set_permissions(can_write, can_delete, can_alter_users)
+        user_db.tokens_revoked_at = now_ms()  # Old tokens carry the old permissions
+        await db.commit()
+        revoke_user(user_db.id, user_db.tokens_revoked_at)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
 
 
 @router.put('/users/updatePassword/{user_id}', tags=['users'], response_model=Response)
-async def update_password(user_id: str, password: str) -> Response:
+async def update_password(user_id: str, password: str, db: AsyncSession = Depends(get_async_db)) -> Response:
     """
     Updates password on a user
     """
-    with get_session() as db:
-        try:
-            user_db = db.query(User).filter(User.name == decrypt(user_id)).first()
-            if not user_db:
-                return Response(success=False, message="User not found.")
-            user_db.set_password(password)
-            db.commit()
-            return Response(success=True)
-        except Exception as e:
-            return Response(success=False, message=str(e))
+    try:
+        resolved_id = await resolve_user_id_async(db, user_id)
+        user_db = await db.get(User, resolved_id) if resolved_id is not None else None
+        if not user_db:
+            return Response(success=False, message="User not found.")
+        user_db.password = await hash_password(password)
+        user_db.tokens_revoked_at = now_ms()  # Signs out everywhere the old password was used
+        await db.commit()
+        revoke_user(user_db.id, user_db.tokens_revoked_at)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
 
 
 @router.delete('/users/{username}', tags=['users'], response_model=Response)
-async def delete_user(username: str, reference_id: str) -> Response:
+async def delete_user(username: str, reference_id: str, db: AsyncSession = Depends(get_async_db)) -> Response:
     """
     Deletes a user from the database
     """
-    with get_session() as db:
-        try:
-            if not check_referenced_user_permissions(db, reference_id, False, False, True):
-                return Response(success=False, message='Reference user cannot perform this operation')
-            user_db = db.query(User).filter(User.name == username).first()
-            if not user_db:
-                return Response(success=False, message="User not found.")
-            db.query(Kitchen).filter(Kitchen.user_id == user_db.id).delete()  # Delete their kitchen first
-            db.delete(user_db)
-            db.commit()
-            return Response(success=True)
-        except Exception as e:
-            return Response(success=False, message=str(e))
+    try:
+        if not await check_referenced_user_permissions_async(db, reference_id, False, False, True):
+            return Response(success=False, message='Reference user cannot perform this operation')
+        user_db = (await db.execute(select(User).where(User.name == username))).scalars().first()
+        if not user_db:
+            return Response(success=False, message="User not found.")
+        deleted_id = user_db.id
+        await db.execute(delete(Kitchen).where(Kitchen.user_id == deleted_id))  # Delete their kitchen first
+        await db.delete(user_db)
+        await db.commit()
+        revoke_user(deleted_id)
+        cookable_cache.forget_user(deleted_id)
+        return Response(success=True)
+    except Exception as e:
+        return Response(success=False, message=str(e))
@@ -0,0 +1,211 @@
+"""
+Fills an empty database with a synthetic catalog for load tests and benchmarks.
+
+Ingredient popularity follows a Zipf distribution, so a few staples show up in most recipes and kitchens while most
+ingredients are rare, like in a real catalog. The same seed always makes the same catalog.
+
+    DATABASE_URL=sqlite:///catalog.db python -m kitchenLibrary.app.scripts.generate_catalog --recipes 100000
+    python -m kitchenLibrary.app.scripts.generate_catalog --url mysql+pymysql://root:pw@localhost/recipes
+
+Every user gets the same password, user1 can do everything and the others can only read.
+"""
+import argparse
+import os
+import random
+import time
+from itertools import accumulate
+from typing import Iterator, List, Sequence, Tuple, TypeVar
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.schema import Table
+
+from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.models.kitchen import Kitchen
+from kitchenLibrary.app.models.meta import Base
+from kitchenLibrary.app.models.migrations import upgrade
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.models.recipes import Recipe
+from kitchenLibrary.app.models.user import User
+from kitchenLibrary.app.passwords import hash_password_sync
+
+# Rows per INSERT statement and transaction
+CHUNK_SIZE = 10000
+
+T = TypeVar('T')
+
+STAPLES = (
+    'salt', 'black pepper', 'olive oil', 'garlic', 'onion', 'butter', 'egg', 'flour', 'sugar', 'water', 'milk',
+    'tomato', 'lemon', 'vegetable oil', 'carrot', 'celery', 'potato', 'rice', 'chicken breast', 'parsley',
+    'cheddar cheese', 'parmesan cheese', 'bread', 'soy sauce', 'ginger', 'cumin', 'paprika', 'bay leaf', 'thyme',
+    'basil', 'oregano', 'cinnamon', 'honey', 'vinegar', 'baking powder', 'baking soda', 'vanilla extract',
+    'heavy cream', 'ground beef', 'bacon', 'ham', 'shrimp', 'salmon', 'tofu', 'spinach', 'kale', 'broccoli',
+    'cauliflower', 'zucchini', 'bell pepper', 'jalapeno', 'chili powder', 'cilantro', 'lime', 'avocado',
+    'black beans', 'chickpeas', 'lentils', 'pasta', 'noodles', 'mushroom', 'shallot', 'leek', 'scallion',
+    'sesame oil', 'peanut butter', 'jelly', 'apple', 'banana', 'strawberry', 'blueberry', 'orange', 'yogurt',
+    'sour cream', 'mayonnaise', 'mustard', 'ketchup', 'worcestershire sauce', 'chicken stock', 'beef stock',
+    'coconut milk', 'curry powder', 'turmeric', 'nutmeg', 'brown sugar', 'maple syrup', 'oats', 'walnuts',
+    'almonds', 'pecans', 'raisins', 'cornstarch', 'breadcrumbs', 'mozzarella', 'feta', 'ricotta', 'pork chop',
+    'sausage', 'lamb', 'turkey', 'cod', 'tuna', 'corn', 'peas', 'green beans', 'cabbage', 'cucumber', 'radish',
+    'beet', 'sweet potato', 'squash', 'pumpkin', 'eggplant', 'asparagus', 'artichoke', 'olives', 'capers',
+)
+QUALIFIERS = ('fresh', 'dried', 'smoked', 'roasted', 'ground', 'pickled', 'toasted', 'frozen', 'canned', 'wild',
+              'organic', 'chopped', 'red', 'green', 'sweet', 'spicy')
+DISHES = ('stew', 'soup', 'salad', 'pie', 'casserole', 'curry', 'stir fry', 'bake', 'sandwich', 'tacos', 'pasta',
+          'risotto', 'skillet', 'roast', 'bowl', 'tart', 'muffins', 'pancakes', 'chili', 'gratin')
+STYLES = ('easy', 'classic', 'quick', 'rustic', 'creamy', 'crispy', 'spicy', 'smoky', 'hearty', 'lemony', 'garlicky',
+          'sheet pan', 'weeknight', 'grandmas', 'slow cooker', 'one pot')
+STEPS = ('Chop the {}.', 'Heat a pan and add the {}.', 'Stir in the {} and simmer for {} minutes.',
+         'Whisk the {} until smooth.', 'Fold in the {} gently.', 'Season the {} to taste.',
+         'Roast the {} at 400 degrees for {} minutes.', 'Let the {} rest for {} minutes before serving.',
+         'Toss the {} with the dressing.', 'Top with the {} and serve warm.')
+UNITS = ('cup', 'tbsp', 'tsp', 'oz', 'lb', 'g', 'slice', 'clove', 'pinch', 'whole')
+QUANTITIES = (0.25, 0.5, 1, 1.5, 2, 3, 4)
+
+
+def ingredient_names(count: int) -> List[str]:
+    """
+    Distinct ingredient names, most common first
+    """
+    names = list(STAPLES)
+    names += [f'{qualifier} {staple}' for qualifier in QUALIFIERS for staple in STAPLES]
+    names += [f'{first} {second} {staple}' for first in QUALIFIERS for second in QUALIFIERS if first < second
+              for staple in STAPLES]
+    names = list(dict.fromkeys(names))  # 'sweet' + 'potato' is also the staple 'sweet potato'
+    names += [f'ingredient {number}' for number in range(max(0, count - len(names)))]
+    return names[:count]
+
+
+class ZipfSampler:
+    """
+    Picks indexes 0..n-1, index i with weight 1 / (i + 1) ** s
+    """
+
+    def __init__(self, rng: random.Random, n: int, s: float):
+        self.rng = rng
+        self.population = range(n)
+        self.cum_weights = list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+    def distinct(self, k: int) -> List[int]:
+        """
+        k different indexes, fewer if there are not enough
+        """
+        k = min(k, len(self.population))
+        picked = dict.fromkeys(self.rng.choices(self.population, cum_weights=self.cum_weights, k=k))
+        while len(picked) < k:
+            picked.update(dict.fromkeys(self.rng.choices(self.population, cum_weights=self.cum_weights, k=k)))
+        return list(picked)[:k]
+
+
+def _chunks(rows: Iterator[T]) -> Iterator[List[T]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert(engine: Engine, table: Table, rows: Iterator[dict]) -> int:
+    start = time.perf_counter()
+    count = 0
+    for chunk in _chunks(rows):
+        with engine.begin() as conn:
+            conn.execute(table.insert(), chunk)
+        count += len(chunk)
+    print(f'{table.name:<20} {count:>10} rows {time.perf_counter() - start:>8.1f} s')
+    return count
+
+
+def _recipes(args: argparse.Namespace, rng: random.Random, names: Sequence[str]) -> Iterator[Tuple[dict, List[dict]]]:
+    """
+    Recipe rows, each with the rows linking it to its ingredients
+    """
+    sampler = ZipfSampler(rng, len(names), args.zipf)
+    used_names = set()
+    for recipe_id in range(1, args.recipes + 1):
+        size = min(args.max_recipe_size, 3 + int(rng.expovariate(1 / args.mean_recipe_size)))
+        ingredient_ids = sampler.distinct(size)
+        main = names[ingredient_ids[0]]
+
+        name = f'{rng.choice(STYLES)} {main} {rng.choice(DISHES)}'
+        if name in used_names:
+            name = f'{name} {recipe_id}'
+        used_names.add(name)
+
+        steps = [rng.choice(STEPS).format(names[rng.choice(ingredient_ids)], rng.randint(2, 45))
+                 for _ in range(rng.randint(3, 8))]
+        links = [{'recipe_id': recipe_id,
+                  'ingredient_id': ingredient_id + 1,
+                  'quantity': rng.choice(QUANTITIES),
+                  'unit': rng.choice(UNITS),
+                  'required': position == 0 or rng.random() < args.required_ratio}
+                 for position, ingredient_id in enumerate(ingredient_ids)]
+        yield {'id': recipe_id, 'name': name[:128],
+               'directions': '\n'.join(f'{number}. {step}' for number, step in enumerate(steps, 1))}, links
+
+
+def _insert_recipes(engine: Engine, recipes: Iterator[Tuple[dict, List[dict]]]) -> None:
+    """
+    Inserts recipes and their links a chunk of recipes at a time, so memory doesn't grow with the catalog
+    """
+    start = time.perf_counter()
+    recipe_count = link_count = 0
+    for chunk in _chunks(recipes):
+        links = [link for _, recipe_links in chunk for link in recipe_links]
+        with engine.begin() as conn:
+            conn.execute(Recipe.__table__.insert(), [recipe for recipe, _ in chunk])
+            conn.execute(RecipeIngredient.__table__.insert(), links)
+        recipe_count += len(chunk)
+        link_count += len(links)
+    print(f'{"recipes":<20} {recipe_count:>10} rows {time.perf_counter() - start:>8.1f} s')
+    print(f'{"recipe_ingredients":<20} {link_count:>10} rows')
+
+
+def _kitchens(args: argparse.Namespace, rng: random.Random, ingredient_count: int) -> Iterator[dict]:
+    sampler = ZipfSampler(rng, ingredient_count, args.zipf)
+    for user_id in range(1, args.users + 1):
+        size = min(args.max_kitchen_size, 5 + int(rng.expovariate(1 / args.mean_kitchen_size)))
+        for ingredient_id in sampler.distinct(size):
+            yield {'user_id': user_id, 'ingredient_id': ingredient_id + 1}
+
+
+def main(args: argparse.Namespace) -> None:
+    engine = create_engine(args.url)
+    Base.metadata.create_all(engine)
+    upgrade(engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Recipe.__table__)).scalar():
+            raise SystemExit(f'{args.url} already has recipes, use an empty database')
+
+    rng = random.Random(args.seed)
+    names = ingredient_names(args.ingredients)
+    _insert(engine, Ingredient.__table__, ({'id': number, 'name': name} for number, name in enumerate(names, 1)))
+
+    _insert_recipes(engine, _recipes(args, rng, names))
+
+    password = hash_password_sync(args.password)
+    _insert(engine, User.__table__, ({'id': user_id, 'name': f'user{user_id}', 'password': password,
+                                      'permissions': 7 if user_id == 1 else 0}
+                                     for user_id in range(1, args.users + 1)))
+    _insert(engine, Kitchen.__table__, _kitchens(args, rng, len(names)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('DATABASE_URL'), required=not os.getenv('DATABASE_URL'),
+                        help='SQLAlchemy URL of the database to fill, DATABASE_URL by default')
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--ingredients', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--password', default='password', help='password of every user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of ingredient popularity')
+    parser.add_argument('--mean-recipe-size', type=float, default=5, help='mean ingredients per recipe beyond 3')
+    parser.add_argument('--max-recipe-size', type=int, default=25)
+    parser.add_argument('--required-ratio', type=float, default=0.8, help='share of ingredients that are required')
+    parser.add_argument('--mean-kitchen-size', type=float, default=20, help='mean ingredients per kitchen beyond 5')
+    parser.add_argument('--max-kitchen-size', type=int, default=300)
+    main(parser.parse_args())
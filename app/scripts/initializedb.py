@@ -5,6 +5,7 @@ from kitchenLibrary.app.models import (
 from kitchenLibrary.app.models.ingredients import Ingredient
 from kitchenLibrary.app.models.kitchen import Kitchen
 from kitchenLibrary.app.models.meta import Base
+from kitchenLibrary.app.models.migrations import upgrade
 from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
 from kitchenLibrary.app.models.recipes import Recipe
 from kitchenLibrary.app.models.user import User
@@ -13,7 +14,7 @@ from kitchenLibrary.app.models.user import User
 def main():
     engine = get_engine()
     Base.metadata.create_all(engine)
-
+    upgrade(engine)
 
     with get_session() as db:
 
@@ -1,10 +1,13 @@
 from kitchenLibrary.app.models import get_engine
 from kitchenLibrary.app.models.meta import Base
+from kitchenLibrary.app.models.migrations import upgrade
 
 
 def main():
     engine = get_engine()
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(engine)  # New tables
+    for version in upgrade(engine):  # Changes to existing tables
+        print(f'Applied migration {version}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,220 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from kitchenLibrary.app.matching import CatalogIndex
+from kitchenLibrary.app.models.recipes import Recipe
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Words too common in directions to help ranking, skipping them keeps postings short
+STOP_WORDS = frozenset(('a', 'an', 'and', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'into', 'is', 'it', 'of',
+                        'on', 'or', 'the', 'then', 'to', 'until', 'with'))
+# A word in the name counts as this many words in the directions
+NAME_WEIGHT = 3
+# BM25 term frequency saturation and length normalization
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase words of a text without stop words
+    """
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+class RecipeSearchIndex(CatalogIndex):
+    """
+    Inverted index over recipe names and directions ranked with BM25.
+
+    Each word's postings are also kept sorted by how much they add to a score (built lazily per word), so a
+    search walks the lists from the top and stops once nothing further down can make the top results. Common
+    words then cost about as much as rare ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)  # token -> recipe id -> weighted frequency
+        self.impacts: Dict[str, List[Tuple[float, int]]] = {}  # token -> (score without idf, recipe id), best first
+        self.lengths: Dict[int, int] = {}  # recipe id -> weighted number of tokens
+        self.norms: Dict[int, float] = {}  # recipe id -> BM25 length normalization
+        self.norm_average = 0.0  # average length the norms were computed with
+        self.terms: Dict[int, Tuple[str, ...]] = {}  # recipe id -> its distinct tokens, to remove it again
+        self.names: Dict[int, str] = {}
+        self.total_length = 0
+
+    def _build(self, db: Session) -> 'RecipeSearchIndex':
+        """
+        A new index from the recipes table
+        """
+        fresh = RecipeSearchIndex()
+        for recipe_id, name, directions in db.query(Recipe.id, Recipe.name, Recipe.directions).yield_per(1000):
+            fresh._add(recipe_id, name, directions)
+        fresh._renormalize()
+        return fresh
+
+    def _swap(self, fresh: 'RecipeSearchIndex') -> None:
+        self.postings = fresh.postings
+        self.impacts = fresh.impacts
+        self.lengths = fresh.lengths
+        self.norms = fresh.norms
+        self.norm_average = fresh.norm_average
+        self.terms = fresh.terms
+        self.names = fresh.names
+        self.total_length = fresh.total_length
+
+    def _renormalize(self) -> None:
+        """
+        Recomputes every length norm. Only needed once the average length has drifted, since norms of recipes
+        added in between use the old average.
+        """
+        self.norm_average = self.total_length / len(self.lengths) if self.lengths else 0.0
+        self.norms = {recipe_id: self._norm(length) for recipe_id, length in self.lengths.items()}
+        self.impacts = {}
+
+    def _norm(self, length: int) -> float:
+        return K1 * (1 - B + B * length / self.norm_average) if self.norm_average else K1
+
+    def _add(self, recipe_id: int, name: str, directions: str) -> None:
+        if recipe_id in self.names:
+            self._remove(recipe_id)
+        frequencies = Counter(tokenize(directions))
+        for token in tokenize(name):
+            frequencies[token] += NAME_WEIGHT
+        for token, frequency in frequencies.items():
+            self.postings[token][recipe_id] = frequency
+            self.impacts.pop(token, None)
+        self.terms[recipe_id] = tuple(frequencies)
+        self.names[recipe_id] = name
+        self.lengths[recipe_id] = sum(frequencies.values())
+        self.norms[recipe_id] = self._norm(self.lengths[recipe_id])
+        self.total_length += self.lengths[recipe_id]
+
+    def _remove(self, recipe_id: int) -> None:
+        name = self.names.pop(recipe_id, None)
+        if name is None:
+            return
+        self.total_length -= self.lengths.pop(recipe_id)
+        del self.norms[recipe_id]
+        for token in self.terms.pop(recipe_id):
+            self.impacts.pop(token, None)
+            recipes = self.postings[token]
+            recipes.pop(recipe_id, None)
+            if not recipes:
+                del self.postings[token]
+
+    def _changed(self) -> None:
+        if self.lengths and abs(self.total_length / len(self.lengths) - self.norm_average) > 0.05 * self.norm_average:
+            self._renormalize()
+
+    def add_recipe(self, recipe_id: int, name: str, directions: str) -> None:
+        """
+        Adds a committed recipe
+        """
+        with self.lock:
+            self._apply(self._add_recipe, recipe_id, name, directions)
+
+    def _add_recipe(self, recipe_id: int, name: str, directions: str) -> None:
+        self._add(recipe_id, name, directions)
+        self._changed()
+
+    def remove_recipes(self, recipe_ids: Iterable[int]) -> None:
+        """
+        Removes deleted recipes
+        """
+        with self.lock:
+            self._apply(self._remove_recipes, list(recipe_ids))
+
+    def _remove_recipes(self, recipe_ids: List[int]) -> None:
+        for recipe_id in recipe_ids:
+            self._remove(recipe_id)
+        self._changed()
+
+    def _impact(self, frequency: int, recipe_id: int) -> float:
+        return frequency * (K1 + 1) / (frequency + self.norms[recipe_id])
+
+    def _sorted_impacts(self, token: str) -> List[Tuple[float, int]]:
+        impacts = self.impacts.get(token)
+        if impacts is None:
+            impacts = sorted(((self._impact(frequency, recipe_id), recipe_id)
+                              for recipe_id, frequency in self.postings[token].items()), reverse=True)
+            self.impacts[token] = impacts
+        return impacts
+
+    def _score(self, recipe_id: int, weights: List[Tuple[float, Dict[int, int]]]) -> float:
+        return sum(idf * self._impact(recipes[recipe_id], recipe_id)
+                   for idf, recipes in weights if recipe_id in recipes)
+
+    def search(self, query: str, limit: int, offset: int = 0,
+               only: Optional[Set[int]] = None) -> Tuple[List[Tuple[str, float]], bool]:
+        """
+        Ranks recipes by BM25 over the query's words.
+
+        Arguments:
+            query: what the user typed
+            limit: most results to return
+            offset: how many of the best results to skip
+            only: if given, only these recipe ids can match
+
+        Returns:
+            (recipe name, score) from best to worst, and if there are more results after these
+        """
+        wanted = offset + limit + 1
+        with self.lock:
+            count = len(self.lengths)
+            tokens = [token for token in set(tokenize(query)) if token in self.postings]
+            weights = [(math.log(1 + (count - len(self.postings[token]) + 0.5) / (len(self.postings[token]) + 0.5)),
+                        self.postings[token])
+                       for token in tokens]
+            if not weights:
+                return [], False
+
+            best: List[Tuple[float, int]] = []  # min-heap of (score, -recipe id)
+            if only is not None:
+                for recipe_id in only:
+                    score = self._score(recipe_id, weights)
+                    if score:
+                        self._keep(best, wanted, (score, -recipe_id))
+            else:
+                lists = [(idf, self._sorted_impacts(token)) for (idf, _), token in zip(weights, tokens)]
+                seen = set()
+                depth = 0
+                while True:
+                    threshold = 0.0
+                    for idf, impacts in lists:
+                        if depth < len(impacts):
+                            impact, recipe_id = impacts[depth]
+                            threshold += idf * impact
+                            if recipe_id not in seen:
+                                seen.add(recipe_id)
+                                self._keep(best, wanted, (self._score(recipe_id, weights), -recipe_id))
+                    # Nothing deeper in any list can beat the worst result kept
+                    if not threshold or (len(best) == wanted and best[0][0] > threshold):
+                        break
+                    depth += 1
+
+            ranked = sorted(best, reverse=True)
+            page = [(self.names[-negative_id], score) for score, negative_id in ranked[offset:offset + limit]]
+            return page, len(ranked) > offset + limit
+
+    @staticmethod
+    def _keep(best: List[Tuple[float, int]], size: int, item: Tuple[float, int]) -> None:
+        if len(best) < size:
+            heapq.heappush(best, item)
+        elif item > best[0]:
+            heapq.heapreplace(best, item)
+
+
+recipe_search_index = RecipeSearchIndex()
+
+
+def get_recipe_search_index(db: Session) -> RecipeSearchIndex:
+    """
+    Gets the process wide search index, loading it first if needed
+    """
+    recipe_search_index.load_if_stale(db)
+    return recipe_search_index
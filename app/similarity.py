@@ -0,0 +1,350 @@
+import hashlib
+import heapq
+import os
+import random
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from kitchenLibrary.app.matching import CatalogIndex, RecipeIndex, get_recipe_index, recipe_index
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.models.recipes import Recipe
+
+# Signatures are BANDS * ROWS hashes long. Recipes with Jaccard similarity s share a bucket in at least one band
+# with chance 1 - (1 - s ** ROWS) ** BANDS, more bands find more of the similar recipes but also more candidates.
+BANDS = int(os.getenv('SIMILARITY_BANDS', '24'))
+ROWS = int(os.getenv('SIMILARITY_ROWS', '3'))
+# Candidates compared exactly per result asked for, the ones sharing the most buckets first
+RERANK_FACTOR = 100
+# Where signatures are saved after a load and read back by the next one, unset to keep them in memory only
+INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH')
+# What an optional ingredient counts for against a required one in a weighted similarity
+OPTIONAL_WEIGHT = 0.5
+SEED = 20210401
+# Largest prime below 2^32, the hash functions work modulo it so every signature value fits 4 bytes
+PRIME = (1 << 32) - 5
+FILE_MAGIC = b'KLM2'
+FILE_HEADER = struct.Struct('<4s?IIQ')  # magic, little endian, bands, rows, recipes
+
+
+def _hash_parameters(count: int) -> List[Tuple[int, int]]:
+    rng = random.Random(SEED)
+    return [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(count)]
+
+
+def fingerprint(ingredient_ids: Iterable[int]) -> int:
+    """
+    64 bit digest of a recipe's ingredient set, saved with its signature to tell if the signature still fits
+    """
+    digest = hashlib.blake2b(array('q', sorted(set(ingredient_ids))).tobytes(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+# (required ingredient ids, optional ingredient ids) of a recipe
+Ingredients = Tuple[Set[int], Set[int]]
+
+
+def jaccard(a: Ingredients, b: Ingredients, optional_weight: float = 1.0) -> float:
+    """
+    Jaccard similarity of two recipes' ingredients, weighted so an optional ingredient counts optional_weight.
+
+    An ingredient required in one recipe and optional in the other counts as optional in both.
+    """
+    required_a, optional_a = a
+    required_b, optional_b = b
+    shared = len(required_a & required_b) + optional_weight * (len(required_a & optional_b) +
+                                                               len(optional_a & required_b) +
+                                                               len(optional_a & optional_b))
+    total = (len(required_a) + len(required_b) + optional_weight * (len(optional_a) + len(optional_b))) - shared
+    return shared / total if total else 0.0
+
+
+class SimilarityIndex(CatalogIndex):
+    """
+    MinHash signatures of every recipe's ingredient set with locality sensitive hashing buckets.
+
+    Recipes landing in the same bucket in any band are the candidates for a similar recipe, and only those are
+    compared exactly, so a lookup costs about as much as its candidates instead of the whole catalog.
+
+    Everything loaded sits in flat arrays: signatures by slot, and per band the bucket key of every slot sorted so a
+    bucket is a binary search away. Recipes added since go into small per band dicts and deleted ones are marked
+    dead, both are folded into the arrays by the next load. A reload keeps the signatures it already has for recipes
+    whose ingredients haven't changed, and they can be saved to a file so a new process doesn't hash every recipe
+    again.
+    """
+
+    def __init__(self, recipe_index: RecipeIndex, path: Optional[str] = INDEX_PATH):
+        super().__init__()
+        self.recipe_index = recipe_index
+        self.path = path
+        self.size = BANDS * ROWS
+        self.parameters = _hash_parameters(self.size)
+        self.ingredient_hashes: Dict[int, Tuple[int, ...]] = {}  # ingredient id -> its value under each hash
+        self.signatures = array('I')  # slot * size -> signature of the recipe in that slot
+        self.recipe_ids = array('q')  # slot -> recipe id, 0 once deleted
+        self.fingerprints = array('Q')  # slot -> fingerprint of the recipe's ingredients
+        self.slots: Dict[int, int] = {}  # recipe id -> slot
+        self.band_keys = [array('q') for _ in range(BANDS)]  # per band, sorted bucket keys of the loaded slots
+        self.band_slots = [array('I') for _ in range(BANDS)]  # per band, slot of each key in band_keys
+        self.added: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(BANDS)]  # per band, key -> slots
+        self.unsaved = False  # if the recipes differ from what was last saved at path
+
+    def _build(self, db: Session) -> 'SimilarityIndex':
+        """
+        A new index, hashing only the recipes without a signature for their current ingredients in this index or
+        saved at path. The file is only read if this index is missing some.
+
+        Recipes are never edited in place, but the id of a deleted recipe can be given to a new one, so a signature
+        is only reused while the fingerprint kept with it matches the recipe's ingredients. Ingredients come from
+        the recipe index, which get_similarity_index loads first.
+        """
+        fresh = SimilarityIndex(self.recipe_index, self.path)
+        fresh.ingredient_hashes = self.ingredient_hashes
+        with self.lock:
+            # Changes only append to the arrays, so a kept slot can be read from them without the lock
+            slots, fingerprints, signatures = dict(self.slots), self.fingerprints, self.signatures
+            unsaved = self.unsaved
+        saved: Optional[Dict[int, Tuple[int, array]]] = None
+        recipe_ids = [recipe_id for recipe_id, in db.query(Recipe.id).order_by(Recipe.id).all()]
+        index = self.recipe_index
+        with index.lock:
+            ingredients = {recipe_id: index.required[recipe_id] | index.optional[recipe_id]
+                           for recipe_id in recipe_ids if recipe_id in index.required}
+        # Recipes the recipe index doesn't have yet are read from the database
+        unknown = [recipe_id for recipe_id in recipe_ids if recipe_id not in ingredients]
+        for start in range(0, len(unknown), 1000):
+            for recipe_id, ingredient_id in db.query(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id) \
+                    .filter(RecipeIngredient.recipe_id.in_(unknown[start:start + 1000])).all():
+                ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+
+        hashed = 0
+        for slot, recipe_id in enumerate(recipe_ids):
+            recipe_ingredients = ingredients.get(recipe_id, ())
+            recipe_fingerprint = fingerprint(recipe_ingredients)
+            kept = slots.get(recipe_id)
+            if kept is not None and fingerprints[kept] == recipe_fingerprint:
+                fresh.signatures.extend(signatures[kept * self.size:(kept + 1) * self.size])
+            else:
+                if saved is None:
+                    saved = fresh._read(self.path) if self.path and os.path.exists(self.path) else {}
+                saved_fingerprint, signature = saved.get(recipe_id, (None, None))
+                if saved_fingerprint != recipe_fingerprint:
+                    signature = fresh._signature(recipe_ingredients)
+                    hashed += 1
+                fresh.signatures.extend(signature)
+            fresh.recipe_ids.append(recipe_id)
+            fresh.fingerprints.append(recipe_fingerprint)
+            fresh.slots[recipe_id] = slot
+        fresh._build_bands()
+        # Rewritten unless it holds exactly these signatures: nothing was hashed and either every signature came from
+        # this index, which matched the file and had the same recipes, or the file has the same recipes
+        if saved is None:
+            fresh.unsaved = unsaved or len(slots) != len(recipe_ids)
+        else:
+            fresh.unsaved = unsaved or hashed > 0 or len(saved) != len(recipe_ids)
+        if self.path and fresh.unsaved:
+            fresh.save(self.path)
+            fresh.unsaved = False
+        return fresh
+
+    def _swap(self, fresh: 'SimilarityIndex') -> None:
+        self.ingredient_hashes = fresh.ingredient_hashes
+        self.signatures = fresh.signatures
+        self.recipe_ids = fresh.recipe_ids
+        self.fingerprints = fresh.fingerprints
+        self.slots = fresh.slots
+        self.band_keys = fresh.band_keys
+        self.band_slots = fresh.band_slots
+        self.added = fresh.added
+        self.unsaved = fresh.unsaved
+
+    def _build_bands(self) -> None:
+        """
+        Sorts every slot's bucket key in each band
+        """
+        raw = self.signatures.tobytes()
+        stride = self.size * self.signatures.itemsize
+        width = ROWS * self.signatures.itemsize
+        for band in range(BANDS):
+            offset = band * width
+            keys = [hash(raw[start:start + width]) for start in range(offset, len(raw), stride)]
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self.band_keys[band] = array('q', [keys[slot] for slot in order])
+            self.band_slots[band] = array('I', order)
+
+    def _signature(self, ingredient_ids: Iterable[int]) -> array:
+        """
+        Smallest value of each hash over the ingredients, each ingredient's values computed once per process
+        """
+        values = []
+        for ingredient_id in ingredient_ids:
+            hashes = self.ingredient_hashes.get(ingredient_id)
+            if hashes is None:
+                hashes = self.ingredient_hashes[ingredient_id] = tuple((a * ingredient_id + b) % PRIME
+                                                                      for a, b in self.parameters)
+            values.append(hashes)
+        return array('I', map(min, zip(*values)) if values else [PRIME] * self.size)
+
+    def _keys(self, slot: int) -> List[int]:
+        """
+        Bucket key of a slot in each band
+        """
+        raw = self.signatures[slot * self.size:(slot + 1) * self.size].tobytes()
+        width = ROWS * self.signatures.itemsize
+        return [hash(raw[band * width:(band + 1) * width]) for band in range(BANDS)]
+
+    def add_recipe(self, recipe_id: int, ingredient_ids: Iterable[int]) -> None:
+        """
+        Adds a committed recipe
+        """
+        with self.lock:
+            self._apply(self._add_recipe, recipe_id, list(ingredient_ids))
+
+    def _add_recipe(self, recipe_id: int, ingredient_ids: List[int]) -> None:
+        self._remove(recipe_id)
+        slot = len(self.recipe_ids)
+        self.signatures.extend(self._signature(ingredient_ids))
+        self.recipe_ids.append(recipe_id)
+        self.fingerprints.append(fingerprint(ingredient_ids))
+        self.slots[recipe_id] = slot
+        for added, key in zip(self.added, self._keys(slot)):
+            added[key].append(slot)
+        self.unsaved = True
+
+    def _remove(self, recipe_id: int) -> None:
+        slot = self.slots.pop(recipe_id, None)
+        if slot is not None:
+            self.recipe_ids[slot] = 0
+
+    def remove_recipes(self, recipe_ids: Iterable[int]) -> None:
+        """
+        Removes deleted recipes
+        """
+        with self.lock:
+            self._apply(self._remove_recipes, list(recipe_ids))
+
+    def _remove_recipes(self, recipe_ids: List[int]) -> None:
+        for recipe_id in recipe_ids:
+            self._remove(recipe_id)
+        self.unsaved = True
+
+    def candidates(self, recipe_id: int) -> Counter:
+        """
+        Recipes sharing a bucket with a recipe in any band
+
+        Returns:
+            recipe id -> number of bands it shares a bucket in
+        """
+        with self.lock:
+            slot = self.slots.get(recipe_id)
+            if slot is None:
+                return Counter()
+            slots = Counter()
+            for keys, band_slots, added, key in zip(self.band_keys, self.band_slots, self.added, self._keys(slot)):
+                start = bisect_left(keys, key)
+                slots.update(band_slots[start:bisect_right(keys, key, start)])
+                slots.update(added.get(key, ()))
+            del slots[slot]
+            recipe_ids = self.recipe_ids
+            return Counter({recipe_ids[other]: count for other, count in slots.items() if recipe_ids[other]})
+
+    def _ingredients(self, recipe_id: int) -> Optional[Ingredients]:
+        required = self.recipe_index.required.get(recipe_id)
+        return None if required is None else (required, self.recipe_index.optional[recipe_id])
+
+    def similar(self, recipe_id: int, k: int, weighted: bool = False) -> List[Tuple[int, float]]:
+        """
+        The recipes most similar to one by exact Jaccard similarity of their ingredient sets.
+
+        Only the k * RERANK_FACTOR candidates sharing the most buckets are compared exactly, as sharing more of
+        them means a higher estimated similarity.
+
+        Arguments:
+            recipe_id: recipe to find others like
+            k: most recipes to return
+            weighted: count optional ingredients as OPTIONAL_WEIGHT of a required one
+
+        Returns:
+            (recipe id, similarity) of up to k recipes from most to least similar
+        """
+        candidates = self.candidates(recipe_id).most_common(k * RERANK_FACTOR)
+        optional_weight = OPTIONAL_WEIGHT if weighted else 1.0
+        with self.recipe_index.lock:
+            target = self._ingredients(recipe_id)
+            if target is None:
+                return []
+            scored = []
+            for candidate, _ in candidates:
+                ingredients = self._ingredients(candidate)
+                if ingredients is not None:
+                    scored.append((jaccard(target, ingredients, optional_weight), -candidate))
+        return [(-negative_id, score) for score, negative_id in heapq.nlargest(k, scored)]
+
+    def save(self, path: str) -> None:
+        """
+        Writes the signature and ingredient fingerprint of every recipe to a file, replacing it only once the new
+        one is complete
+        """
+        with self.lock:
+            recipe_ids = array('q', (recipe_id for recipe_id in self.recipe_ids if recipe_id))
+            if len(recipe_ids) == len(self.recipe_ids):
+                fingerprints = array('Q', self.fingerprints)
+                signatures = array('I', self.signatures)
+            else:
+                fingerprints, signatures = array('Q'), array('I')
+                for slot, recipe_id in enumerate(self.recipe_ids):
+                    if recipe_id:
+                        fingerprints.append(self.fingerprints[slot])
+                        signatures.extend(self.signatures[slot * self.size:(slot + 1) * self.size])
+        partial = f'{path}.{os.getpid()}.tmp'
+        with open(partial, 'wb') as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, sys.byteorder == 'little', BANDS, ROWS, len(recipe_ids)))
+            recipe_ids.tofile(f)
+            fingerprints.tofile(f)
+            signatures.tofile(f)
+        os.replace(partial, path)
+
+    def _read(self, path: str) -> Dict[int, Tuple[int, array]]:
+        """
+        Signatures saved by save, nothing if the file was made with other settings or on another byte order
+
+        Returns:
+            recipe id -> (fingerprint of its ingredients, signature)
+        """
+        with open(path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                return {}
+            magic, little, bands, rows, count = FILE_HEADER.unpack(header)
+            if (magic, little, bands, rows) != (FILE_MAGIC, sys.byteorder == 'little', BANDS, ROWS):
+                return {}
+            recipe_ids, fingerprints, signatures = array('q'), array('Q'), array('I')
+            recipe_ids.fromfile(f, count)
+            fingerprints.fromfile(f, count)
+            signatures.fromfile(f, count * self.size)
+        return {recipe_id: (fingerprints[i], signatures[i * self.size:(i + 1) * self.size])
+                for i, recipe_id in enumerate(recipe_ids)}
+
+    def memory_bytes(self) -> int:
+        """
+        Bytes held by the signature and band arrays
+        """
+        arrays = [self.signatures, self.recipe_ids, self.fingerprints] + self.band_keys + self.band_slots
+        return sum(values.itemsize * len(values) for values in arrays)
+
+
+similarity_index = SimilarityIndex(recipe_index)
+
+
+def get_similarity_index(db: Session) -> SimilarityIndex:
+    """
+    Gets the process wide similarity index, loading it and the recipe index it reranks with first if needed
+    """
+    get_recipe_index(db)
+    similarity_index.load_if_stale(db)
+    return similarity_index
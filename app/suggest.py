@@ -0,0 +1,131 @@
+import heapq
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy.orm import Session
+
+from kitchenLibrary.app.matching import CatalogIndex
+from kitchenLibrary.app.models.ingredients import Ingredient
+
+# Least trigram similarity for a fuzzy suggestion
+MIN_SIMILARITY = 0.3
+
+
+def trigrams(text: str) -> Set[str]:
+    """
+    Padded character trigrams of a name, so the start and end of a word weigh more
+    """
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientSuggester(CatalogIndex):
+    """
+    Autocomplete over ingredient names.
+
+    Prefix matches come from a sorted array of names (a binary search finds where the prefix starts, the matches
+    follow it). When there are not enough of those, names sharing the most trigrams with the query fill the rest,
+    which catches typos like "chese".
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.names: List[str] = []
+        self.trigram_postings: Dict[str, Set[str]] = defaultdict(set)  # trigram -> names containing it
+        self.trigram_counts: Dict[str, int] = {}  # name -> number of trigrams in it
+
+    def _build(self, db: Session) -> 'IngredientSuggester':
+        """
+        A new index from the ingredients table
+        """
+        fresh = IngredientSuggester()
+        fresh._add(name for name, in db.query(Ingredient.name).all())
+        return fresh
+
+    def _swap(self, fresh: 'IngredientSuggester') -> None:
+        self.names = fresh.names
+        self.trigram_postings = fresh.trigram_postings
+        self.trigram_counts = fresh.trigram_counts
+
+    def _add(self, names: Iterable[str]) -> None:
+        new_names = set(names) - self.trigram_counts.keys()
+        if len(new_names) == 1:
+            insort(self.names, next(iter(new_names)))
+        elif new_names:
+            self.names = sorted(self.names + list(new_names))
+        for name in new_names:
+            grams = trigrams(name)
+            self.trigram_counts[name] = len(grams)
+            for gram in grams:
+                self.trigram_postings[gram].add(name)
+
+    def add(self, names: Iterable[str]) -> None:
+        """
+        Adds committed ingredient names. Names already known are skipped.
+        """
+        with self.lock:
+            self._apply(self._add, list(names))
+
+    def remove(self, names: Iterable[str]) -> None:
+        """
+        Forgets deleted ingredient names
+        """
+        with self.lock:
+            self._apply(self._remove, list(names))
+
+    def _remove(self, names: List[str]) -> None:
+        for name in names:
+            if self.trigram_counts.pop(name, None) is None:
+                continue
+            index = bisect_left(self.names, name)
+            if index < len(self.names) and self.names[index] == name:
+                del self.names[index]
+            for gram in trigrams(name):
+                self.trigram_postings[gram].discard(name)
+
+    def suggest(self, query: str, k: int) -> List[str]:
+        """
+        Finds up to k ingredient names for what a user has typed so far.
+
+        Returns:
+            Prefix matches in alphabetical order, then fuzzy matches from most to least similar
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        with self.lock:
+            suggestions = []
+            index = bisect_left(self.names, query)
+            while len(suggestions) < k and index < len(self.names) and self.names[index].startswith(query):
+                suggestions.append(self.names[index])
+                index += 1
+            if len(suggestions) == k:
+                return suggestions
+
+            query_grams = trigrams(query)
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.trigram_postings.get(gram, ()))
+
+            def similarities():
+                for name, count in shared.items():
+                    similarity = count / (len(query_grams) + self.trigram_counts[name] - count)
+                    if similarity >= MIN_SIMILARITY:
+                        yield similarity, name
+
+            prefixed = set(suggestions)
+            best = heapq.nlargest(k, similarities())
+            suggestions.extend(name for _, name in best if name not in prefixed)
+            return suggestions[:k]
+
+
+ingredient_suggester = IngredientSuggester()
+
+
+def get_ingredient_suggester(db: Session) -> IngredientSuggester:
+    """
+    Gets the process wide ingredient suggester, loading it first if needed
+    """
+    ingredient_suggester.load_if_stale(db)
+    return ingredient_suggester
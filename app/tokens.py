@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+# Seconds an access token stays valid
+TOKEN_TTL = int(os.getenv('TOKEN_TTL', '3600'))
+TOKEN_VERSION = 'v1'
+# Message of TokenExpired, the frontend looks for it to sign the user out
+TOKEN_EXPIRED_MESSAGE = 'Access token expired, sign in again.'
+
+
+class TokenClaims(BaseModel):
+    """
+    What a signed access token says about its user
+    """
+    user_id: int
+    permissions: int
+    issued_at: int  # milliseconds since epoch
+    expires: int  # seconds since epoch
+
+
+class TokenExpired(ValueError):
+    """
+    A correctly signed token past its expiry, told apart from an invalid one so clients know to sign in again
+    """
+
+    def __init__(self):
+        super().__init__(TOKEN_EXPIRED_MESSAGE)
+
+
+def _secret() -> bytes:
+    secret = os.getenv('TOKEN_SECRET') or os.getenv('FERNET_KEY')
+    if not secret:
+        raise RuntimeError('TOKEN_SECRET is not set')
+    return secret.encode('utf-8')
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(_secret(), f'{TOKEN_VERSION}.{payload}'.encode('ascii'), hashlib.sha256).digest())
+
+
+# Seconds a worker trusts what it read of a user's tokens_revoked_at. Bounds how long a token revoked by another
+# worker keeps working here, revocations made by this worker apply at once.
+REVOCATION_CACHE_TTL = float(os.getenv('REVOCATION_CACHE_TTL', '30'))
+
+# user id -> (monotonic time it expires, time in ms before which their tokens are no longer accepted)
+_revoked_before: Dict[int, Tuple[float, int]] = {}
+_revoked_lock = threading.Lock()
+
+
+def now_ms() -> int:
+    """
+    Time in milliseconds since epoch, what issued_at and tokens_revoked_at hold
+    """
+    return int(time.time() * 1000)
+
+
+def remember_revocation(user_id: int, revoked_before: int) -> None:
+    """
+    Caches a user's tokens_revoked_at for REVOCATION_CACHE_TTL seconds
+    """
+    with _revoked_lock:
+        _revoked_before[user_id] = (time.monotonic() + REVOCATION_CACHE_TTL, revoked_before)
+
+
+def revoke_user(user_id: int, revoked_before: Optional[int] = None) -> None:
+    """
+    Rejects every token issued to a user so far, e.g. after their permissions change or they are deleted.
+
+    This only tells the current worker. Store the same time in the user's tokens_revoked_at, in the transaction making
+    the change, so other workers reject the tokens once their cached copy expires.
+
+    Arguments:
+        user_id: whose tokens to reject
+        revoked_before: the time stored in tokens_revoked_at, now by default
+    """
+    remember_revocation(user_id, now_ms() if revoked_before is None else revoked_before)
+
+
+def is_revoked(claims: 'TokenClaims') -> Optional[bool]:
+    """
+    If a token's user revoked it, from the cached tokens_revoked_at.
+
+    Returns:
+        None when the user's revocation time isn't cached, look it up and remember_revocation() it
+    """
+    with _revoked_lock:
+        cached = _revoked_before.get(claims.user_id)
+        if cached is None:
+            return None
+        expires, revoked_before = cached
+        if expires < time.monotonic():
+            del _revoked_before[claims.user_id]
+            return None
+    return claims.issued_at <= revoked_before
+
+
+def is_token(text: str) -> bool:
+    """
+    If text looks like a signed access token rather than a legacy encrypted user id
+    """
+    return text.startswith(TOKEN_VERSION + '.')
+
+
+def issue_token(user_id: int, permissions: int) -> str:
+    """
+    Makes a signed access token for a user that can be checked without the database
+    """
+    now = time.time()
+    payload = _b64encode(json.dumps({'u': user_id,
+                                     'p': permissions,
+                                     'i': int(now * 1000),
+                                     'e': int(now) + TOKEN_TTL}, separators=(',', ':')).encode('utf-8'))
+    return f'{TOKEN_VERSION}.{payload}.{_sign(payload)}'
+
+
+def verify_token(token: str) -> Optional[TokenClaims]:
+    """
+    Checks a token's signature and expiry. Whether it was revoked needs the user's tokens_revoked_at, see
+    is_revoked().
+
+    Returns:
+        The token's claims, or None if the token is not valid
+
+    Raises:
+        TokenExpired: if the token is valid but has expired
+    """
+    try:
+        version, payload, signature = token.split('.')
+        if version != TOKEN_VERSION or not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        raw = json.loads(_b64decode(payload))
+        claims = TokenClaims(user_id=raw['u'], permissions=raw['p'], issued_at=raw['i'], expires=raw['e'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    if claims.expires < time.time():
+        raise TokenExpired()
+    return claims
@@ -0,0 +1,43 @@
+from typing import Dict, List, Optional, Tuple
+
+# Unit name -> (kind, how many of the kind's base unit it is). Volumes are in teaspoons, weights in ounces.
+CONVERSIONS: Dict[str, Tuple[str, float]] = {
+    'tsp': ('volume', 1), 'teaspoon': ('volume', 1), 'teaspoons': ('volume', 1),
+    'tbsp': ('volume', 3), 'tablespoon': ('volume', 3), 'tablespoons': ('volume', 3),
+    'cup': ('volume', 48), 'cups': ('volume', 48),
+    'ml': ('volume', 0.202884), 'l': ('volume', 202.884),
+    'oz': ('weight', 1), 'ounce': ('weight', 1), 'ounces': ('weight', 1),
+    'lb': ('weight', 16), 'lbs': ('weight', 16), 'pound': ('weight', 16), 'pounds': ('weight', 16),
+    'g': ('weight', 0.035274), 'kg': ('weight', 35.274),
+}
+# Units a summed quantity of each kind is given back in, largest first
+DISPLAY_UNITS: Dict[str, List[str]] = {'volume': ['cup', 'tbsp', 'tsp'], 'weight': ['lb', 'oz']}
+
+
+def to_base(quantity: float, unit: Optional[str]) -> Tuple[str, float]:
+    """
+    Converts a quantity to the base unit of its kind so compatible units can be added up
+
+    Returns:
+        (kind, quantity in the base unit). Units without a conversion are their own kind, unchanged.
+    """
+    unit = (unit or '').strip().lower()
+    kind, factor = CONVERSIONS.get(unit, (unit, 1))
+    return kind, quantity * factor
+
+
+def from_base(kind: str, quantity: float) -> Tuple[float, str]:
+    """
+    Gives a summed base quantity back in the largest display unit it is at least one of
+
+    Returns:
+        (quantity, unit)
+    """
+    units = DISPLAY_UNITS.get(kind)
+    if units is None:
+        return quantity, kind
+    for unit in units:
+        factor = CONVERSIONS[unit][1]
+        if quantity >= factor:
+            return round(quantity / factor, 3), unit
+    return round(quantity, 3), units[-1]
@@ -1,11 +1,16 @@
 import os
+from functools import lru_cache
 from typing import Optional, Any
 
-from cryptography.fernet import Fernet
 from pydantic import BaseModel
+from sqlalchemy import Table, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import Insert
 
-from kitchenLibrary.app.models.user import User
+from kitchenLibrary.app.models.user import User, permissions_allow
+from kitchenLibrary.app.tokens import TokenClaims, is_revoked, is_token, remember_revocation, verify_token
 
 
 class Response(BaseModel):
@@ -15,23 +20,90 @@ class Response(BaseModel):
     success: bool
     message: Optional[str] = ""
     data: Optional[Any] = None
+    next_cursor: Optional[Any] = None  # Set by paginated endpoints when there are more results
 
 
-fernet = Fernet(os.getenv('FERNET_KEY'))
+@lru_cache(maxsize=None)
+def get_fernet():
+    """
+    Builds the Fernet for legacy encrypted ids on first use, so cryptography stays out of cold starts
+    """
+    from cryptography.fernet import Fernet
+    return Fernet(os.getenv('FERNET_KEY'))
 
 
 def encrypt(text: str) -> str:
     """
     Encrypts a text
     """
-    return fernet.encrypt(bytes(text)).decode('utf-8')
+    return get_fernet().encrypt(bytes(text)).decode('utf-8')
 
 
 def decrypt(text: str) -> str:
     """
     Decrypts a text
     """
-    return fernet.decrypt(bytes(text)).decode('utf-8')
+    return get_fernet().decrypt(bytes(text)).decode('utf-8')
+
+
+def _legacy_user(user_id: str) -> Select:
+    """
+    Query for the user behind a legacy encrypted user id
+    """
+    return select(User).where(User.id == decrypt(user_id.encode('utf-8')))
+
+
+def _revoked_at(user_id: int) -> Select:
+    """
+    Query for when a user's tokens were last revoked
+    """
+    return select(User.tokens_revoked_at).where(User.id == user_id)
+
+
+def _unless_revoked(claims: TokenClaims, revoked_at: Optional[int]) -> Optional[TokenClaims]:
+    """
+    Caches what was read of tokens_revoked_at and checks the token against it. A deleted user's tokens are all revoked.
+    """
+    if revoked_at is None:
+        return None
+    remember_revocation(claims.user_id, revoked_at)
+    return None if is_revoked(claims) else claims
+
+
+def verify_user_token(db: Session, token: str) -> Optional[TokenClaims]:
+    """
+    Checks a token's signature, expiry and revocation, reading the user's tokens_revoked_at when it isn't cached.
+
+    Returns:
+        The token's claims, or None if the token is not valid
+
+    Raises:
+        TokenExpired: if the token is valid but has expired
+    """
+    claims = verify_token(token)
+    if claims is None:
+        return None
+    revoked = is_revoked(claims)
+    if revoked is None:
+        return _unless_revoked(claims, db.execute(_revoked_at(claims.user_id)).scalar())
+    return None if revoked else claims
+
+
+async def verify_user_token_async(db: AsyncSession, token: str) -> Optional[TokenClaims]:
+    """
+    verify_user_token for async handlers
+    """
+    claims = verify_token(token)
+    if claims is None:
+        return None
+    revoked = is_revoked(claims)
+    if revoked is None:
+        return _unless_revoked(claims, await db.scalar(_revoked_at(claims.user_id)))
+    return None if revoked else claims
+
+
+def _token_allows(claims: Optional[TokenClaims], can_write: bool, can_delete: bool, can_alter_users: bool) -> bool:
+    return claims is not None and permissions_allow(claims.permissions, can_write, can_delete, can_alter_users)
 
 
 def check_referenced_user_permissions(db: Session,
@@ -40,11 +112,75 @@ def check_referenced_user_permissions(db: Session,
                                       can_delete: bool,
                                       can_alter_users: bool) -> bool:
     """
-    decrypts user id and checks if they have a permission
+    Checks if the user behind a reference id has a permission.
+
+    Signed access tokens carry the permissions, only the user's revocation time is read and that is cached. An
+    expired token raises TokenExpired so the handler's message tells the client to sign in again. Legacy encrypted user
+    ids are decrypted and looked up.
     """
-    user_db = db.query(User).filter(User.id == decrypt(user_id.encode('utf-8'))).first()
+    if is_token(user_id):
+        return _token_allows(verify_user_token(db, user_id), can_write, can_delete, can_alter_users)
+
+    user_db = db.execute(_legacy_user(user_id)).scalars().first()
     if not user_db:
         return False
     if not user_db.check_permissions(can_write, can_delete, can_alter_users):
         return False
     return True
+
+
+async def check_referenced_user_permissions_async(db: AsyncSession,
+                                                  user_id: str,
+                                                  can_write: bool,
+                                                  can_delete: bool,
+                                                  can_alter_users: bool) -> bool:
+    """
+    check_referenced_user_permissions for async handlers
+    """
+    if is_token(user_id):
+        return _token_allows(await verify_user_token_async(db, user_id), can_write, can_delete, can_alter_users)
+
+    user_db = (await db.execute(_legacy_user(user_id))).scalars().first()
+    return bool(user_db) and user_db.check_permissions(can_write, can_delete, can_alter_users)
+
+
+def resolve_user_id(db: Session, user_id: str) -> Optional[int]:
+    """
+    Gets the id of the user behind a reference id.
+
+    Returns:
+        The user's id, or None if the token is not valid or the user does not exist
+
+    Raises:
+        TokenExpired: if the token is valid but has expired
+    """
+    if is_token(user_id):
+        claims = verify_user_token(db, user_id)
+        return claims.user_id if claims else None
+
+    user_db = db.execute(_legacy_user(user_id)).scalars().first()
+    return user_db.id if user_db else None
+
+
+async def resolve_user_id_async(db: AsyncSession, user_id: str) -> Optional[int]:
+    """
+    resolve_user_id for async handlers
+    """
+    if is_token(user_id):
+        claims = await verify_user_token_async(db, user_id)
+        return claims.user_id if claims else None
+
+    user_db = (await db.execute(_legacy_user(user_id))).scalars().first()
+    return user_db.id if user_db else None
+
+
+def insert_ignore(db: Session, table: Table) -> Insert:
+    """
+    INSERT statement that skips rows which would break a unique key instead of failing
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return insert(table).prefix_with('OR IGNORE')
+    return insert(table)
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+
+async def request(app, method: str, path: str, params: Optional[Dict[str, Any]] = None, body: Any = None,
+                  headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Sends one request straight to an ASGI app, without a server or sockets in between.
+
+    Arguments:
+        app: the ASGI application
+        method: HTTP method
+        path: URL path
+        params: query parameters
+        body: sent as JSON unless it is already bytes
+        headers: extra request headers
+
+    Returns:
+        (status code, response headers, response body)
+    """
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+        headers = {'content-type': 'application/json', **(headers or {})}
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': urlencode(params or {}, doseq=True).encode('utf-8'),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 0),
+        'server': ('127.0.0.1', 80),
+    }
+    pending = [{'type': 'http.request', 'body': body or b'', 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive() -> dict:
+        if pending:
+            return pending.pop()
+        # Like a client that stays connected until the response is done
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = 0
+    response_headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+
+    async def send(message: dict) -> None:
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            response_headers.update((name.decode('latin-1'), value.decode('latin-1'))
+                                    for name, value in message.get('headers', []))
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return status, response_headers, b''.join(chunks)
@@ -0,0 +1,103 @@
+"""
+Measures API throughput and latency at several concurrency levels.
+
+Requests go straight into the ASGI app in this process, so the numbers show how the handlers share the event loop,
+threadpool and connection pools without a web server in the way. Cached catalog endpoints are asked with a new
+catalog version every time so each request reaches the database.
+
+Run it against the same database on the commit before and after a change to compare them:
+
+    DATABASE_URL=... python -m kitchenLibrary.benchmarks.concurrency --recipe "grilled cheese" --ingredients bread cheese
+
+Only SQLite has been measured so far. On a local file with a 2,000 recipe catalog the async kitchen read did 326 req/s
+alone and 350 with 32 in flight, against 542 and 480 for the blocking query it replaced: aiosqlite adds a thread hop to
+every query and there is no network wait to overlap. The async handlers are only worth keeping if a run against MySQL
+through aiomysql, with its real round trips, shows a gain. Until that has been measured, treat them as unproven and
+move any that show no gain back to plain def with get_db.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from kitchenLibrary.app.cache import bump_catalog_version
+from kitchenLibrary.app.main import app
+from kitchenLibrary.app.tokens import issue_token
+from kitchenLibrary.benchmarks.asgi import request
+
+Call = Callable[[], Awaitable[int]]
+
+
+def _endpoints(args: argparse.Namespace) -> Dict[str, Call]:
+    token = issue_token(args.user_id, 0)
+
+    async def ingredients() -> int:
+        bump_catalog_version()
+        return (await request(app, 'GET', '/ingredients'))[0]
+
+    async def kitchen() -> int:
+        return (await request(app, 'GET', f'/kitchen/{token}'))[0]
+
+    async def recipe() -> int:
+        bump_catalog_version()
+        return (await request(app, 'POST', f'/recipes/search/{args.recipe}'))[0]
+
+    async def match_all() -> int:
+        return (await request(app, 'POST', '/recipes/match_all', body=args.ingredients))[0]
+
+    return {'GET /ingredients': ingredients,
+            'GET /kitchen/{user_id}': kitchen,
+            'POST /recipes/search/{name}': recipe,
+            'POST /recipes/match_all': match_all}
+
+
+async def _run(call: Call, concurrency: int, total: int) -> List[float]:
+    """
+    Makes total calls with concurrency of them in flight at once
+
+    Returns:
+        Latency of every call in seconds
+    """
+    latencies: List[float] = []
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            status = await call()
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                raise RuntimeError(f'Request failed with status {status}')
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def main(args: argparse.Namespace) -> None:
+    endpoints = _endpoints(args)
+    print(f'{"endpoint":<30} {"concurrency":>11} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8}')
+    for name, call in endpoints.items():
+        await _run(call, 1, args.warmup)
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            latencies = await _run(call, concurrency, args.requests)
+            elapsed = time.perf_counter() - start
+            print(f'{name:<30} {concurrency:>11} {len(latencies) / elapsed:>9.1f} '
+                  f'{statistics.median(latencies) * 1000:>8.2f} {_percentile(latencies, 0.99) * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint and concurrency level')
+    parser.add_argument('--warmup', type=int, default=20, help='requests per endpoint before measuring')
+    parser.add_argument('--user-id', type=int, default=1, help='user whose kitchen is read')
+    parser.add_argument('--recipe', required=True, help='name of a recipe to look up')
+    parser.add_argument('--ingredients', nargs='+', required=True, help='ingredients to match recipes against')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,306 @@
+"""
+Load test of every endpoint against a generated catalog, run in-process through the ASGI app.
+
+Fill a database with app/scripts/generate_catalog.py first, then:
+
+    DATABASE_URL=sqlite:///catalog.db python -m kitchenLibrary.benchmarks.load --save before.json
+    DATABASE_URL=sqlite:///catalog.db python -m kitchenLibrary.benchmarks.load --baseline before.json
+
+Requests are made from a seeded random stream, so two runs against the same catalog send the same requests. Each
+endpoint is warmed up (loading the in-memory indexes) and then hit --requests times with --concurrency requests in
+flight. Write endpoints clean up after themselves, recipes and users they add are deleted again by the delete
+endpoints and the kitchens PUT and PATCH change are put back when the run ends, even if it fails. With --baseline the
+run fails when a gated endpoint got slower than the tolerance allows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import sys
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+from sqlalchemy import func, select
+
+from kitchenLibrary.app.main import app
+from kitchenLibrary.app.models import get_session_factory
+from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.models.kitchen import Kitchen
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.models.recipes import Recipe
+from kitchenLibrary.app.models.user import User
+from kitchenLibrary.app.tokens import issue_token
+from kitchenLibrary.benchmarks.asgi import request
+
+# Endpoints a regression fails the run for
+GATED = ('GET /ingredients/suggest', 'GET /kitchen/{user_id}/cookable', 'GET /recipes/search',
+         'POST /recipes/search/{name}', 'GET /recipes/{name}/similar', 'POST /recipes/batch',
+         'POST /recipes/match_any', 'POST /recipes/match_all', 'POST /recipes/match_near')
+
+# Endpoints that add rows and the ones deleting them again, each runs exactly --requests times
+BALANCED = ('PUT /recipes', 'DELETE /recipes/{name}', 'PUT /recipes/bulk', 'DELETE /recipes', 'PUT /users/{username}',
+            'DELETE /users/{username}')
+
+# (method, path, query parameters, body)
+Call = Tuple[str, str, Dict, object]
+
+
+class Workload:
+    """
+    Makes the requests for each endpoint from a sample of the catalog
+    """
+
+    def __init__(self, sessions, rng: random.Random, password: str):
+        self.sessions = sessions
+        self.rng = rng
+        self.password = password
+        with sessions() as db:
+            popularity = db.query(Ingredient.name, func.count(RecipeIngredient.id)) \
+                .join(RecipeIngredient, RecipeIngredient.ingredient_id == Ingredient.id) \
+                .group_by(Ingredient.name).all()
+            self.ingredients = [name for name, _ in popularity]
+            self.weights = [count for _, count in popularity]
+            recipe_count = db.scalar(select(func.count()).select_from(Recipe))
+            recipe_ids = rng.sample(range(1, recipe_count + 1), min(recipe_count, 1000))
+            self.recipes = [name for name, in db.query(Recipe.name).filter(Recipe.id.in_(recipe_ids)).all()]
+            self.users = [user_id for user_id, in
+                          db.query(Kitchen.user_id).distinct().order_by(Kitchen.user_id).limit(1000).all()]
+            self.user_names = dict(db.query(User.id, User.name).filter(User.id.in_(self.users)).all())
+            # What the kitchens held before the run, to restore the ones PUT and PATCH replace
+            self.kitchens: Dict[int, List[int]] = {user_id: [] for user_id in self.users}
+            for user_id, ingredient_id in db.query(Kitchen.user_id, Kitchen.ingredient_id) \
+                    .filter(Kitchen.user_id.in_(self.users)):
+                self.kitchens[user_id].append(ingredient_id)
+        self.changed_kitchens: Set[int] = set()
+        self.words = [word for name in self.recipes for word in name.split()]
+        self.run = secrets.token_hex(3)
+        self.added_recipes: List[str] = []
+        self.added_batches: List[List[str]] = []
+        self.added_users: List[str] = []
+        self.counter = 0
+
+    def _pantry(self, low: int, high: int) -> List[str]:
+        return list(set(self.rng.choices(self.ingredients, weights=self.weights, k=self.rng.randint(low, high))))
+
+    def _new_recipe(self) -> dict:
+        self.counter += 1
+        return {'name': f'load test {self.run} {self.counter}',
+                'directions': ' '.join(self.rng.choices(self.words, k=30)),
+                'ingredients': [{'name': name, 'quantity': 1, 'unit': 'cup', 'required': True}
+                                for name in self._pantry(3, 10)]}
+
+    def _admin(self) -> str:
+        # Issued per request, since updatePassword can revoke the generated admin's earlier tokens
+        return issue_token(1, 7)
+
+    def _user(self) -> Tuple[str, str]:
+        user_id = self.rng.choice(self.users)
+        return issue_token(user_id, 0), self.user_names[user_id]
+
+    def _kitchen_user(self) -> str:
+        """
+        Token of a user whose kitchen is about to change
+        """
+        user_id = self.rng.choice(self.users)
+        self.changed_kitchens.add(user_id)
+        return issue_token(user_id, 0)
+
+    def restore_kitchens(self) -> int:
+        """
+        Puts back what the kitchens PUT and PATCH changed held before the run
+
+        Returns:
+            How many kitchens were restored
+        """
+        if not self.changed_kitchens:
+            return 0
+        with self.sessions() as db:
+            user_ids = sorted(self.changed_kitchens)
+            db.query(Kitchen).filter(Kitchen.user_id.in_(user_ids)).delete(synchronize_session=False)
+            rows = [{'user_id': user_id, 'ingredient_id': ingredient_id}
+                    for user_id in user_ids for ingredient_id in self.kitchens[user_id]]
+            if rows:
+                db.execute(Kitchen.__table__.insert(), rows)
+            db.commit()
+        self.changed_kitchens.clear()
+        return len(user_ids)
+
+    def add_recipe(self) -> Call:
+        recipe = self._new_recipe()
+        self.added_recipes.append(recipe['name'])
+        return 'PUT', '/recipes', {'reference_id': self._admin()}, recipe
+
+    def add_recipes_bulk(self) -> Call:
+        recipes = [self._new_recipe() for _ in range(20)]
+        self.added_batches.append([recipe['name'] for recipe in recipes])
+        return 'PUT', '/recipes/bulk', {'reference_id': self._admin()}, recipes
+
+    def delete_recipe(self) -> Call:
+        name = self.added_recipes.pop() if self.added_recipes else 'missing recipe'
+        return 'DELETE', f'/recipes/{name}', {'recipe_name': name, 'reference_id': self._admin()}, None
+
+    def delete_recipes_bulk(self) -> Call:
+        names = self.added_batches.pop() if self.added_batches else ['missing recipe']
+        return 'DELETE', '/recipes', {'reference_id': self._admin()}, names
+
+    def add_user(self) -> Call:
+        self.counter += 1
+        name = f'load test {self.run} {self.counter}'
+        self.added_users.append(name)
+        return 'PUT', f'/users/{name}', {'password': self.password}, None
+
+    def update_permissions(self) -> Call:
+        name = self.added_users[-1] if self.added_users else 'missing user'
+        return 'PUT', f'/users/updatePermissions/{name}', {'reference_id': self._admin(), 'can_write': True}, None
+
+    def delete_user(self) -> Call:
+        name = self.added_users.pop() if self.added_users else 'missing user'
+        return 'DELETE', f'/users/{name}', {'reference_id': self._admin()}, None
+
+    def calls(self) -> Dict[str, Callable[[], Call]]:
+        """
+        Endpoint label -> makes the next request for it, in the order they are run
+        """
+        rng = self.rng
+        return {
+            'GET /ingredients': lambda: ('GET', '/ingredients', {}, None),
+            'GET /ingredients/suggest': lambda: ('GET', '/ingredients/suggest',
+                                                 {'q': rng.choice(self.ingredients)[:rng.randint(2, 5)]}, None),
+            'GET /kitchen/{user_id}': lambda: ('GET', f'/kitchen/{self._user()[0]}', {}, None),
+            'GET /kitchen/{user_id}/cookable': lambda: ('GET', f'/kitchen/{self._user()[0]}/cookable', {}, None),
+            'PUT /kitchen/{user_id}': lambda: ('PUT', f'/kitchen/{self._kitchen_user()}', {}, self._pantry(5, 40)),
+            'PATCH /kitchen/{user_id}': lambda: ('PATCH', f'/kitchen/{self._kitchen_user()}', {},
+                                                 {'add': self._pantry(1, 3), 'remove': self._pantry(1, 3)}),
+            'GET /recipes/search': lambda: ('GET', '/recipes/search',
+                                            {'q': ' '.join(rng.choices(self.words, k=rng.randint(1, 3)))}, None),
+            'POST /recipes/search/{name}': lambda: ('POST', f'/recipes/search/{rng.choice(self.recipes)}', {}, None),
+            'GET /recipes/{name}/similar': lambda: ('GET', f'/recipes/{rng.choice(self.recipes)}/similar',
+                                                    {'k': 10}, None),
+            'POST /recipes/batch': lambda: ('POST', '/recipes/batch', {}, rng.sample(self.recipes, 50)),
+            'POST /recipes/match_any': lambda: ('POST', '/recipes/match_any', {}, self._pantry(3, 10)),
+            'POST /recipes/match_all': lambda: ('POST', '/recipes/match_all', {}, self._pantry(20, 80)),
+            'POST /recipes/match_near': lambda: ('POST', '/recipes/match_near', {'max_missing': 2},
+                                                 self._pantry(20, 80)),
+            'POST /shopping_list': lambda: ('POST', '/shopping_list', {},
+                                            {'user_id': self._user()[0], 'recipes': rng.sample(self.recipes, 20),
+                                             'servings': 2}),
+            'PUT /recipes': self.add_recipe,
+            'DELETE /recipes/{name}': self.delete_recipe,
+            'PUT /recipes/bulk': self.add_recipes_bulk,
+            'DELETE /recipes': self.delete_recipes_bulk,
+            'PUT /users/{username}': self.add_user,
+            'POST /users/signIn/{username}': lambda: ('POST', f'/users/signIn/{self._user()[1]}',
+                                                      {'password': self.password}, None),
+            'PUT /users/updatePermissions/{username}': self.update_permissions,
+            'PUT /users/updatePassword/{user_id}': lambda: ('PUT', f'/users/updatePassword/{self._user()[0]}',
+                                                            {'password': self.password}, None),
+            'DELETE /users/{username}': self.delete_user,
+            'GET /metrics': lambda: ('GET', '/metrics', {}, None),
+        }
+
+
+def _failed(status: int, headers: Dict[str, str], body: bytes) -> bool:
+    if status >= 400:
+        return True
+    if headers.get('content-type', '').startswith('application/json'):
+        return not json.loads(body).get('success', True)
+    return False
+
+
+async def _run(make_call: Callable[[], Call], concurrency: int, total: int) -> Tuple[List[float], int]:
+    """
+    Makes total requests with concurrency of them in flight at once
+
+    Returns:
+        Latency of every request in seconds, and how many failed
+    """
+    latencies: List[float] = []
+    failures = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for _ in remaining:
+            method, path, params, body = make_call()
+            start = time.perf_counter()
+            status, headers, content = await request(app, method, path, params, body)
+            latencies.append(time.perf_counter() - start)
+            failures += _failed(status, headers, content)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def measure(args: argparse.Namespace, workload: Workload) -> Dict[str, dict]:
+    results = {}
+    print(f'{"endpoint":<42} {"req/s":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"failed":>7}')
+    for name, make_call in workload.calls().items():
+        if args.endpoints and name not in args.endpoints:
+            continue
+        await _run(make_call, 1, 0 if name in BALANCED else args.warmup)
+        start = time.perf_counter()
+        latencies, failures = await _run(make_call, args.concurrency, args.requests)
+        elapsed = time.perf_counter() - start
+        results[name] = {'rps': len(latencies) / elapsed,
+                         'p50_ms': _percentile(latencies, 0.5) * 1000,
+                         'p90_ms': _percentile(latencies, 0.9) * 1000,
+                         'p99_ms': _percentile(latencies, 0.99) * 1000,
+                         'failed': failures}
+        result = results[name]
+        print(f'{name:<42} {result["rps"]:>8.1f} {result["p50_ms"]:>8.2f} {result["p90_ms"]:>8.2f} '
+              f'{result["p99_ms"]:>8.2f} {failures:>7}')
+    return results
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Gated endpoints whose median latency grew by more than tolerance since the baseline
+    """
+    slower = []
+    for name in GATED:
+        if name in results and name in baseline:
+            before, after = baseline[name]['p50_ms'], results[name]['p50_ms']
+            if after > before * (1 + tolerance):
+                slower.append(f'{name}: p50 {before:.2f} ms -> {after:.2f} ms')
+    return slower
+
+
+def main(args: argparse.Namespace) -> int:
+    os.environ.setdefault('TOKEN_SECRET', secrets.token_hex(32))
+    workload = Workload(get_session_factory(), random.Random(args.seed), args.password)
+    try:
+        results = asyncio.run(measure(args, workload))
+    finally:
+        print(f'Restored {workload.restore_kitchens()} kitchens')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for line in slower:
+            print(f'Regression: {line}')
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=10, help='requests per endpoint before measuring')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--password', default='password', help='password the catalog was generated with')
+    parser.add_argument('--endpoints', nargs='*', help='only run these, e.g. "POST /recipes/match_all"')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p50 growth over the baseline')
+    sys.exit(main(parser.parse_args()))
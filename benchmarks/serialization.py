@@ -0,0 +1,82 @@
+"""
+Compares the two ways recipe lists can be sent, without a database in the way.
+
+model: FullRecipe models wrapped in util.Response, then validated and encoded by FastAPI against response_model
+fast: plain dicts encoded by encoding.fast_response
+
+Both make the same JSON, which is checked before timing.
+
+    python -m kitchenLibrary.benchmarks.serialization --recipes 100 1000 5000 --ingredients 12
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from kitchenLibrary.app.encoding import fast_response
+from kitchenLibrary.app.main import app
+from kitchenLibrary.app.models.ingredients import IngredientInfo
+from kitchenLibrary.app.models.recipes import RecipeInfo
+from kitchenLibrary.app.routers.recipes import FullRecipe
+from kitchenLibrary.app.util import Response
+
+
+def _rows(recipes: int, ingredients: int) -> List[tuple]:
+    """
+    (recipe name, directions, [(ingredient name, quantity, unit, required)]) like the queries return
+    """
+    return [(f'recipe {i}', 'Mix everything together and bake until golden. ' * 4,
+             [(f'ingredient {j}', j * 0.5, 'cup', j % 3 != 0) for j in range(ingredients)])
+            for i in range(recipes)]
+
+
+def _model_path(rows: List[tuple]) -> bytes:
+    route = next(route for route in app.routes if isinstance(route, APIRoute) and route.path == '/recipes/match_any')
+    recipes = [FullRecipe(recipe_info=RecipeInfo(name=name, directions=directions),
+                          ingredients=[IngredientInfo(name=ingredient, quantity=quantity, unit=unit, required=required)
+                                       for ingredient, quantity, unit, required in links])
+               for name, directions, links in rows]
+    content = asyncio.run(serialize_response(field=route.secure_cloned_response_field,
+                                             response_content=Response(success=True, data=recipes)))
+    return JSONResponse(content).body
+
+
+def _fast_path(rows: List[tuple]) -> bytes:
+    recipes = [{'recipe_info': {'name': name, 'directions': directions},
+                'ingredients': [{'name': ingredient, 'quantity': quantity, 'unit': unit, 'required': required}
+                                for ingredient, quantity, unit, required in links]}
+               for name, directions, links in rows]
+    return fast_response(success=True, data=recipes).body
+
+
+def _best_of(repeats: int, path: Callable[[List[tuple]], bytes], rows: List[tuple]) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        path(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace) -> None:
+    print(f'{"recipes":>8} {"rows":>8} {"model ms":>10} {"fast ms":>9} {"speedup":>8}')
+    for count in args.recipes:
+        rows = _rows(count, args.ingredients)
+        if json.loads(_model_path(rows)) != json.loads(_fast_path(rows)):
+            raise AssertionError('The two paths made different JSON')
+        model = _best_of(args.repeats, _model_path, rows)
+        fast = _best_of(args.repeats, _fast_path, rows)
+        print(f'{count:>8} {count * args.ingredients:>8} {model * 1000:>10.2f} {fast * 1000:>9.2f} '
+              f'{model / fast:>7.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--ingredients', type=int, default=12, help='ingredients per recipe')
+    parser.add_argument('--repeats', type=int, default=5)
+    main(parser.parse_args())
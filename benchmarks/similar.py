@@ -0,0 +1,82 @@
+"""
+Measures the similar recipes index: how long it takes to build, save and load, how much memory its arrays take, how fast lookups are and how many of the truly most similar recipes they find.
+
+Recall compares each lookup with an exact search over every recipe, so sample a few hundred recipes at most:
+
+    DATABASE_URL=sqlite:///catalog.db python -m kitchenLibrary.benchmarks.similar --samples 200 --k 10
+
+SIMILARITY_BANDS and SIMILARITY_ROWS set the signature shape to compare.
+"""
+import argparse
+import heapq
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import List
+
+from kitchenLibrary.app.matching import recipe_index
+from kitchenLibrary.app.models import get_session_factory
+from kitchenLibrary.app.similarity import BANDS, OPTIONAL_WEIGHT, ROWS, SimilarityIndex, jaccard
+
+
+def _exact(recipe_id: int, k: int, weighted: bool) -> List[float]:
+    """
+    Similarities of the k recipes most similar to one, comparing it with every other recipe
+    """
+    optional_weight = OPTIONAL_WEIGHT if weighted else 1.0
+    target = (recipe_index.required[recipe_id], recipe_index.optional[recipe_id])
+    scores = [jaccard(target, (required, recipe_index.optional[other]), optional_weight)
+              for other, required in recipe_index.required.items() if other != recipe_id]
+    return heapq.nlargest(k, scores)
+
+
+def main(args: argparse.Namespace) -> None:
+    path = os.path.join(tempfile.mkdtemp(), 'similarity.bin')
+    with get_session_factory()() as db:
+        recipe_index.load(db)
+
+        start = time.perf_counter()
+        index = SimilarityIndex(recipe_index, path)
+        index.load(db)
+        print(f'bands {BANDS} rows {ROWS}, {len(index.slots)} recipes')
+        print(f'build and save     {time.perf_counter() - start:>8.2f} s, '
+              f'{os.path.getsize(path) / 2 ** 20:.1f} MB file, {index.memory_bytes() / 2 ** 20:.1f} MB of arrays')
+
+        start = time.perf_counter()
+        SimilarityIndex(recipe_index, path).load(db)
+        print(f'load saved         {time.perf_counter() - start:>8.2f} s')
+
+    rng = random.Random(args.seed)
+    samples = rng.sample(sorted(index.slots), min(args.samples, len(index.slots)))
+    latencies, exact_latencies, candidates, recalls = [], [], [], []
+    for recipe_id in samples:
+        start = time.perf_counter()
+        found = index.similar(recipe_id, args.k, args.weighted)
+        latencies.append(time.perf_counter() - start)
+        candidates.append(len(index.candidates(recipe_id)))
+
+        start = time.perf_counter()
+        exact = _exact(recipe_id, args.k, args.weighted)
+        exact_latencies.append(time.perf_counter() - start)
+        if exact:
+            # Ties make the exact ids arbitrary, so a result counts if it is as similar as the k-th best
+            recalls.append(sum(score >= exact[-1] for _, score in found) / len(exact))
+
+    latencies.sort()
+    print(f'lookup p50         {statistics.median(latencies) * 1000:>8.2f} ms')
+    print(f'lookup p99         {latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000:>8.2f} ms')
+    print(f'exact search p50   {statistics.median(exact_latencies) * 1000:>8.2f} ms')
+    print(f'candidates mean    {statistics.mean(candidates):>8.1f}')
+    print(f'recall@{args.k:<11} {statistics.mean(recalls):>8.3f}')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=200, help='recipes to look up')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--weighted', action='store_true', help='weigh optional ingredients less')
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+"""
+Measures how long a fresh process takes to import the Lambda handler, which is most of a cold start.
+
+Each run imports kitchenLibrary.app.main in a new interpreter with -X importtime. The best run is reported, split
+by top level package, since the slower runs mostly measure noise from the machine.
+
+    python -m kitchenLibrary.benchmarks.startup --runs 10 --budget-ms 800
+
+Exits with status 1 when the best run is over the budget, so it can guard a build.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict, Tuple
+
+MODULE = 'kitchenLibrary.app.main'
+
+
+def _import_once() -> Tuple[float, Dict[str, int]]:
+    """
+    Imports the handler in a new interpreter
+
+    Returns:
+        Wall time in seconds, and microseconds spent in each top level package's own code
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {MODULE}'],
+                            env=env, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    elapsed = time.perf_counter() - start
+
+    packages: Dict[str, int] = Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, _, name = line[len('import time:'):].split('|')
+        packages[name.strip().split('.')[0]] += int(self_time)
+    return elapsed, packages
+
+
+def main(args: argparse.Namespace) -> int:
+    # The first import writes bytecode caches, which a Lambda image should already have
+    _import_once()
+    runs = [_import_once() for _ in range(args.runs)]
+    elapsed, packages = min(runs, key=lambda run: run[0])
+
+    print(f'best of {args.runs}: {elapsed * 1000:.1f} ms wall, {sum(packages.values()) / 1000:.1f} ms importing')
+    for package, self_time in Counter(packages).most_common(args.top):
+        print(f'{package:<24} {self_time / 1000:>8.1f} ms')
+
+    if args.budget_ms is not None and elapsed * 1000 > args.budget_ms:
+        print(f'Over the {args.budget_ms} ms budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='packages to list')
+    parser.add_argument('--budget-ms', type=float, help='fail when the best run takes longer')
+    sys.exit(main(parser.parse_args()))
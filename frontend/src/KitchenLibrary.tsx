@@ -1,6 +1,6 @@
 import React from 'react';
 import './KitchenLibrary.scss';
-import {Api, ApiResponse} from './api/Api';
+import {Api, ApiResponse, tokenExpiry} from './api/Api';
 import {Login} from "./components/login/login";
 import * as Blueprint from "@blueprintjs/core";
 import {BrowserRouter as Router, Link, Route, Switch} from "react-router-dom";
@@ -49,11 +49,34 @@ export default class KitchenLibrary extends React.Component<Props, State> {
      * @inheritDoc
      */
     public componentDidMount() {
+        Api.onTokenExpired(() => {
+            if (this.state.userId !== undefined) {
+                this.setUserId(undefined);
+                Toaster.show({
+                    intent: Blueprint.Intent.WARNING,
+                    message: "Your session expired, please log in again",
+                    timeout: 3000
+                })
+            }
+        });
         Api.Ingredient.getAllIngredients()
             .then((result: ApiResponse<string[]>) => this.setState({possibleIngredients: result.data})
             )
     }
 
+    /**
+     * Logs a user in or out, keeping the cookie only as long as their access token is valid
+     * @param userId - access token of the user, undefined to log out
+     */
+    private setUserId(userId: string | undefined) {
+        this.setState({userId: userId});
+        if (userId) {
+            Cookies.set("userId", userId, {expires: tokenExpiry(userId)});
+        } else {
+            Cookies.remove("userId")
+        }
+    }
+
     /**
      * @inheritDoc
      */
@@ -67,14 +90,7 @@ export default class KitchenLibrary extends React.Component<Props, State> {
                 <div className={`${COMPONENT_NAME}__header__right`}>
                     <Login
                         userId={this.state.userId}
-                        setUserId={(newUserId) => {
-                            this.setState({userId: newUserId});
-                            if (newUserId) {
-                                Cookies.set("userId", newUserId);
-                            } else {
-                                Cookies.remove("userId")
-                            }
-                        }}
+                        setUserId={(newUserId) => this.setUserId(newUserId)}
                     />
                 </div>
             </div>);
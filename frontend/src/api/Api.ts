@@ -6,7 +6,8 @@ import axios from "axios"
 export interface ApiResponse<T> {
     success: boolean;
     message: string;
-    data: T
+    data: T;
+    next_cursor?: number | null;
 }
 
 /**
@@ -44,9 +45,45 @@ export interface FullRecipe {
     ingredients: IngredientInfo[]
 }
 
+/**
+ * Message the API answers with when the access token sent has expired
+ */
+export const TOKEN_EXPIRED_MESSAGE = "Access token expired, sign in again.";
+
+/**
+ * Gets when an access token from Api.User.signIn expires
+ * @param token - signed access token
+ * @returns expiry time, undefined for a legacy encrypted user id which never expires
+ */
+export function tokenExpiry(token: string): Date | undefined {
+    const parts = token.split(".");
+    if (parts.length !== 3) {
+        return undefined;
+    }
+    try {
+        const payload = JSON.parse(atob(parts[1].replace(/-/g, "+").replace(/_/g, "/")));
+        return new Date(payload.e * 1000);
+    } catch {
+        return undefined;
+    }
+}
+
 export namespace Api {
     const endpoint = "https://3ngv4gtvia.execute-api.us-east-2.amazonaws.com/prod";
 
+    /**
+     * Calls a handler whenever a response says the access token sent with the request has expired
+     * @param handler - called after the response arrives, e.g. to log the user out
+     */
+    export function onTokenExpired(handler: () => void): void {
+        axios.interceptors.response.use((response) => {
+            if (response.data && response.data.success === false && response.data.message === TOKEN_EXPIRED_MESSAGE) {
+                handler();
+            }
+            return response;
+        });
+    }
+
     export namespace Ingredient {
         /**
          * Gets all the ingredient names
@@ -156,7 +193,7 @@ export namespace Api {
          * Attempts to sign a user in
          * @param username - username of user
          * @param password - user password
-         * @returns ApiResponse<string> with data being encrypted user id
+         * @returns ApiResponse<string> with data being a signed access token used as the user id
          */
         export function signIn(username: string, password: string): Promise<ApiResponse<string>> {
             return axios.post<ApiResponse<string>>(`${endpoint}/users/signIn/${username}`, null, {
@@ -209,12 +246,22 @@ export namespace Api {
         }
 
         /**
-         * Gets all the recipes that contain any of the inputted ingredients
+         * Gets all the recipes that contain any of the inputted ingredients, following next_cursor until the last page
          * @param ingredients - list of ingredient names
          */
         export function getAllRecipes(ingredients: string[]): Promise<ApiResponse<FullRecipe[]>> {
-            return axios.post<ApiResponse<FullRecipe[]>>(`${endpoint}/recipes/match_any`, ingredients)
-                .then((result) => result.data)
+            const getPage = (cursor: number | null, recipes: FullRecipe[]): Promise<ApiResponse<FullRecipe[]>> =>
+                axios.post<ApiResponse<FullRecipe[]>>(`${endpoint}/recipes/match_any`, ingredients, {
+                    params: cursor === null ? {} : {cursor: cursor}
+                }).then((result) => {
+                    const page = result.data;
+                    const all = recipes.concat(page.data || []);
+                    if (page.success && page.next_cursor != null) {
+                        return getPage(page.next_cursor, all);
+                    }
+                    return {...page, data: all, next_cursor: null};
+                });
+            return getPage(null, []);
         }
 
         /**
@@ -0,0 +1,81 @@
+"""
+The app on a SQLite database in memory, for tests that send it requests. Import this before anything else from the app
+so the app never opens the database DATABASE_URL would point it at.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('TOKEN_SECRET', 'kitchenLibrary tests')
+
+from sqlalchemy import select  # noqa: E402
+
+from kitchenLibrary.app.main import app  # noqa: E402
+from kitchenLibrary.app.models import get_engine  # noqa: E402
+from kitchenLibrary.app.models.ingredients import Ingredient  # noqa: E402
+from kitchenLibrary.app.models.meta import Base  # noqa: E402
+from kitchenLibrary.app.models.migrations import upgrade  # noqa: E402
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient  # noqa: E402
+from kitchenLibrary.app.models.recipes import Recipe  # noqa: E402
+from kitchenLibrary.app.models.user import User  # noqa: E402
+from kitchenLibrary.app.tokens import issue_token  # noqa: E402
+from kitchenLibrary.benchmarks.asgi import request  # noqa: E402
+
+Base.metadata.create_all(get_engine())
+upgrade(get_engine())
+
+
+def add_recipes(recipes: Dict[str, Iterable[Tuple[str, float, str, bool]]]) -> Dict[str, int]:
+    """
+    Inserts recipes straight into the database, leaving the app's indexes to find them when they next load.
+
+    Arguments:
+        recipes: recipe name -> (ingredient name, quantity, unit, required) of each of its ingredients
+
+    Returns:
+        recipe name -> id
+    """
+    engine = get_engine()
+    with engine.begin() as conn:
+        names = {name for links in recipes.values() for name, _, _, _ in links}
+        known = dict(conn.execute(select(Ingredient.name, Ingredient.id).where(Ingredient.name.in_(names))).all())
+        for name in sorted(names - known.keys()):
+            known[name] = conn.execute(Ingredient.__table__.insert().values(name=name)).inserted_primary_key[0]
+
+        recipe_ids = {}
+        for recipe_name, links in recipes.items():
+            recipe_id = conn.execute(Recipe.__table__.insert().values(name=recipe_name, directions='Cook it.')) \
+                .inserted_primary_key[0]
+            recipe_ids[recipe_name] = recipe_id
+            rows = [{'recipe_id': recipe_id, 'ingredient_id': known[name], 'quantity': quantity, 'unit': unit,
+                     'required': required} for name, quantity, unit, required in links]
+            if rows:
+                conn.execute(RecipeIngredient.__table__.insert(), rows)
+    return recipe_ids
+
+
+def add_user(name: str, permissions: int) -> str:
+    """
+    Inserts a user who can't sign in, for tests that only need their access token
+
+    Returns:
+        an access token for the user
+    """
+    with get_engine().begin() as conn:
+        user_id = conn.execute(User.__table__.insert().values(name=name, password=b'-' * 60, permissions=permissions)) \
+            .inserted_primary_key[0]
+    return issue_token(user_id, permissions)
+
+
+def send(method: str, path: str, params: Optional[Dict[str, Any]] = None, body: Any = None,
+         headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], Any]:
+    """
+    Sends one request to the app.
+
+    Returns:
+        (status code, response headers, the decoded JSON body or None if there is no body)
+    """
+    status, response_headers, content = asyncio.run(request(app, method, path, params, body, headers))
+    return status, response_headers, json.loads(content) if content else None
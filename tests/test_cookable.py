@@ -0,0 +1,112 @@
+"""
+Checks that CookableCache's incremental updates give the same recipes as matching every pantry from scratch. Run it
+from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_cookable
+"""
+import random
+import unittest
+from typing import Dict, List, Set, Tuple
+
+from kitchenLibrary.app.matching import CookableCache, RecipeIndex
+
+INGREDIENTS = 40
+USERS = 5
+STEPS = 300
+
+
+class FixtureIndex(RecipeIndex):
+    """
+    Recipe index loaded from a dict instead of the database
+    """
+
+    def __init__(self, recipes: Dict[int, List[Tuple[int, str, bool]]]):
+        super().__init__()
+        self.recipes = recipes
+
+    def _build(self, db) -> RecipeIndex:
+        fresh = RecipeIndex()
+        for recipe_id, links in self.recipes.items():
+            fresh._add_recipe(recipe_id, links)
+        return fresh
+
+
+def _links(rng: random.Random) -> List[Tuple[int, str, bool]]:
+    """
+    Random ingredients for a recipe, some recipes having only optional ones
+    """
+    ingredient_ids = rng.sample(range(1, INGREDIENTS + 1), rng.randint(1, 6))
+    all_optional = rng.random() < 0.2
+    return [(ingredient_id, f'ingredient {ingredient_id}', not all_optional and rng.random() < 0.7)
+            for ingredient_id in ingredient_ids]
+
+
+class CookableCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(20210401)
+        self.recipes = {recipe_id: _links(self.rng) for recipe_id in range(1, 201)}
+        self.index = FixtureIndex(dict(self.recipes))
+        self.index.load(None)
+        self.cache = CookableCache(self.index, USERS)
+        # The ingredient ids of 0 can't be in a recipe, so pantries also hold ingredients the index doesn't know
+        self.pantries: Dict[int, Set[int]] = {user_id: set(self.rng.sample(range(0, INGREDIENTS + 1), 12))
+                                              for user_id in range(USERS)}
+        for user_id, pantry in self.pantries.items():
+            self.cache.store(user_id, pantry, self.cache.writes)
+
+    def assertMatchesIndex(self):
+        for user_id, pantry in self.pantries.items():
+            cookable = self.cache.get(user_id)
+            if cookable is None:
+                cookable = self.cache.store(user_id, pantry, self.cache.writes)
+            expected = self.index.match_all(f'ingredient {ingredient_id}' for ingredient_id in pantry)
+            self.assertEqual(expected, cookable, f'user {user_id}')
+
+    def test_deltas_match_match_all(self):
+        next_recipe_id = max(self.recipes) + 1
+        for _ in range(STEPS):
+            step = self.rng.random()
+            user_id = self.rng.randrange(USERS)
+            pantry = self.pantries[user_id]
+            if step < 0.3:
+                added = set(self.rng.sample(range(0, INGREDIENTS + 1), 3))
+                pantry |= added
+                self.cache.update_pantry(user_id, added, [])
+            elif step < 0.6:
+                removed = set(self.rng.sample(sorted(pantry), min(3, len(pantry))))
+                pantry -= removed
+                self.cache.update_pantry(user_id, [], removed)
+            elif step < 0.75:
+                links = _links(self.rng)
+                self.index.add_recipe(next_recipe_id, links)
+                self.cache.recipes_changed([next_recipe_id])
+                next_recipe_id += 1
+            elif step < 0.9:
+                recipe_id = self.rng.choice(sorted(self.index.required))
+                self.index.remove_recipe(recipe_id)
+                self.cache.recipes_changed([recipe_id])
+            else:
+                self.cache.forget_user(user_id)
+            self.assertMatchesIndex()
+
+    def test_reload_drops_users(self):
+        self.index.load(None)
+        self.assertIsNone(self.cache.get(0))
+        self.assertMatchesIndex()
+
+    def test_pantry_read_before_an_edit_is_not_kept(self):
+        self.cache.forget_user(0)
+        writes = self.cache.writes
+        self.cache.update_pantry(1, [1], [])
+        self.cache.store(0, self.pantries[0], writes)
+        self.assertIsNone(self.cache.get(0))
+
+    def test_least_recently_used_user_is_dropped(self):
+        self.cache.get(0)
+        self.cache.store(USERS, {1, 2, 3}, self.cache.writes)
+        self.assertIsNotNone(self.cache.get(0))
+        self.assertIsNone(self.cache.get(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
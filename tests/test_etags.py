@@ -0,0 +1,70 @@
+"""
+Checks the ETags of cached catalog responses: a matching If-None-Match gets a 304, and changing the catalog changes
+what is served. Run it from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_etags
+"""
+import unittest
+
+from kitchenLibrary.tests.catalog import add_recipes, add_user, send
+
+RECIPE = '/recipes/search/etag pancakes'
+
+
+class ETagTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        add_recipes({'etag pancakes': [('etag flour', 2.0, 'cup', True), ('etag syrup', 1.0, 'tbsp', False)]})
+        cls.editor = add_user('etag editor', 3)
+
+    def test_matching_etag_gets_304(self):
+        status, headers, body = send('POST', RECIPE)
+        self.assertEqual(status, 200)
+        self.assertTrue(body['success'], body['message'])
+        etag = headers['etag']
+        self.assertEqual(headers['cache-control'], 'no-cache')
+
+        for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            status, headers, body = send('POST', RECIPE, headers={'If-None-Match': if_none_match})
+            self.assertEqual(status, 304, if_none_match)
+            self.assertEqual(headers['etag'], etag)
+            self.assertIsNone(body)
+
+        status, headers, body = send('POST', RECIPE, headers={'If-None-Match': '"other"'})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['etag'], etag)
+        self.assertEqual(body['data']['recipe_info']['name'], 'etag pancakes')
+
+    def test_failures_are_not_cached(self):
+        status, headers, body = send('POST', '/recipes/search/etag waffles')
+        self.assertFalse(body['success'])
+        self.assertNotIn('etag', headers)
+
+        # Inserted behind the app's back, so only an uncached lookup finds it
+        add_recipes({'etag waffles': [('etag flour', 1.0, 'cup', True)]})
+        _, headers, body = send('POST', '/recipes/search/etag waffles')
+        self.assertTrue(body['success'], body['message'])
+        self.assertIn('etag', headers)
+
+    def test_catalog_changes_change_the_etag(self):
+        _, headers, before = send('GET', '/ingredients')
+        etag = headers['etag']
+        _, _, body = send('PUT', '/recipes', {'reference_id': self.editor},
+                          {'name': 'etag crepes', 'directions': 'Thin pancakes.',
+                           'ingredients': [{'name': 'etag milk', 'quantity': 1, 'unit': 'cup', 'required': True}]})
+        self.assertTrue(body['success'], body['message'])
+
+        status, headers, after = send('GET', '/ingredients', headers={'If-None-Match': etag})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(headers['etag'], etag)
+        self.assertNotIn('etag milk', before['data'])
+        self.assertIn('etag milk', after['data'])
+
+        _, _, body = send('DELETE', '/recipes/etag crepes', {'recipe_name': 'etag crepes', 'reference_id': self.editor})
+        self.assertTrue(body['success'], body['message'])
+        _, _, body = send('POST', '/recipes/search/etag crepes')
+        self.assertFalse(body['success'])
+
+
+if __name__ == '__main__':
+    unittest.main()
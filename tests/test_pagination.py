@@ -0,0 +1,59 @@
+"""
+Checks that following match_any's next_cursor visits every matching recipe once, in id order. Run it from the directory
+above the package:
+
+    python -m unittest kitchenLibrary.tests.test_pagination
+"""
+import random
+import unittest
+
+from kitchenLibrary.tests.catalog import add_recipes, send
+
+PAGE_SIZE = 7
+
+
+class MatchAnyPaginationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(20210402)
+        pantry = ['pagination butter', 'pagination flour']
+        others = [f'pagination spice {number}' for number in range(10)]
+        recipes = {}
+        for number in range(40):
+            ingredients = rng.sample(others, 3) + rng.sample(pantry, rng.randint(0, 2))
+            recipes[f'pagination recipe {number}'] = [(name, 1.0, 'cup', True) for name in ingredients]
+        recipe_ids = add_recipes(recipes)
+        cls.pantry = pantry
+        cls.expected = sorted(recipe_ids[name] for name, links in recipes.items()
+                              if any(ingredient in pantry for ingredient, _, _, _ in links))
+        cls.names = {recipe_id: name for name, recipe_id in recipe_ids.items()}
+
+    def test_pages_cover_every_match_once(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {'limit': PAGE_SIZE} if cursor is None else {'limit': PAGE_SIZE, 'cursor': cursor}
+            status, _, page = send('POST', '/recipes/match_any', params, self.pantry)
+            self.assertEqual(status, 200)
+            self.assertTrue(page['success'], page['message'])
+            self.assertLessEqual(len(page['data']), PAGE_SIZE)
+            seen.extend(recipe['recipe_info']['name'] for recipe in page['data'])
+            pages += 1
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+            self.assertEqual(len(page['data']), PAGE_SIZE)
+
+        self.assertEqual(seen, [self.names[recipe_id] for recipe_id in self.expected])
+        self.assertEqual(pages, -(-len(self.expected) // PAGE_SIZE))
+
+    def test_cursor_past_the_end(self):
+        _, _, page = send('POST', '/recipes/match_any', {'cursor': self.expected[-1]}, self.pantry)
+        self.assertTrue(page['success'], page['message'])
+        self.assertEqual(page['data'], [])
+        self.assertIsNone(page['next_cursor'])
+
+
+if __name__ == '__main__':
+    unittest.main()
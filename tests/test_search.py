@@ -0,0 +1,109 @@
+"""
+Checks that RecipeSearchIndex's early terminating search ranks recipes exactly like scoring every one of them. Run it
+from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_search
+"""
+import math
+import random
+import unittest
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from kitchenLibrary.app.search import B, K1, NAME_WEIGHT, RecipeSearchIndex, tokenize
+
+WORDS = [f'word{number}' for number in range(300)]
+
+
+class FixtureSearchIndex(RecipeSearchIndex):
+    """
+    Search index loaded from a dict instead of the database
+    """
+
+    def __init__(self, recipes: Dict[int, Tuple[str, str]]):
+        super().__init__()
+        self.recipes = recipes
+
+    def _build(self, db) -> RecipeSearchIndex:
+        fresh = RecipeSearchIndex()
+        for recipe_id, (name, directions) in self.recipes.items():
+            fresh._add(recipe_id, name, directions)
+        fresh._renormalize()
+        return fresh
+
+
+def _text(rng: random.Random, length: int) -> str:
+    """
+    Words drawn with a skew, so some are in most recipes and most are rare
+    """
+    return ' '.join(WORDS[min(int(rng.paretovariate(1.1)) - 1, len(WORDS) - 1)] for _ in range(length))
+
+
+def _bm25(recipes: Dict[int, Tuple[str, str]], query: str) -> List[Tuple[str, float]]:
+    """
+    Every recipe's BM25 score for the query, worked out from the texts, best first
+    """
+    frequencies = {}
+    for recipe_id, (name, directions) in recipes.items():
+        counts = Counter(tokenize(directions))
+        for token in tokenize(name):
+            counts[token] += NAME_WEIGHT
+        frequencies[recipe_id] = counts
+    average = sum(sum(counts.values()) for counts in frequencies.values()) / len(frequencies)
+    matches = Counter(token for counts in frequencies.values() for token in counts)
+    scores = []
+    for recipe_id, counts in frequencies.items():
+        score = 0.0
+        for token in set(tokenize(query)):
+            if not counts[token]:
+                continue
+            idf = math.log(1 + (len(recipes) - matches[token] + 0.5) / (matches[token] + 0.5))
+            norm = K1 * (1 - B + B * sum(counts.values()) / average)
+            score += idf * counts[token] * (K1 + 1) / (counts[token] + norm)
+        if score:
+            scores.append((score, -recipe_id))
+    return [(recipes[-negative_id][0], score) for score, negative_id in sorted(scores, reverse=True)]
+
+
+class EarlyTerminationTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(20210404)
+        self.recipes = {recipe_id: (f'recipe {recipe_id} {_text(self.rng, 3)}',
+                                    _text(self.rng, self.rng.randint(5, 60)))
+                        for recipe_id in range(1, 1501)}
+        self.index = FixtureSearchIndex(dict(self.recipes))
+        self.index.load(None)
+
+    def _query(self) -> str:
+        return _text(self.rng, self.rng.randint(1, 4))
+
+    def assertSameRanking(self, query: str, limit: int, offset: int):
+        everything = set(self.index.names)
+        expected = self.index.search(query, limit, offset, only=everything)
+        self.assertEqual(self.index.search(query, limit, offset), expected, query)
+
+    def test_matches_scoring_every_recipe(self):
+        for _ in range(300):
+            self.assertSameRanking(self._query(), self.rng.randint(1, 20), self.rng.choice((0, 0, 5, 40)))
+
+    def test_scores_are_bm25(self):
+        for _ in range(20):
+            query = self._query()
+            expected = _bm25(self.recipes, query)
+            results, more = self.index.search(query, 10)
+            self.assertEqual([name for name, _ in results], [name for name, _ in expected[:10]], query)
+            for (_, score), (_, expected_score) in zip(results, expected):
+                self.assertAlmostEqual(score, expected_score, places=9)
+            self.assertEqual(more, len(expected) > 10)
+
+    def test_matches_after_changes(self):
+        for recipe_id in range(1501, 1701):
+            self.index.add_recipe(recipe_id, f'recipe {recipe_id} {_text(self.rng, 3)}',
+                                  _text(self.rng, self.rng.randint(5, 200)))
+        self.index.remove_recipes(self.rng.sample(range(1, 1501), 300))
+        for _ in range(200):
+            self.assertSameRanking(self._query(), self.rng.randint(1, 20), self.rng.choice((0, 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
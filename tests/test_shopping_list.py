@@ -0,0 +1,57 @@
+"""
+Checks the shopping list adds up quantities across recipes and units, leaves out what is in the kitchen and only
+reports recipes that don't exist as not found. Run it from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_shopping_list
+"""
+import unittest
+
+from kitchenLibrary.tests.catalog import add_recipes, add_user, send
+from kitchenLibrary.app.models import get_engine
+from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.models.kitchen import Kitchen
+from kitchenLibrary.app.tokens import verify_token
+
+
+class ShoppingListTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        add_recipes({'shopping bread': [('shopping flour', 2.0, 'cups', True), ('shopping salt', 1.0, 'tsp', True),
+                                        ('shopping butter', 4.0, 'oz', False)],
+                     'shopping cake': [('shopping flour', 8.0, 'tbsp', True), ('shopping butter', 0.75, 'lb', True),
+                                       ('shopping eggs', 3.0, 'whole', True), ('shopping salt', 0.5, 'tsp', False)],
+                     'shopping toast': []})
+        cls.token = add_user('shopping user', 0)
+        with get_engine().begin() as conn:
+            salt = conn.execute(Ingredient.__table__.select().where(Ingredient.name == 'shopping salt')).first().id
+            conn.execute(Kitchen.__table__.insert().values(user_id=verify_token(cls.token).user_id,
+                                                           ingredient_id=salt))
+
+    def _shopping_list(self, recipes, servings=1.0) -> dict:
+        _, _, body = send('POST', '/shopping_list', body={'user_id': self.token, 'recipes': recipes,
+                                                           'servings': servings})
+        self.assertTrue(body['success'], body['message'])
+        return body['data']
+
+    def test_sums_across_recipes_and_units(self):
+        shopping = self._shopping_list(['Shopping Bread', 'shopping cake'])
+        items = {item['name']: (item['quantity'], item['unit'], item['required']) for item in shopping['items']}
+        self.assertEqual(items, {'shopping flour': (2.5, 'cup', True),  # 96 + 24 tsp
+                                 'shopping butter': (1.0, 'lb', True),  # 4 + 12 oz
+                                 'shopping eggs': (3.0, 'whole', True)})
+        self.assertEqual(shopping['in_kitchen'], ['shopping salt'])
+        self.assertEqual(shopping['recipes_not_found'], [])
+
+    def test_servings_scale_quantities(self):
+        items = {item['name']: (item['quantity'], item['unit'])
+                 for item in self._shopping_list(['shopping bread'], servings=0.25)['items']}
+        self.assertEqual(items, {'shopping flour': (8.0, 'tbsp'), 'shopping butter': (1.0, 'oz')})
+
+    def test_recipe_without_ingredients_is_found(self):
+        shopping = self._shopping_list(['shopping toast', 'shopping pie'])
+        self.assertEqual(shopping['items'], [])
+        self.assertEqual(shopping['recipes_not_found'], ['shopping pie'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Checks that SimilarityIndex finds the recipes most like another as well as comparing it with every recipe, and that a
+reload only hashes recipes whose ingredients changed. Run it from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_similarity
+"""
+import heapq
+import random
+import unittest
+from unittest import mock
+
+from kitchenLibrary.tests.catalog import add_recipes
+from kitchenLibrary.app.matching import RecipeIndex
+from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.models.ingredients import Ingredient
+from kitchenLibrary.app.models.recipe_ingredients import RecipeIngredient
+from kitchenLibrary.app.similarity import SimilarityIndex, jaccard
+
+# Recipes are variations of a few bases, so most have some close neighbours
+BASES = 40
+VARIATIONS = 15
+K = 10
+MIN_SIMILARITY = 0.5
+
+
+class SimilarityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(20210405)
+        ingredients = [f'lsh ingredient {number}' for number in range(400)]
+        recipes = {}
+        for base_number in range(BASES):
+            base = rng.sample(ingredients, rng.randint(6, 12))
+            for variation in range(VARIATIONS):
+                kept = [name for name in base if rng.random() < 0.85]
+                extra = rng.sample(ingredients, rng.randint(0, 3))
+                recipes[f'lsh recipe {base_number} {variation}'] = [(name, 1.0, 'cup', rng.random() < 0.7)
+                                                                    for name in set(kept + extra)]
+        cls.recipe_ids = sorted(add_recipes(recipes).values())
+
+    def setUp(self):
+        self.db = get_session()
+        self.recipe_index = RecipeIndex()
+        self.recipe_index.load(self.db)
+        self.index = SimilarityIndex(self.recipe_index, path=None)
+        self.index.load(self.db)
+
+    def tearDown(self):
+        self.db.close()
+
+    def _exhaustive(self, recipe_id: int):
+        """
+        The K most similar recipes by comparing with every recipe in the index
+        """
+        target = self.index._ingredients(recipe_id)
+        scored = [(jaccard(target, self.index._ingredients(other)), -other)
+                  for other in self.recipe_index.required if other != recipe_id]
+        return [(-negative_id, score) for score, negative_id in heapq.nlargest(K, scored)]
+
+    def test_recall_of_similar_recipes(self):
+        found = wanted = 0
+        for recipe_id in self.recipe_ids[::7]:
+            expected = {other for other, score in self._exhaustive(recipe_id) if score >= MIN_SIMILARITY}
+            results = self.index.similar(recipe_id, K)
+            for other, score in results:
+                self.assertAlmostEqual(score, jaccard(self.index._ingredients(recipe_id),
+                                                      self.index._ingredients(other)))
+            found += len(expected & {other for other, _ in results})
+            wanted += len(expected)
+        self.assertGreater(wanted, 100)
+        self.assertGreaterEqual(found / wanted, 0.9)
+
+    def test_reload_only_hashes_changed_recipes(self):
+        changed = self.recipe_ids[3]
+        before = {recipe_id: self.index.similar(recipe_id, K) for recipe_id in self.recipe_ids[::25]}
+
+        # Another worker gives the recipe other ingredients without this one hearing of it
+        new_ingredients = [ingredient_id for ingredient_id, in self.db.query(Ingredient.id)
+                           .filter(Ingredient.name.in_(['lsh ingredient 1', 'lsh ingredient 2'])).all()]
+        self.db.query(RecipeIngredient).filter(RecipeIngredient.recipe_id == changed).delete()
+        self.db.add_all([RecipeIngredient(recipe_id=changed, ingredient_id=ingredient_id, quantity=1, unit='cup',
+                                          required=True) for ingredient_id in new_ingredients])
+        self.db.commit()
+        self.recipe_index.load(self.db)
+        signature = SimilarityIndex._signature
+        with mock.patch.object(SimilarityIndex, '_signature', autospec=True, side_effect=signature) as hashing:
+            self.index.load(self.db)
+        self.assertEqual([call.args[1] for call in hashing.call_args_list], [set(new_ingredients)])
+
+        slot = self.index.slots[changed]
+        self.assertEqual(self.index.signatures[slot * self.index.size:(slot + 1) * self.index.size],
+                         self.index._signature(new_ingredients))
+        for recipe_id, similar in before.items():
+            if recipe_id != changed and all(other != changed for other, _ in similar):
+                self.assertEqual(self.index.similar(recipe_id, K), similar)
+
+
+if __name__ == '__main__':
+    unittest.main()
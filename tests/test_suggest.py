@@ -0,0 +1,101 @@
+"""
+Checks that IngredientSuggester finds names despite typos and gives the same suggestions as scoring every name. Run it
+from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_suggest
+"""
+import heapq
+import random
+import string
+import unittest
+from typing import List
+
+from kitchenLibrary.app.suggest import MIN_SIMILARITY, IngredientSuggester, trigrams
+
+NAMES = ['basil', 'black pepper', 'brown sugar', 'butter', 'buttermilk', 'cheddar cheese', 'cheese', 'chicken breast',
+         'chicken stock', 'cinnamon', 'garlic', 'ginger', 'green onion', 'lemon juice', 'milk', 'olive oil', 'onion',
+         'parmesan cheese', 'red onion', 'salt', 'sugar', 'tomato', 'tomato paste', 'vanilla extract']
+
+
+class FixtureSuggester(IngredientSuggester):
+    """
+    Suggester loaded from a list instead of the database
+    """
+
+    def __init__(self, names: List[str]):
+        super().__init__()
+        self.fixture = names
+
+    def _build(self, db) -> IngredientSuggester:
+        fresh = IngredientSuggester()
+        fresh._add(self.fixture)
+        return fresh
+
+
+def _exhaustive(names: List[str], query: str, k: int) -> List[str]:
+    """
+    suggest() worked out by comparing the query with every name
+    """
+    query = query.strip().lower()
+    prefixed = sorted(name for name in names if name.startswith(query))[:k]
+    query_grams = trigrams(query)
+    scored = []
+    for name in names:
+        grams = trigrams(name)
+        similarity = len(query_grams & grams) / len(query_grams | grams)
+        if similarity >= MIN_SIMILARITY:
+            scored.append((similarity, name))
+    fuzzy = [name for _, name in heapq.nlargest(k, scored) if name not in prefixed]
+    return (prefixed + fuzzy)[:k]
+
+
+def _typo(rng: random.Random, name: str) -> str:
+    """
+    The name with one letter dropped, doubled, swapped with the next or replaced
+    """
+    position = rng.randrange(len(name) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:position] + name[position + 1:]
+    if kind == 1:
+        return name[:position] + name[position] + name[position:]
+    if kind == 2:
+        return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+    return name[:position] + rng.choice(string.ascii_lowercase) + name[position + 1:]
+
+
+class SuggestTest(unittest.TestCase):
+    def setUp(self):
+        self.suggester = FixtureSuggester(list(NAMES))
+        self.suggester.load(None)
+
+    def test_typos(self):
+        for query, expected in (('chese', 'cheese'), ('tomatoe', 'tomato'), ('garlick', 'garlic'),
+                                ('cinamon', 'cinnamon'), ('buter', 'butter'), ('Basl', 'basil')):
+            self.assertEqual(self.suggester.suggest(query, 1), [expected], query)
+
+    def test_prefixes_come_first_in_order(self):
+        self.assertEqual(self.suggester.suggest('chicken', 5)[:2], ['chicken breast', 'chicken stock'])
+        self.assertEqual(self.suggester.suggest('but', 2), ['butter', 'buttermilk'])
+        self.assertEqual(self.suggester.suggest('  ', 5), [])
+
+    def test_matches_exhaustive_scoring(self):
+        rng = random.Random(20210403)
+        for _ in range(500):
+            query = _typo(rng, rng.choice(NAMES))
+            if rng.random() < 0.3:
+                query = query[:rng.randint(1, len(query))]
+            k = rng.randint(1, 8)
+            self.assertEqual(self.suggester.suggest(query, k), _exhaustive(NAMES, query, k), (query, k))
+
+    def test_added_and_removed_names(self):
+        self.suggester.add(['cheese curds'])
+        self.suggester.remove(['cheddar cheese'])
+        names = [name for name in NAMES if name != 'cheddar cheese'] + ['cheese curds']
+        self.assertEqual(self.suggester.suggest('chese curd', 1), ['cheese curds'])
+        for query in ('chedar', 'chese', 'cheese', 'parmesan chese'):
+            self.assertEqual(self.suggester.suggest(query, 5), _exhaustive(names, query, 5), query)
+
+
+if __name__ == '__main__':
+    unittest.main()
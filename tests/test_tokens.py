@@ -0,0 +1,149 @@
+"""
+Checks issuing access tokens, their expiry and revocation, both by the worker that revoked them and through the users
+table other workers read. Run it from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_tokens
+"""
+import time
+import unittest
+
+from kitchenLibrary.tests.catalog import send
+from kitchenLibrary.app import tokens
+from kitchenLibrary.app.models import get_session
+from kitchenLibrary.app.models.user import User
+from kitchenLibrary.app.tokens import TokenExpired, is_revoked, issue_token, now_ms, revoke_user, verify_token
+from kitchenLibrary.app.util import verify_user_token
+
+
+def _later() -> None:
+    """
+    Waits for the millisecond clock to move, so tokens issued before and after a revocation are told apart
+    """
+    start = now_ms()
+    while now_ms() == start:
+        time.sleep(0.001)
+
+
+class TokenTest(unittest.TestCase):
+    def tearDown(self):
+        with tokens._revoked_lock:
+            tokens._revoked_before.clear()
+
+    def test_issued_token_verifies(self):
+        claims = verify_token(issue_token(41, 5))
+        self.assertEqual((claims.user_id, claims.permissions), (41, 5))
+        self.assertGreater(claims.expires, time.time())
+
+    def test_tampered_token_is_rejected(self):
+        version, payload, signature = issue_token(41, 1).split('.')
+        forged = issue_token(41, 7).split('.')[1]
+        self.assertIsNone(verify_token(f'{version}.{forged}.{signature}'))
+        self.assertIsNone(verify_token(f'{version}.{payload}.{signature[:-2]}'))
+        self.assertIsNone(verify_token('not a token'))
+
+    def test_expired_token_raises(self):
+        ttl = tokens.TOKEN_TTL
+        tokens.TOKEN_TTL = -1
+        try:
+            token = issue_token(41, 1)
+        finally:
+            tokens.TOKEN_TTL = ttl
+        with self.assertRaises(TokenExpired):
+            verify_token(token)
+
+    def test_revocation_rejects_older_tokens(self):
+        old = verify_token(issue_token(42, 1))
+        self.assertIsNone(is_revoked(old))
+        _later()
+        revoke_user(42)
+        _later()
+        new = verify_token(issue_token(42, 1))
+        self.assertTrue(is_revoked(old))
+        self.assertFalse(is_revoked(new))
+
+    def test_cached_revocation_expires(self):
+        claims = verify_token(issue_token(43, 1))
+        cache_ttl = tokens.REVOCATION_CACHE_TTL
+        tokens.REVOCATION_CACHE_TTL = -1
+        try:
+            revoke_user(43)
+        finally:
+            tokens.REVOCATION_CACHE_TTL = cache_ttl
+        self.assertIsNone(is_revoked(claims))
+
+
+class SharedRevocationTest(unittest.TestCase):
+    """
+    Revocations another worker made, which this one only sees in the users table
+    """
+
+    def setUp(self):
+        _, _, body = send('PUT', '/users/token test user', {'password': 'first password'})
+        self.assertTrue(body['success'], body['message'])
+        db = get_session()
+        try:
+            self.user_id = db.query(User.id).filter(User.name == 'token test user').scalar()
+        finally:
+            db.close()
+
+    def tearDown(self):
+        db = get_session()
+        try:
+            db.query(User).filter(User.id == self.user_id).delete()
+            db.commit()
+        finally:
+            db.close()
+        with tokens._revoked_lock:
+            tokens._revoked_before.clear()
+
+    def _verify(self, token: str):
+        db = get_session()
+        try:
+            return verify_user_token(db, token)
+        finally:
+            db.close()
+
+    def test_revocation_in_the_users_table(self):
+        token = issue_token(self.user_id, 0)
+        self.assertIsNotNone(self._verify(token))
+
+        _later()
+        db = get_session()
+        try:
+            db.query(User).filter(User.id == self.user_id).update({User.tokens_revoked_at: now_ms()})
+            db.commit()
+        finally:
+            db.close()
+        # This worker still trusts what it read until the cached copy expires
+        self.assertIsNotNone(self._verify(token))
+        with tokens._revoked_lock:
+            tokens._revoked_before.clear()
+        self.assertIsNone(self._verify(token))
+
+        _later()
+        self.assertIsNotNone(self._verify(issue_token(self.user_id, 0)))
+
+    def test_password_change_revokes_tokens(self):
+        _, _, body = send('POST', '/users/signIn/token test user', {'password': 'first password'})
+        token = body['data']
+        _later()
+        _, _, body = send('PUT', f'/users/updatePassword/{token}', {'password': 'second password'})
+        self.assertTrue(body['success'], body['message'])
+        self.assertIsNone(self._verify(token))
+        with tokens._revoked_lock:
+            tokens._revoked_before.clear()
+        self.assertIsNone(self._verify(token))
+
+    def test_deleted_user_tokens_are_rejected(self):
+        token = issue_token(self.user_id, 0)
+        db = get_session()
+        try:
+            db.query(User).filter(User.id == self.user_id).delete()
+            db.commit()
+        finally:
+            db.close()
+        self.assertIsNone(self._verify(token))
+
+
+if __name__ == '__main__':
+    unittest.main()
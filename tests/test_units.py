@@ -0,0 +1,54 @@
+"""
+Checks converting recipe quantities to a base unit and back. Run it from the directory above the package:
+
+    python -m unittest kitchenLibrary.tests.test_units
+"""
+import random
+import unittest
+
+from kitchenLibrary.app.units import CONVERSIONS, DISPLAY_UNITS, from_base, to_base
+
+
+class UnitsTest(unittest.TestCase):
+    def test_to_base(self):
+        self.assertEqual(to_base(2, 'cups'), ('volume', 96))
+        self.assertEqual(to_base(1, ' Tbsp '), ('volume', 3))
+        self.assertEqual(to_base(1.5, 'lb'), ('weight', 24))
+        self.assertEqual(to_base(3, 'pinch'), ('pinch', 3))
+        self.assertEqual(to_base(2, None), ('', 2))
+
+    def test_compatible_units_add_up(self):
+        total = sum(to_base(quantity, unit)[1] for quantity, unit in ((1, 'cup'), (4, 'tbsp'), (12, 'tsp')))
+        self.assertEqual(from_base('volume', total), (1.5, 'cup'))
+        total = sum(to_base(quantity, unit)[1] for quantity, unit in ((12, 'oz'), (0.25, 'pound')))
+        self.assertEqual(from_base('weight', total), (1.0, 'lb'))
+
+    def test_metric_units(self):
+        kind, quantity = to_base(1, 'l')
+        self.assertEqual(kind, 'volume')
+        self.assertEqual(from_base(kind, quantity), (4.227, 'cup'))
+        kind, quantity = to_base(1, 'kg')
+        self.assertEqual(from_base(kind, quantity), (2.205, 'lb'))
+        self.assertEqual(from_base(*to_base(5, 'ml')), (1.014, 'tsp'))
+
+    def test_largest_display_unit_that_fits(self):
+        self.assertEqual(from_base('volume', 47), (15.667, 'tbsp'))
+        self.assertEqual(from_base('volume', 2), (2, 'tsp'))
+        self.assertEqual(from_base('volume', 0.5), (0.5, 'tsp'))
+        self.assertEqual(from_base('weight', 15), (15, 'oz'))
+        self.assertEqual(from_base('pinch', 3), (3, 'pinch'))
+
+    def test_round_trip(self):
+        rng = random.Random(20210406)
+        for _ in range(1000):
+            unit = rng.choice(sorted(CONVERSIONS))
+            quantity = rng.uniform(0.1, 50)
+            kind, base_quantity = to_base(quantity, unit)
+            shown, shown_unit = from_base(kind, base_quantity)
+            self.assertIn(shown_unit, DISPLAY_UNITS[kind])
+            self.assertAlmostEqual(to_base(shown, shown_unit)[1], base_quantity,
+                                   delta=0.0005 * CONVERSIONS[shown_unit][1])
+
+
+if __name__ == '__main__':
+    unittest.main()